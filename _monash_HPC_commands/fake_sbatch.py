@@ -0,0 +1,68 @@
+import os
+import re
+import sys
+import time
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# Local stand-in for sbatch, for testing job scripts (e.g. the sweeps of scripts/training/submit_sweep.py) without SLURM:
+#   python _monash_HPC_commands/fake_sbatch.py [--parsable] [--array=0-3] job.sh
+# Runs every array task of the script with bash, with the SLURM_* variables a real job would see, then prints the job id.
+# Unlike sbatch it blocks until all tasks have finished.
+# FAKE_SBATCH_NODES:    Number of simulated nodes (default 1). Task i runs on node i % nodes, each node with its own $TMPDIR.
+# FAKE_SBATCH_PARALLEL: Number of tasks run at once (default 2), so tasks share a node's staged data as they would on a cluster.
+
+def parse_options(args, script_lines):
+    # Command line options override the #SBATCH lines of the script, as with sbatch
+    options = {}
+    for line in script_lines:
+        match = re.match(r"#SBATCH\s+--([\w-]+)=(\S+)", line)
+        if match:
+            options[match.group(1)] = match.group(2)
+    for arg in args:
+        match = re.match(r"--([\w-]+)=(\S+)", arg)
+        if match:
+            options[match.group(1)] = match.group(2)
+    return options
+
+def array_indices(array):
+    # "0-3", "0-9%2" or "1,4,7"
+    indices = []
+    for part in array.split('%')[0].split(','):
+        first, _, last = part.partition('-')
+        indices.extend(range(int(first), int(last or first) + 1))
+    return indices
+
+def run_task(script_path, options, job_id, task_id, node, nodes_dir):
+    node_tmp = os.path.join(nodes_dir, f"node{node}")
+    os.makedirs(node_tmp, exist_ok=True)
+    env = dict(
+        os.environ, TMPDIR=node_tmp, SLURM_JOB_ID=str(job_id + task_id), SLURM_ARRAY_JOB_ID=str(job_id),
+        SLURM_ARRAY_TASK_ID=str(task_id), SLURM_CPUS_PER_TASK=options.get('cpus-per-task', '1'), SLURMD_NODENAME=f"node{node}"
+    )
+    output = options.get('output', f"slurm-{job_id}_{task_id}.out").replace('%A', str(job_id)).replace('%a', str(task_id)).replace('%j', str(job_id + task_id))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        return subprocess.run(["bash", script_path], env=env, stdout=f, stderr=subprocess.STDOUT).returncode
+
+def main(args):
+    script_path = args[-1]
+    with open(script_path) as f:
+        options = parse_options(args[:-1], f.read().splitlines())
+
+    job_id = int(time.time()) % 1000000 * 1000
+    indices = array_indices(options['array']) if 'array' in options else [0]
+    num_nodes = int(os.environ.get('FAKE_SBATCH_NODES', 1))
+    nodes_dir = os.environ.get('FAKE_SBATCH_NODES_DIR') or tempfile.mkdtemp(prefix='fake_slurm_')
+
+    with ThreadPoolExecutor(int(os.environ.get('FAKE_SBATCH_PARALLEL', 2))) as pool:
+        return_codes = list(pool.map(lambda task_id: run_task(script_path, options, job_id, task_id, task_id % num_nodes, nodes_dir), indices))
+
+    failed = [task_id for task_id, code in zip(indices, return_codes) if code != 0]
+    if failed:
+        print(f"fake_sbatch: tasks {failed} of job {job_id} failed", file=sys.stderr)
+    print(job_id if '--parsable' in args else f"Submitted batch job {job_id}")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
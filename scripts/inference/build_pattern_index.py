@@ -0,0 +1,39 @@
+import torch
+
+# Config
+import scripts.inference.config_inference as config_inference
+
+# Functions
+from src.data_loading.simXRD_data_loader import create_inference_data_loader
+from src.inference.load_model import load_model
+from src.inference.pattern_search import PatternSearchIndex, export_embeddings, read_formulas, query_patterns
+
+# Embeds SEARCH_DATABASE with a trained model, builds the nearest-neighbour index and saves it to SEARCH_INDEX_PATH.
+# Then runs a few patterns from INFERENCE_DATA through it as an example.
+
+def main():
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = load_model(config_inference.MODEL_TYPE, config_inference.MODEL_PATH, device)
+
+    # Embed the database
+    search_loader = create_inference_data_loader(config_inference.SEARCH_DATABASE, config_inference.BATCH_SIZE, config_inference.NUM_WORKERS)
+    embeddings, space_groups = export_embeddings(model, config_inference.MODEL_TYPE, search_loader, device)
+    formulas = read_formulas(config_inference.SEARCH_DATABASE)
+
+    # Build and save the index
+    index = PatternSearchIndex(embeddings, formulas, space_groups, num_lists=config_inference.SEARCH_NUM_LISTS, num_probe=config_inference.SEARCH_NUM_PROBE)
+    index.save(config_inference.SEARCH_INDEX_PATH)
+    print(f"Pattern index with {len(index)} entries saved to '{config_inference.SEARCH_INDEX_PATH}'")
+
+    # Example queries
+    query_loader = create_inference_data_loader(config_inference.INFERENCE_DATA, 8, 0)
+    intensities, spg, *_ = next(iter(query_loader))
+    results = query_patterns(model, config_inference.MODEL_TYPE, index, intensities, device, k=config_inference.SEARCH_TOP_K)
+
+    for true_spg, matches in zip(spg.numpy() + 1, results):
+        print(f"\nQuery (true spg {true_spg}):")
+        for match in matches:
+            print(f"  {match['formula']} (spg {match['spg']}), similarity {match['similarity']:.3f}")
+
+if __name__ == "__main__":
+    main()
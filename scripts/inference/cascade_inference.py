@@ -0,0 +1,59 @@
+import json
+import time
+import numpy as np
+import torch
+
+# Config
+import scripts.inference.config_inference as config_inference
+
+# Functions
+from scripts.inference.ensemble_inference import load_data
+from src.inference.cascade import CascadePredictor, calibrate_thresholds
+from src.inference.predictor import TorchPredictor
+from src.inference.load_model import load_model
+
+# Cascaded inference over CASCADE_MODELS (cheapest first):
+# calibrates the exit thresholds on VAL_DATA so spg accuracy stays at the last model's (within CASCADE_MAX_ACCURACY_DROP),
+# saves them to CASCADE_THRESHOLDS_PATH, then predicts INFERENCE_DATA with the cascade and with the last model alone,
+# and reports accuracy, throughput and where the patterns exited.
+
+def timed_predict(predictor, intensities):
+    start = time.perf_counter()
+    outputs = predictor.predict(intensities)
+    return outputs, len(intensities) / (time.perf_counter() - start)
+
+def main():
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    models = [load_model(model_type, model_path, device) for model_type, model_path in config_inference.CASCADE_MODELS]
+    names = [model_type for model_type, _ in config_inference.CASCADE_MODELS]
+
+    # Calibrate on every stage's outputs for all of the val set
+    val_intensities, val_labels = load_data(config_inference.VAL_DATA)
+    val_logits = [TorchPredictor(model, device, config_inference.BATCH_SIZE).predict(val_intensities) for model in models]
+    thresholds = calibrate_thresholds(
+        val_logits, val_labels['spg'], 'spg', config_inference.CASCADE_CONFIDENCE_TASKS, config_inference.CASCADE_MAX_ACCURACY_DROP
+    )
+    for name, threshold in zip(names, thresholds):
+        print(f"{name}: exits at confidence >= {threshold:.4f}")
+    with open(config_inference.CASCADE_THRESHOLDS_PATH, 'w') as f:
+        json.dump({'models': config_inference.CASCADE_MODELS, 'confidence_tasks': list(config_inference.CASCADE_CONFIDENCE_TASKS), 'thresholds': thresholds}, f, indent=2)
+
+    # Cascade vs the last model alone
+    intensities, labels = load_data(config_inference.INFERENCE_DATA)
+    cascade = CascadePredictor(models, thresholds, device, config_inference.BATCH_SIZE, config_inference.CASCADE_CONFIDENCE_TASKS)
+    cascade_logits, cascade_speed = timed_predict(cascade, intensities)
+    full_logits, full_speed = timed_predict(TorchPredictor(models[-1], device, config_inference.BATCH_SIZE), intensities)
+
+    for task in cascade.tasks:
+        if task not in labels:
+            continue
+        cascade_accuracy = 100. * np.mean(cascade_logits[task].argmax(axis=1) == labels[task])
+        full_accuracy = 100. * np.mean(full_logits[task].argmax(axis=1) == labels[task])
+        print(f"{task}: cascade accuracy {cascade_accuracy:.2f}%, {names[-1]} alone {full_accuracy:.2f}%")
+
+    exit_fractions = np.bincount(cascade.last_exits, minlength=len(models)) / len(intensities)
+    print("Exits: " + ", ".join(f"{name} {100 * fraction:.1f}%" for name, fraction in zip(names, exit_fractions)))
+    print(f"Throughput: cascade {cascade_speed:.1f} patterns/s, {names[-1]} alone {full_speed:.1f} patterns/s ({cascade_speed / full_speed:.2f}x)")
+
+if __name__ == "__main__":
+    main()
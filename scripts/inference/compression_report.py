@@ -0,0 +1,66 @@
+import os
+import time
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+# Config
+import scripts.inference.config_inference as config_inference
+import scripts.training.config_training as config_training
+
+# Functions
+from src.data_loading.simXRD_data_loader import create_inference_data_loader
+from src.data_loading.intensity_store import load_intensity_store
+from src.data_loading.compressed_store import load_compressed_store, CompressedXRDDataset
+from src.inference.load_model import load_model
+from src.training.train_multitask import evaluate_multi_task
+
+# Compares the compressed intensity stores (REPORT_CODECS) with the float32 patterns of VAL_DATA:
+# size on disk, reconstruction error, batched read throughput, and the multi-task metrics of MODEL_PATH on the decoded patterns.
+
+REPORTED_METRICS = ['spg_accuracy', 'spg_top5_accuracy', 'crysystem_accuracy', 'blt_accuracy', 'composition_f1']
+
+def read_throughput(store, batch_size, num_batches=50):
+    # Patterns per second for batches of shard-local shuffled indices (as ShardShuffleSampler produces)
+    rng = np.random.default_rng(0)
+    start = time.perf_counter()
+    for _ in range(num_batches):
+        shard = rng.integers(0, (len(store) + store.shard_size - 1) // store.shard_size)
+        rows = np.arange(shard * store.shard_size, min((shard + 1) * store.shard_size, len(store)))
+        store.get(rng.choice(rows, min(batch_size, len(rows)), replace=False))
+    return num_batches * batch_size / (time.perf_counter() - start)
+
+def main():
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = load_model(config_inference.MODEL_TYPE, config_inference.MODEL_PATH, device)
+    criterion = config_training.MULTI_TASK_CRITERIA
+
+    val_path = config_inference.VAL_DATA
+    float_store = load_intensity_store(val_path)
+    val_loader = create_inference_data_loader(val_path, config_inference.BATCH_SIZE, config_inference.NUM_WORKERS)
+    base_metrics = evaluate_multi_task(model, val_loader, criterion, device)
+
+    print(f"\n=== {os.path.basename(val_path)}: {len(float_store)} patterns ===")
+    print(f"ASE database: {os.path.getsize(val_path) / 1e6:.1f} MB, float32 store: {os.path.getsize(float_store.filename) / 1e6:.1f} MB")
+    print("float32: " + ", ".join(f"{name} {base_metrics[name]:.2f}" for name in REPORTED_METRICS if name in base_metrics))
+
+    for codec in config_inference.REPORT_CODECS:
+        store = load_compressed_store(val_path, codec)
+        max_error, total_error = 0.0, 0.0
+        for start in range(0, len(store), store.shard_size):
+            indices = np.arange(start, min(start + store.shard_size, len(store)))
+            error = np.abs(store.get(indices) - float_store[indices])
+            max_error = max(max_error, float(error.max()))
+            total_error += float(error.sum(dtype=np.float64))
+
+        dataset = CompressedXRDDataset(val_path, codec)
+        loader = DataLoader(dataset, batch_size=config_inference.BATCH_SIZE, shuffle=False, num_workers=config_inference.NUM_WORKERS)
+        metrics = evaluate_multi_task(model, loader, criterion, device)
+
+        print(f"\n{codec}: {os.path.getsize(store.store_path) / 1e6:.1f} MB ({os.path.getsize(float_store.filename) / os.path.getsize(store.store_path):.1f}x smaller than float32)")
+        print(f"  Abs error (patterns normalised to 100): max {max_error:.4f}, mean {total_error / float_store.size:.6f}")
+        print(f"  Read + decode: {read_throughput(store, config_inference.BATCH_SIZE):,.0f} patterns/s")
+        print("  " + ", ".join(f"{name} {metrics[name]:.2f} ({metrics[name] - base_metrics[name]:+.2f})" for name in REPORTED_METRICS if name in metrics))
+
+if __name__ == "__main__":
+    main()
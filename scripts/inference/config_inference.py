@@ -0,0 +1,58 @@
+import os
+
+# Paths
+DATA_DIR = 'training_data/simXRD_partial_data'
+MODEL_SAVE_DIR = 'trained_models'
+
+# Model (MODEL_TYPE is any key of MODEL_CLASS in config_training.py)
+MODEL_TYPE = "smallFCN_MultiTask"
+MODEL_PATH = os.path.join(MODEL_SAVE_DIR, "smallFCN_MultiTask_spg_acc_94.65_20240728_235958.pth")
+
+# Data
+INFERENCE_DATA = os.path.join(DATA_DIR, 'test.db')
+
+# Data Loading Settings
+BATCH_SIZE = 256
+NUM_WORKERS = 6
+
+# Pattern search
+SEARCH_DATABASE = os.path.join(DATA_DIR, 'train.db')                  # The database of known phases to search through
+SEARCH_INDEX_PATH = os.path.join(MODEL_SAVE_DIR, 'pattern_index.npz')
+SEARCH_NUM_LISTS = None     # Number of IVF lists. None = ~4 * sqrt(database size). 1 = exact search.
+SEARCH_NUM_PROBE = 8        # Lists scored per query. Higher = better recall, slower.
+SEARCH_TOP_K = 5
+
+# Quantized CPU inference
+VAL_DATA = os.path.join(DATA_DIR, 'val.db')                            # Calibration and accuracy report data
+QUANTIZATION_MODE = "dynamic"       # Options: "dynamic" (int8 Linear layers), "static" (FX int8 Conv1d + Linear, needs calibration)
+QUANTIZATION_BACKEND = "x86"        # Options: "x86", "fbgemm", "qnnpack" (ARM)
+CALIBRATION_BATCHES = 32            # Number of BATCH_SIZE batches of VAL_DATA used for static calibration
+REPORT_BATCHES = None               # Number of batches of VAL_DATA in the fp32 vs int8 report. None = all of it.
+QUANTIZED_MODEL_PATH = os.path.join(MODEL_SAVE_DIR, f"{MODEL_TYPE}_{QUANTIZATION_MODE}_int8.pth")
+
+# ONNX export
+ONNX_MODEL_PATH = os.path.join(MODEL_SAVE_DIR, f"{MODEL_TYPE}.onnx")
+ONNX_NUM_THREADS = None             # ONNX Runtime intra-op threads. None = all cores.
+
+# Ensemble and test-time augmentation (TTA)
+ENSEMBLE_MODELS = [                 # (MODEL_TYPE, path) of every checkpoint in the ensemble
+    (MODEL_TYPE, MODEL_PATH),
+]
+TTA_SHIFTS = (-2, 0, 2)             # Pattern shifts in points (zero offset errors)
+TTA_STRETCHES = (0.998, 1.0, 1.002) # Pattern axis stretches (lattice strain)
+ENSEMBLE_OUTPUT_PATH = os.path.join(MODEL_SAVE_DIR, "ensemble_probabilities.npz")
+
+# Consistent decoding (spg / crysystem / blt predictions that agree with each other)
+CONSISTENT_TOP_K = 5                # Number of jointly consistent (spg, crysystem, blt) candidates kept per pattern
+
+# Compressed intensity storage report (scripts/inference/compression_report.py)
+REPORT_CODECS = ["uint16", "uint8_log"]   # Codecs of src/data_loading/compressed_store.py compared against the float32 patterns of VAL_DATA
+
+# Cascaded inference (scripts/inference/cascade_inference.py). Cheap models answer confident patterns, the rest go on to the next model.
+CASCADE_MODELS = [                  # (MODEL_TYPE, path), cheapest first. The last model answers whatever is left.
+    ("smallCNN10_MultiTask", os.path.join(MODEL_SAVE_DIR, "smallCNN10_MultiTask.pth")),
+    ("CNN11_MultiTask", os.path.join(MODEL_SAVE_DIR, "CNN11_MultiTask.pth")),
+]
+CASCADE_CONFIDENCE_TASKS = ("spg", "crysystem")   # A pattern exits early only if all of these heads are confident
+CASCADE_MAX_ACCURACY_DROP = 0.0     # Allowed val spg accuracy drop (percentage points) below the last model alone when calibrating the thresholds
+CASCADE_THRESHOLDS_PATH = os.path.join(MODEL_SAVE_DIR, "cascade_thresholds.json")
@@ -0,0 +1,76 @@
+import numpy as np
+import torch
+
+# Config
+import scripts.inference.config_inference as config_inference
+
+# Functions
+from src.data_loading.simXRD_data_loader import create_inference_data_loader
+from src.inference.ensemble import EnsemblePredictor
+from src.inference.consistent_decoding import decode_predictions
+from src.inference.load_model import load_model
+
+# Ensembles the checkpoints in ENSEMBLE_MODELS with test-time augmentation:
+# fits the per-task temperatures on CALIBRATION_BATCHES of VAL_DATA, predicts INFERENCE_DATA batch by batch
+# (only the averaged probabilities are kept, not every member's logits or the patterns),
+# reports accuracy / NLL and saves the averaged probabilities (and the top CONSISTENT_TOP_K consistent predictions) to ENSEMBLE_OUTPUT_PATH.
+
+TASK_LABELS = {'spg': 1, 'crysystem': 2, 'blt': 3}   # Position of each label in a data loader batch
+
+def load_data(data_path, num_batches=None):
+    loader = create_inference_data_loader(data_path, config_inference.BATCH_SIZE, config_inference.NUM_WORKERS)
+    intensities, labels = [], {task: [] for task in TASK_LABELS}
+    for batch_idx, batch in enumerate(loader):
+        if num_batches is not None and batch_idx >= num_batches:
+            break
+        intensities.append(batch[0].numpy())
+        for task, position in TASK_LABELS.items():
+            labels[task].append(batch[position].numpy())
+    return np.concatenate(intensities), {task: np.concatenate(values) for task, values in labels.items()}
+
+def main():
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    models = [load_model(model_type, model_path, device) for model_type, model_path in config_inference.ENSEMBLE_MODELS]
+    predictor = EnsemblePredictor(
+        models, device, config_inference.BATCH_SIZE, config_inference.TTA_SHIFTS, config_inference.TTA_STRETCHES
+    )
+
+    # Calibrate
+    val_intensities, val_labels = load_data(config_inference.VAL_DATA, config_inference.CALIBRATION_BATCHES)
+    temperatures = predictor.fit_temperatures(val_intensities, val_labels)
+    print("Fitted temperatures: " + ", ".join(f"{task}: {t:.3f}" for task, t in temperatures.items()))
+
+    # Predict
+    loader = create_inference_data_loader(config_inference.INFERENCE_DATA, config_inference.BATCH_SIZE, config_inference.NUM_WORKERS)
+    probabilities, labels = {}, {task: [] for task in TASK_LABELS}
+    for batch in loader:
+        for task, task_probabilities in predictor.predict(batch[0].numpy()).items():
+            probabilities.setdefault(task, []).append(task_probabilities)
+        for task, position in TASK_LABELS.items():
+            labels[task].append(batch[position].numpy())
+    probabilities = {task: np.concatenate(values) for task, values in probabilities.items()}
+    labels = {task: np.concatenate(values) for task, values in labels.items()}
+
+    for task, task_probabilities in probabilities.items():
+        if task not in labels:
+            continue
+        accuracy = 100. * np.mean(task_probabilities.argmax(axis=1) == labels[task])
+        nll = -np.mean(np.log(np.clip(task_probabilities[np.arange(len(labels[task])), labels[task]], 1e-12, None)))
+        print(f"{task}: accuracy {accuracy:.2f}%, NLL {nll:.4f}")
+
+    # Jointly consistent spg / crysystem / blt candidates
+    if 'spg' in probabilities and 'crysystem' in probabilities:
+        log_probabilities = {task: np.log(np.clip(p, 1e-12, None)) for task, p in probabilities.items() if task in TASK_LABELS}
+        decoded = decode_predictions(log_probabilities, config_inference.CONSISTENT_TOP_K)
+        for task in TASK_LABELS:
+            accuracy = 100. * np.mean(decoded[task][:, 0] == labels[task])
+            print(f"{task} (consistent decoding): accuracy {accuracy:.2f}%")
+        top_k_accuracy = 100. * np.mean((decoded['spg'] == labels['spg'][:, None]).any(axis=1))
+        print(f"spg (consistent decoding): top-{config_inference.CONSISTENT_TOP_K} accuracy {top_k_accuracy:.2f}%")
+        probabilities.update({f"consistent_{key}": value for key, value in decoded.items()})
+
+    np.savez(config_inference.ENSEMBLE_OUTPUT_PATH, **probabilities)
+    print(f"Saved probabilities to '{config_inference.ENSEMBLE_OUTPUT_PATH}'")
+
+if __name__ == "__main__":
+    main()
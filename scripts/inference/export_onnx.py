@@ -0,0 +1,33 @@
+import torch
+
+# Config
+import scripts.inference.config_inference as config_inference
+
+# Functions
+from src.inference.load_model import load_model
+from src.inference.onnx_export import export_to_onnx, check_onnx_parity
+from src.inference.onnx_predictor import OnnxPredictor
+from src.inference.predictor import TorchPredictor
+from src.utils.benchmark import measure_predictor_throughput
+
+# Exports the trained model at MODEL_PATH to ONNX_MODEL_PATH, checks it against eager PyTorch and compares CPU throughput.
+
+def main():
+    device = torch.device("cpu")
+    model = load_model(config_inference.MODEL_TYPE, config_inference.MODEL_PATH, device)
+
+    output_names = export_to_onnx(model, config_inference.ONNX_MODEL_PATH)
+    print(f"Exported '{config_inference.ONNX_MODEL_PATH}' with outputs {output_names}")
+
+    max_errors = check_onnx_parity(model, config_inference.ONNX_MODEL_PATH)
+    print("Parity with PyTorch (max abs error): " + ", ".join(f"{k}: {v:.2e}" for k, v in max_errors.items()))
+
+    # Throughput of both backends on the same batch
+    torch_predictor = TorchPredictor(model, device, config_inference.BATCH_SIZE)
+    onnx_predictor = OnnxPredictor(config_inference.ONNX_MODEL_PATH, config_inference.BATCH_SIZE, config_inference.ONNX_NUM_THREADS)
+    torch_throughput = measure_predictor_throughput(torch_predictor, config_inference.BATCH_SIZE)
+    onnx_throughput = measure_predictor_throughput(onnx_predictor, config_inference.BATCH_SIZE)
+    print(f"CPU throughput: PyTorch {torch_throughput:.0f} samples/s, ONNX Runtime {onnx_throughput:.0f} samples/s")
+
+if __name__ == "__main__":
+    main()
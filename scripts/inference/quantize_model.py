@@ -0,0 +1,38 @@
+import torch
+
+# Config
+import scripts.inference.config_inference as config_inference
+
+# Functions
+from src.data_loading.simXRD_data_loader import create_inference_data_loader
+from src.inference.load_model import load_model
+from src.inference.quantization import quantize_model, compare_with_float
+
+# Quantizes a trained model to int8 for CPU inference, reports top-1 spg accuracy against fp32 on VAL_DATA,
+# and saves the quantized state dict to QUANTIZED_MODEL_PATH (load it with load_quantized_model).
+
+def main():
+    # Quantized kernels are CPU only
+    device = torch.device("cpu")
+    model = load_model(config_inference.MODEL_TYPE, config_inference.MODEL_PATH, device)
+
+    val_loader = create_inference_data_loader(config_inference.VAL_DATA, config_inference.BATCH_SIZE, config_inference.NUM_WORKERS)
+
+    quantized_model = quantize_model(
+        model, config_inference.QUANTIZATION_MODE, val_loader,
+        config_inference.CALIBRATION_BATCHES, config_inference.QUANTIZATION_BACKEND
+    )
+
+    report = compare_with_float(model, quantized_model, val_loader, config_inference.REPORT_BATCHES)
+
+    print(f"\n=== {config_inference.MODEL_TYPE}: fp32 vs {config_inference.QUANTIZATION_MODE} int8 ===")
+    print(f"Top-1 spg accuracy: {report['fp32_spg_accuracy']:.2f}% -> {report['int8_spg_accuracy']:.2f}%")
+    print(f"Prediction agreement: {report['spg_agreement']:.2f}%")
+    print(f"Latency: {report['fp32_ms_per_sample']:.3f} -> {report['int8_ms_per_sample']:.3f} ms/sample ({report['speedup']:.2f}x)")
+    print(f"Size: {report['fp32_size_mb']:.1f} -> {report['int8_size_mb']:.1f} MB")
+
+    torch.save(quantized_model.state_dict(), config_inference.QUANTIZED_MODEL_PATH)
+    print(f"Quantized model saved as '{config_inference.QUANTIZED_MODEL_PATH}'.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import sys
+import time
+import subprocess
+
+# Config
+import scripts.training.config_training as config_training
+
+# Functions
+from scripts.training.main_training import setup_model, setup_optimizer
+from src.data_loading.simXRD_data_loader import create_training_data_loaders
+from src.training.cpu_fast_path import numa_nodes, allowed_cpus, cpu_supports_bf16, configure_cpu_threads, optimize_cpu_model
+
+# CPU training throughput of MODEL_TYPE, before and after the CPU fast path (src/training/cpu_fast_path.py):
+#   python -m scripts.training.benchmark_cpu [num_steps]
+# Trains on TRAIN_DATA with BATCH_SIZE and NUM_WORKERS, as main_training.py would. Every mode runs in a fresh process,
+# as thread pools and pinning can't be undone within one:
+# - baseline:     torch defaults (one thread per core, workers unpinned), fp32
+# - pinned:       cores split between compute and workers, NUMA-local, fp32
+# - pinned_bf16:  pinned + bf16 autocast (only on CPUs with native bf16)
+# Run it on the node type you train on: the gain from pinning grows with the number of sockets.
+
+MODES = ["baseline", "pinned", "pinned_bf16"]
+WARMUP_STEPS = 5
+
+def run_mode(mode, num_steps):
+    worker_init_fn = None
+    if mode != "baseline":
+        worker_init_fn = configure_cpu_threads(config_training.NUM_WORKERS, config_training.CPU_COMPUTE_SOCKETS)
+
+    model, criterion = setup_model()
+    optimizer = setup_optimizer(model, config_training.BATCH_SIZE)
+    if mode != "baseline":
+        model, optimizer = optimize_cpu_model(model, optimizer, bf16=mode == "pinned_bf16")
+    model.train()
+
+    train_loader, _, _ = create_training_data_loaders(
+        config_training.TRAIN_DATA, config_training.VAL_DATA, config_training.TEST_DATA,
+        config_training.BATCH_SIZE, config_training.NUM_WORKERS, worker_init_fn=worker_init_fn
+    )
+
+    num_samples = 0
+    batches = iter(train_loader)
+    for step in range(WARMUP_STEPS + num_steps):
+        if step == WARMUP_STEPS:
+            start = time.perf_counter()
+            num_samples = 0
+        try:
+            inputs, spg, crysystem, blt, composition = next(batches)
+        except StopIteration:
+            batches = iter(train_loader)
+            inputs, spg, crysystem, blt, composition = next(batches)
+
+        optimizer.zero_grad()
+        outputs = model(inputs.unsqueeze(1))
+        if config_training.MULTI_TASK:
+            targets = {'spg': spg, 'crysystem': crysystem, 'blt': blt, 'composition': composition}
+            loss = sum(criterion[task](outputs[task], targets[task]) for task in criterion)
+        else:
+            loss = criterion(outputs, spg)
+        loss.backward()
+        optimizer.step()
+        num_samples += len(inputs)
+
+    return num_samples / (time.perf_counter() - start)
+
+def main():
+    num_steps = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    # Child process: python -m scripts.training.benchmark_cpu <num_steps> <mode>
+    if len(sys.argv) > 2:
+        print(f"THROUGHPUT {run_mode(sys.argv[2], num_steps)}")
+        return
+
+    nodes = numa_nodes()
+    print(f"{len(allowed_cpus())} CPUs in {len(nodes)} NUMA node(s): " + ", ".join(f"node {node}: {len(cpus)}" for node, cpus in nodes.items()))
+    print(f"Native bf16: {cpu_supports_bf16()}. {config_training.MODEL_TYPE}, batch size {config_training.BATCH_SIZE}, {config_training.NUM_WORKERS} workers, {num_steps} steps")
+
+    results = {}
+    for mode in MODES:
+        if mode == "pinned_bf16" and not cpu_supports_bf16():
+            print(f"Skipping {mode}: no native bf16 on this CPU")
+            continue
+        output = subprocess.run(
+            [sys.executable, "-m", "scripts.training.benchmark_cpu", str(num_steps), mode], check=True, capture_output=True, text=True
+        ).stdout
+        results[mode] = float(output.split("THROUGHPUT")[-1])
+        print(f"{mode:>12}: {results[mode]:8.1f} samples/s  ({results[mode] / results['baseline']:.2f}x)")
+
+if __name__ == "__main__":
+    main()
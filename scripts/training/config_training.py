@@ -7,14 +7,19 @@ import torch.optim as optim
 from src.models.CNN10 import CNN10, CNN10_MultiTask, smallCNN10_MultiTask
 from src.models.CNN11 import CNN11, CNN11_MultiTask
 from src.models.FCNs import smallFCN, smallFCN_MultiTask, smallFCN_SelfAttention_MultiTask, experimentalFCN
-from src.models.ViT_1Ds import ViT1D_MultiTask
+from src.models.ViT_1Ds import ViT1D_MultiTask, ViT1D_MultiTask_Patch35, ViT1D_MultiTask_Patch50, ViT1D_MultiTask_Patch100
 from src.models.MLPs import MLP10
 
+# Import optimisers
+from src.training.large_batch import LARS, LAMB
+
 # TODO: Is model class necessary?
 
 # Paths
 DATA_DIR = 'training_data/simXRD_partial_data'
 MODEL_SAVE_DIR = 'trained_models'
+DETAILED_METRICS_DIR = os.path.join(MODEL_SAVE_DIR, 'metrics')   # Per-class test metrics (confusion matrices etc.) are saved here as .npz
+LOG_DIR = os.path.join(MODEL_SAVE_DIR, 'logs')                     # Every run's metrics are logged here (<run>/metrics.jsonl), with or without W&B
 
 # Data
 TRAIN_DATA = os.path.join(DATA_DIR, 'train.db')
@@ -24,6 +29,7 @@ TEST_DATA = os.path.join(DATA_DIR, 'test.db')
 # Model Setup
 MODEL_TYPE = "smallFCN_MultiTask"                 # Options: Any of the imported models. It should be a string. e.g. "smallFCN"
 MULTI_TASK = True                                  # Set to True for multi-task learning (points train function to train_multi_spg_cryssystem_blt_element.py)
+MEMORY_EFFICIENT = False                           # Activation checkpointing to fit larger batches. Only for CNN11 and ViT1D models (see MEMORY_EFFICIENT_MODELS)
 
 # IF SINGLE TASK, loss
 CRITERION_TYPE = "CrossEntropyLoss"  # Options: "CrossEntropyLoss", "MSELoss"
@@ -41,14 +47,89 @@ LEARNING_RATE = 0.0001
 BATCH_SIZE = 32
 NUM_EPOCHS = 100
 
+# Large batch training
+# BATCH_SIZE is the micro-batch that goes through the model in one pass. The optimiser steps every ACCUMULATION_STEPS micro-batches.
+ACCUMULATION_STEPS = 1       # Effective batch size = BATCH_SIZE * ACCUMULATION_STEPS
+AUTO_BATCH_SIZE = False      # Set to True to replace BATCH_SIZE with the largest micro-batch that fits in GPU memory
+LR_SCALING = None            # Options: None, "linear", "sqrt". Scales LEARNING_RATE by (effective batch size / BASE_BATCH_SIZE)
+BASE_BATCH_SIZE = 32         # The batch size that LEARNING_RATE was tuned at
+WARMUP_EPOCHS = 0            # Linear LR warmup over this many epochs (can be fractional). Recommended when LR_SCALING is used.
+
 # Optimiser
-OPTIMIZER_TYPE = "Adam" # Options: "Adam", "SGD"
+OPTIMIZER_TYPE = "Adam" # Options: "Adam", "SGD", "LARS", "LAMB"
+
+# Learning rate schedule, early stopping and best model tracking
+LR_SCHEDULER = None               # Options: None (constant), "plateau", "cosine", "onecycle". Applied after WARMUP_EPOCHS (onecycle uses them as its ramp-up)
+PLATEAU_FACTOR = 0.5              # "plateau": LR is multiplied by this when MONITOR_METRIC stalls...
+PLATEAU_PATIENCE = 3              # ...for this many epochs
+MONITOR_METRIC = "val_spg_accuracy"   # Val metric used by "plateau", early stopping and best model tracking. e.g. "val_spg_loss", "val_composition_f1" (multi-task)
+MONITOR_MODE = "max"              # "max" for accuracies / F1, "min" for losses
+EARLY_STOPPING_PATIENCE = None    # Stop once MONITOR_METRIC hasn't improved for this many epochs. None = always run NUM_EPOCHS
+RESTORE_BEST_MODEL = True         # Keep an in-memory copy of the best epoch's weights and restore them before testing and saving
+
+# Validation cadence
+FULL_VAL_EVERY_EPOCHS = 1         # Validate on the full val set every N epochs (and always after the last epoch)
+FAST_VAL_SUBSET_SIZE = None       # Size of a fixed random val subset checked at the end of the other epochs (logged only: early stopping etc. use full validations). None = no fast validation
+FAST_VAL_EVERY_STEPS = None       # Also check the fast subset every N optimiser steps. None = only at epoch ends
+ASYNC_VALIDATION = False          # Validate a copy of the weights in a background thread, so training doesn't wait for it
+VALIDATION_DEVICE = None          # Device for async validation, e.g. "cuda:1". None = the training device
+
+# Reproducibility (src/utils/reproducibility.py)
+SEED = 0                          # Seeds weight init, shuffling, samplers and DataLoader workers. None = unseeded
+DETERMINISTIC = False             # Deterministic cuDNN / cuBLAS and torch algorithms, for run-to-run identical results. Slower
+DETERMINISM_COST_STEPS = 20       # With DETERMINISTIC: time this many train steps with and without it first, and log the slowdown. None = skip
 
 # Data Loading Settings
 NUM_WORKERS = 6
+INTENSITY_CODEC = None            # Options: None (read the ASE databases), "uint16", "uint8_log" (quantised zstd stores, see compressed_store.py)
+TRAIN_STORE = None                # Directory of an append-only sharded store (see sharded_store.py) to train on instead of TRAIN_DATA. New shards join at the next epoch. LR_SCHEDULER must be None or "plateau"
+DEDUP_SPLITS = None               # Near-duplicate-free train / val / test splits from python -m src.data_loading.dedup (.npz). Replaces TRAIN_DATA, VAL_DATA and TEST_DATA
+DEDUP_TRAIN = True                # With DEDUP_SPLITS: train on one pattern per near-duplicate cluster
+PATTERN_PYRAMID = False           # Set to True to read patterns from the precomputed pattern pyramid at the model's input length (see pattern_pyramid.py)
+COARSE_RESOLUTION_SCHEDULE = []   # Coarse-to-fine training as [(pattern length, epochs), ...], e.g. [(875, 2), (1750, 2)]. Uses the pattern pyramid. Only for MULTI_RESOLUTION_MODELS
+CLASS_BALANCED_SAMPLING = False   # Set to True to re-balance the train set classes with a weighted sampler (uses the label index of TRAIN_DATA)
+CLASS_BALANCE_TASK = "spg"        # Options: "spg", "crysystem", "blt"
+CLASS_BALANCE_POWER = 0.5         # Sample weight = class_count^-power. 0 = natural distribution, 1 = fully balanced.
+HARD_EXAMPLE_MINING = False       # Set to True to oversample high-loss train samples (recorded during training, no extra forward passes). Not with CLASS_BALANCED_SAMPLING.
+HARD_EXAMPLE_TEMPERATURE = 1.0    # Sample probability ~ (loss / mean loss)^(1 / temperature). Higher = closer to uniform.
+HARD_EXAMPLE_EPOCH_FRACTION = 0.5 # Fraction of the train set drawn per epoch after the first (full) epoch
+HARD_EXAMPLE_UNIFORM_MIX = 0.1    # Fraction of sampling probability kept uniform, so easy samples are sub-sampled but never dropped
+
+# CPU-only training (src/training/cpu_fast_path.py). Only applies when no GPU is available.
+CPU_FAST_PATH = False             # Pin the compute threads and DataLoader workers (NUM_WORKERS) to separate cores, NUMA-local
+CPU_COMPUTE_SOCKETS = None        # Number of NUMA nodes (sockets) used for compute, the rest go to the workers. None = all
+CPU_BF16 = False                  # bf16 autocast. None = only on CPUs with native bf16 (AVX512-BF16 / AMX), which bf16 needs to be faster. Uses Intel Extension for PyTorch if installed
+
+# Knowledge distillation (scripts/training/main_distillation.py). The student is MODEL_TYPE.
+TEACHER_MODEL_TYPE = "CNN11_MultiTask"
+TEACHER_MODEL_PATH = os.path.join(MODEL_SAVE_DIR, "CNN11_MultiTask.pth")     # Set to a trained teacher
+TEACHER_LOGITS_CACHE_DIR = os.path.join(MODEL_SAVE_DIR, f"teacher_logits_{TEACHER_MODEL_TYPE}")   # Rebuilt automatically if the teacher or TRAIN_DATA changes
+DISTILLATION_TEMPERATURE = 4.0    # Softens the teacher's outputs
+DISTILLATION_ALPHA = 0.5          # Weight on the hard label loss. (1 - alpha) goes to the teacher's soft targets.
+
+# Structured pruning (scripts/training/main_pruning.py). Prunes a trained MODEL_TYPE model.
+PRUNE_MODEL_PATH = os.path.join(MODEL_SAVE_DIR, "smallFCN_MultiTask.pth")   # Set to a trained model
+PRUNING_AMOUNT = 0.5              # Total fraction of trunk conv channels to remove
+PRUNING_STEPS = 2                 # Prune gradually over this many steps, fine-tuning after each
+PRUNING_FINETUNE_EPOCHS = 3       # Fine-tuning epochs after each pruning step
+
+# SLURM job-array sweeps (scripts/training/submit_sweep.py). Each entry of SWEEP is a dict of overrides of the settings in this file,
+# run as one task of the array. expand_grid() in src/utils/slurm_sweep.py turns {setting: [values]} into all combinations.
+SWEEP = [
+    {"MODEL_TYPE": "smallFCN_MultiTask"},
+    {"MODEL_TYPE": "CNN11_MultiTask"},
+]
+SWEEP_DIR = os.path.join(MODEL_SAVE_DIR, 'sweeps', 'sweep_0')     # Job script, logs, per-task models and results.csv
+SLURM_OPTIONS = {"partition": "gpu", "gres": "gpu:A40:1", "ntasks": 1, "cpus-per-task": 8, "mem": "16G", "time": "2:00:00"}
+SLURM_SETUP_COMMANDS = ["module load cuda"]
+SLURM_MAX_CONCURRENT = None       # Max tasks of the array running at once. None = no limit
+SBATCH_COMMAND = "sbatch"         # "python _monash_HPC_commands/fake_sbatch.py" runs the array locally
+STAGING_DIR = None                # Node-local scratch the datasets are copied to. None = $TMPDIR (or /tmp). TRAIN_STORE and DEDUP_SPLITS are not staged
 
 # WandB configuration (Note that there is already a basic WandB log in train.py)
 USE_WANDB = True        # Set to False if you don't want to use WandB at all.
+WANDB_OFFLINE = False   # Set to True on nodes without network: log to LOG_DIR only, and upload later with python -m scripts.training.sync_logs <run dir>
+STEP_LOG_INTERVAL = 10  # Also log the train losses every N optimiser steps (logged in the background, so cheap). None = once per epoch only
 WANDB_PROJECT_NAME = "FirstModelExperiments"
 WANDB_SAVE_DIR = "/wandb"
 SAVE_MODEL_TO_WANDB_SERVERS = False
@@ -66,13 +147,20 @@ MODEL_CLASS = {
     "smallFCN_SelfAttention_MultiTask": smallFCN_SelfAttention_MultiTask,
     "experimentalFCN": experimentalFCN,
     "MLP10": MLP10,
-    "ViT1D_MultiTask": ViT1D_MultiTask
+    "ViT1D_MultiTask": ViT1D_MultiTask,
+    "ViT1D_MultiTask_Patch35": ViT1D_MultiTask_Patch35,
+    "ViT1D_MultiTask_Patch50": ViT1D_MultiTask_Patch50,
+    "ViT1D_MultiTask_Patch100": ViT1D_MultiTask_Patch100
 }
+MEMORY_EFFICIENT_MODELS = ["CNN11_MultiTask", "ViT1D_MultiTask", "ViT1D_MultiTask_Patch35", "ViT1D_MultiTask_Patch50", "ViT1D_MultiTask_Patch100"]
+MULTI_RESOLUTION_MODELS = ["ViT1D_MultiTask", "ViT1D_MultiTask_Patch35", "ViT1D_MultiTask_Patch50", "ViT1D_MultiTask_Patch100"]
 CRITERION_CLASS = {
     "CrossEntropyLoss": nn.CrossEntropyLoss,
     "MSELoss": nn.MSELoss
 }
 OPTIMIZER_CLASS = {
     "Adam": optim.Adam,
-    "SGD": optim.SGD
+    "SGD": optim.SGD,
+    "LARS": LARS,
+    "LAMB": LAMB
 }
\ No newline at end of file
@@ -0,0 +1,70 @@
+import wandb
+
+# Config
+import scripts.training.config_training as config_training
+
+# Functions
+from scripts.training.main_training import setup_logging, finish_logging, setup_model, setup_device, setup_optimizer, save_model
+from src.data_loading.simXRD_data_loader import create_training_data_loaders
+from src.inference.load_model import load_model
+from src.training.train_distillation import cache_metadata, cache_teacher_logits, train_distillation
+from src.utils.benchmark import measure_throughput, count_parameters
+from src.utils.check_GPUs import check_gpus
+
+# Distils a frozen TEACHER_MODEL_TYPE into a MODEL_TYPE student (multi-task models only).
+
+def main():
+    # Start WandB and the local metric log
+    wandb_run, run_dir = setup_logging({
+        "teacher_model_type": config_training.TEACHER_MODEL_TYPE,
+        "distillation_temperature": config_training.DISTILLATION_TEMPERATURE,
+        "distillation_alpha": config_training.DISTILLATION_ALPHA
+    })
+
+    # Setup student, loss and device
+    student, criterion = setup_model()
+    student, device = setup_device(student)
+    optimizer = setup_optimizer(student, config_training.BATCH_SIZE)
+
+    # Create data loaders. Train batches carry sample indices for the teacher logit lookup.
+    train_loader, val_loader, test_loader = create_training_data_loaders(
+        config_training.TRAIN_DATA, config_training.VAL_DATA, config_training.TEST_DATA, 
+        config_training.BATCH_SIZE, config_training.NUM_WORKERS, return_indices=True, intensity_codec=config_training.INTENSITY_CODEC
+    )
+
+    # Cache the teacher's logits once, then free it
+    teacher = load_model(config_training.TEACHER_MODEL_TYPE, config_training.TEACHER_MODEL_PATH, device)
+    teacher_logits = cache_teacher_logits(
+        teacher, train_loader.dataset.dataset, config_training.TEACHER_LOGITS_CACHE_DIR, device,
+        batch_size=4 * config_training.BATCH_SIZE, num_workers=config_training.NUM_WORKERS,
+        metadata=cache_metadata(
+            config_training.TEACHER_MODEL_PATH, config_training.TRAIN_DATA,
+            teacher_model_type=config_training.TEACHER_MODEL_TYPE, intensity_codec=config_training.INTENSITY_CODEC
+        )
+    )
+    teacher_throughput = measure_throughput(teacher, device)
+    teacher_params = count_parameters(teacher)
+    del teacher
+
+    trained_student, final_metrics = train_distillation(
+        student, teacher_logits, train_loader, val_loader, test_loader, criterion, optimizer,
+        device, config_training.NUM_EPOCHS, config_training.DISTILLATION_TEMPERATURE, config_training.DISTILLATION_ALPHA
+    )
+
+    # Speedup against the teacher
+    student_throughput = measure_throughput(trained_student, device)
+    print(f"Teacher {config_training.TEACHER_MODEL_TYPE}: {teacher_params:,} params, {teacher_throughput:.0f} samples/s")
+    print(f"Student {config_training.MODEL_TYPE}: {count_parameters(trained_student):,} params, {student_throughput:.0f} samples/s ({student_throughput / teacher_throughput:.1f}x)")
+
+    # Save the model
+    save_path, model_name = save_model(trained_student, final_metrics, multi_task=True)
+    print(f"Distillation completed. Model saved as '{model_name}'.")
+
+    if config_training.SAVE_MODEL_TO_WANDB_SERVERS:
+        wandb.save(save_path)
+
+    finish_logging(wandb_run, run_dir)
+
+if __name__ == "__main__":
+    check_gpus()
+    main()
@@ -0,0 +1,74 @@
+import torch
+import wandb
+
+# Config
+import scripts.training.config_training as config_training
+
+# Functions
+from scripts.training.main_training import setup_logging, finish_logging, setup_device, setup_optimizer, save_model
+from src.data_loading.simXRD_data_loader import create_training_data_loaders
+from src.inference.load_model import load_model
+from src.training.pruning import prune_conv_channels, PRUNABLE_CONVS
+from src.training.train_multitask import train_multitask, evaluate_multi_task
+from src.utils.benchmark import measure_throughput, count_parameters
+from src.utils.check_GPUs import check_gpus
+
+# Prunes PRUNING_AMOUNT of the trunk conv channels of a trained MODEL_TYPE model over PRUNING_STEPS steps,
+# fine-tuning for PRUNING_FINETUNE_EPOCHS after each step. Then reports the speedup against the accuracy cost.
+
+def main():
+    # Fine-tuning uses train_multitask, so only the multi-task models in PRUNABLE_CONVS can be pruned
+    if config_training.MODEL_TYPE not in PRUNABLE_CONVS:
+        raise ValueError(f"Pruning is not supported for {config_training.MODEL_TYPE}. Options: {list(PRUNABLE_CONVS.keys())}")
+
+    # Start WandB and the local metric log
+    wandb_run, run_dir = setup_logging({"pruning_amount": config_training.PRUNING_AMOUNT, "pruning_steps": config_training.PRUNING_STEPS})
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = load_model(config_training.MODEL_TYPE, config_training.PRUNE_MODEL_PATH, device)
+    criterion = config_training.MULTI_TASK_CRITERIA
+
+    train_loader, val_loader, test_loader = create_training_data_loaders(
+        config_training.TRAIN_DATA, config_training.VAL_DATA, config_training.TEST_DATA, 
+        config_training.BATCH_SIZE, config_training.NUM_WORKERS, intensity_codec=config_training.INTENSITY_CODEC
+    )
+
+    # Baseline
+    base_metrics = evaluate_multi_task(model, test_loader, criterion, device)
+    base_throughput = measure_throughput(model, device)
+    base_params = count_parameters(model)
+
+    # Each step removes the same fraction of the remaining channels
+    step_amount = 1 - (1 - config_training.PRUNING_AMOUNT) ** (1 / config_training.PRUNING_STEPS)
+    for step in range(config_training.PRUNING_STEPS):
+        model = prune_conv_channels(model, config_training.MODEL_TYPE, step_amount)
+        print(f"\nPruning step {step+1}/{config_training.PRUNING_STEPS}: {count_parameters(model):,} params")
+
+        model, device = setup_device(model)
+        optimizer = setup_optimizer(model, config_training.BATCH_SIZE)
+        model, final_metrics = train_multitask(
+            model, train_loader, val_loader, test_loader, criterion, optimizer,
+            device, config_training.PRUNING_FINETUNE_EPOCHS
+        )
+        model = model.module if isinstance(model, torch.nn.DataParallel) else model
+
+    # Report
+    pruned_throughput = measure_throughput(model, device)
+    print(f"\n=== Pruning {config_training.MODEL_TYPE} by {100 * config_training.PRUNING_AMOUNT:.0f}% ===")
+    print(f"Params: {base_params:,} -> {count_parameters(model):,}")
+    print(f"Throughput: {base_throughput:.0f} -> {pruned_throughput:.0f} samples/s ({pruned_throughput / base_throughput:.2f}x)")
+    for k in ['spg_accuracy', 'crysystem_accuracy', 'blt_accuracy', 'composition_f1']:
+        print(f"Test {k}: {base_metrics[k]:.2f} -> {final_metrics[k]:.2f}")
+
+    # Save the model (load it again with load_model, which resizes the pruned layers)
+    save_path, model_name = save_model(model, final_metrics, multi_task=True)
+    print(f"Pruning completed. Model saved as '{model_name}'.")
+
+    if config_training.SAVE_MODEL_TO_WANDB_SERVERS:
+        wandb.save(save_path)
+
+    finish_logging(wandb_run, run_dir)
+
+if __name__ == "__main__":
+    check_gpus()
+    main()
@@ -1,40 +1,97 @@
+import os
 import torch
 import torch.nn as nn
 import wandb
 import datetime
+import math
 
 # Config
 import scripts.training.config_training as config_training
 
 # Functions
 from src.data_loading.simXRD_data_loader import create_training_data_loaders
+from src.data_loading.label_index import create_class_balanced_sampler
+from src.data_loading.pattern_pyramid import ResolutionSchedule, model_input_length, pyramid_level_for
+from src.training.hard_example_sampler import create_loss_history_sampler
 from src.training.train_spacegroup import train_spg
 from src.training.train_multitask import train_multitask
+from src.training.large_batch import scale_learning_rate
+from src.training.callbacks import EarlyStopping, BestModelTracker, build_lr_scheduler, STEP_COUNT_FREE_SCHEDULERS
+from src.training.validation import ValidationScheduler
+from src.training.cpu_fast_path import configure_cpu_threads, optimize_cpu_model
 from src.utils.check_GPUs import check_gpus
+from src.utils.find_batch_size import find_max_batch_size
+import src.utils.experiment_logger as experiment_logger
+from src.utils.reproducibility import seed_everything, seed_worker, set_deterministic, measure_determinism_cost
 
 # TODO: Setup_device() function has not been tested with multiple GPUs. I am not currently sure how it will handle multiple GPUs. These needs to be done before large training runs.
 
-def setup_wandb():
+def run_config():
+    # The settings recorded with every run
+    return {
+        "model_type": config_training.MODEL_TYPE,
+        "multi_task": config_training.MULTI_TASK,
+        "memory_efficient": config_training.MEMORY_EFFICIENT,
+        "criterion_type": config_training.CRITERION_TYPE,
+        "optimizer_type": config_training.OPTIMIZER_TYPE,
+        "batch_size": config_training.BATCH_SIZE,
+        "accumulation_steps": config_training.ACCUMULATION_STEPS,
+        "lr_scaling": config_training.LR_SCALING,
+        "warmup_epochs": config_training.WARMUP_EPOCHS,
+        "lr_scheduler": config_training.LR_SCHEDULER,
+        "monitor_metric": config_training.MONITOR_METRIC,
+        "early_stopping_patience": config_training.EARLY_STOPPING_PATIENCE,
+        "full_val_every_epochs": config_training.FULL_VAL_EVERY_EPOCHS,
+        "fast_val_subset_size": config_training.FAST_VAL_SUBSET_SIZE,
+        "async_validation": config_training.ASYNC_VALIDATION,
+        "num_workers": config_training.NUM_WORKERS,       
+        "intensity_codec": config_training.INTENSITY_CODEC,
+        "coarse_resolution_schedule": config_training.COARSE_RESOLUTION_SCHEDULE,
+        "class_balanced_sampling": config_training.CLASS_BALANCED_SAMPLING,
+        "class_balance_power": config_training.CLASS_BALANCE_POWER,
+        "hard_example_mining": config_training.HARD_EXAMPLE_MINING,
+        "hard_example_temperature": config_training.HARD_EXAMPLE_TEMPERATURE,
+        "hard_example_epoch_fraction": config_training.HARD_EXAMPLE_EPOCH_FRACTION,
+        "learning_rate": config_training.LEARNING_RATE,
+        "num_epochs": config_training.NUM_EPOCHS,
+        "seed": config_training.SEED,
+        "deterministic": config_training.DETERMINISTIC,
+    }
+
+def setup_wandb(config):
     wandb.require("core") # This line *maybe* fixes a "retry upload" bug I was having. See: https://github.com/wandb/wandb/issues/4929
     return wandb.init(
         project=config_training.WANDB_PROJECT_NAME, 
         dir=config_training.WANDB_SAVE_DIR, 
-        config={
-            "model_type": config_training.MODEL_TYPE,
-            "multi_task": config_training.MULTI_TASK,
-            "criterion_type": config_training.CRITERION_TYPE,
-            "optimizer_type": config_training.OPTIMIZER_TYPE,
-            "batch_size": config_training.BATCH_SIZE,
-            "num_workers": config_training.NUM_WORKERS,       
-            "learning_rate": config_training.LEARNING_RATE,
-            "num_epochs": config_training.NUM_EPOCHS,
-        }
+        mode="disabled" if config_training.WANDB_OFFLINE else None,   # Offline: every wandb call is a no-op, metrics only go to LOG_DIR
+        config=config
     )
 
+def setup_logging(extra_config=None):
+    # Starts W&B (if USE_WANDB) and the local experiment logger, which forwards to W&B from a background thread
+    config = {**run_config(), **(extra_config or {})}
+    wandb_run = setup_wandb(config) if config_training.USE_WANDB else None
+    run_dir = os.path.join(config_training.LOG_DIR, f"{config_training.MODEL_TYPE}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    experiment_logger.start(run_dir, config, use_wandb=config_training.USE_WANDB and not config_training.WANDB_OFFLINE)
+    print(f"Logging metrics to '{run_dir}'")
+    return wandb_run, run_dir
+
+def finish_logging(wandb_run, run_dir):
+    experiment_logger.finish()
+    if wandb_run is not None:
+        wandb_run.finish()
+    if config_training.USE_WANDB and config_training.WANDB_OFFLINE:
+        print(f"Offline run. Upload it to W&B later with: python -m scripts.training.sync_logs {run_dir}")
+
 def setup_model():
-    # Initialize the model, loss function, and optimiser
+    # Initialize the model and loss function
     model_class = config_training.MODEL_CLASS[config_training.MODEL_TYPE]
-    model = model_class()
+    if config_training.MEMORY_EFFICIENT:
+        if config_training.MODEL_TYPE not in config_training.MEMORY_EFFICIENT_MODELS:
+            raise ValueError(f"MEMORY_EFFICIENT is not supported for {config_training.MODEL_TYPE}. Options: {config_training.MEMORY_EFFICIENT_MODELS}")
+        model = model_class(memory_efficient=True)
+    else:
+        model = model_class()
     
     if config_training.MULTI_TASK:
         criterion = config_training.MULTI_TASK_CRITERIA
@@ -42,10 +99,50 @@ def setup_model():
         criterion_class = config_training.CRITERION_CLASS[config_training.CRITERION_TYPE]
         criterion = criterion_class()
     
+    return model, criterion
+
+def setup_optimizer(model, effective_batch_size):
+    # Initialize the optimiser, with the learning rate scaled to the effective batch size
+    learning_rate = scale_learning_rate(
+        config_training.LEARNING_RATE, effective_batch_size, config_training.BASE_BATCH_SIZE, config_training.LR_SCALING
+    )
+    if learning_rate != config_training.LEARNING_RATE:
+        print(f"Effective batch size {effective_batch_size}: scaled learning rate {config_training.LEARNING_RATE} -> {learning_rate}")
+
     optimizer_class = config_training.OPTIMIZER_CLASS[config_training.OPTIMIZER_TYPE]
-    optimizer = optimizer_class(model.parameters(), lr=config_training.LEARNING_RATE)
+    optimizer = optimizer_class(model.parameters(), lr=learning_rate)
     
-    return model, criterion, optimizer
+    return optimizer
+
+def optimiser_steps_per_epoch(train_loader, accumulation_steps, loss_history_sampler=None):
+    # Optimiser steps of every epoch. With hard example mining, the epochs after the sampler's warm-up only draw
+    # HARD_EXAMPLE_EPOCH_FRACTION of the train set (len(train_loader) is the length of the current, full epoch).
+    samples_per_epoch = [len(train_loader.sampler)] * config_training.NUM_EPOCHS
+    if loss_history_sampler is not None:
+        mining_samples = max(1, int(loss_history_sampler.epoch_fraction * loss_history_sampler.num_samples_total))
+        samples_per_epoch = [
+            samples if epoch < loss_history_sampler.warmup_epochs else mining_samples for epoch, samples in enumerate(samples_per_epoch)
+        ]
+    return [math.ceil(math.ceil(samples / train_loader.batch_size) / accumulation_steps) for samples in samples_per_epoch]
+
+def setup_callbacks(optimizer, epoch_steps):
+    # Per-optimiser-step LR scheduler (incl. warmup) and the epoch-end callbacks for the trainers
+    # epoch_steps: Optimiser steps of every epoch (see optimiser_steps_per_epoch)
+    full_epochs = min(int(config_training.WARMUP_EPOCHS), len(epoch_steps) - 1)
+    warmup_steps = sum(epoch_steps[:full_epochs]) + int((config_training.WARMUP_EPOCHS - full_epochs) * epoch_steps[full_epochs])
+    scheduler, lr_callback = build_lr_scheduler(
+        optimizer, config_training.LR_SCHEDULER, config_training.NUM_EPOCHS, epoch_steps[-1],
+        warmup_steps, config_training.MONITOR_METRIC, config_training.MONITOR_MODE,
+        config_training.PLATEAU_FACTOR, config_training.PLATEAU_PATIENCE, total_steps=sum(epoch_steps)
+    )
+
+    callbacks = [] if lr_callback is None else [lr_callback]
+    if config_training.RESTORE_BEST_MODEL:
+        callbacks.append(BestModelTracker(config_training.MONITOR_METRIC, config_training.MONITOR_MODE))
+    if config_training.EARLY_STOPPING_PATIENCE is not None:
+        callbacks.append(EarlyStopping(config_training.MONITOR_METRIC, config_training.MONITOR_MODE, config_training.EARLY_STOPPING_PATIENCE))
+
+    return scheduler, callbacks
 
 def setup_device(model):
     # Setup GPUs
@@ -70,21 +167,101 @@ def save_model(model, final_metrics, multi_task=False):
     return full_path, model_name
 
 def main():
-    # Start WandB
-    if config_training.USE_WANDB:
-        wandb_run = setup_wandb()
+    # Start WandB and the local metric log
+    wandb_run, run_dir = setup_logging()
+
+    # Seed before anything random happens (weight init, shuffling, dropout). The generator drives the train loader and samplers.
+    generator = None
+    worker_init_fn = None
+    if config_training.SEED is not None:
+        generator = seed_everything(config_training.SEED)
+        worker_init_fn = seed_worker
+    if config_training.DETERMINISTIC:
+        set_deterministic(True)
+
+    # Setup model and loss
+    model, criterion = setup_model()
+
+    # Setup device
+    model, device = setup_device(model)
+
+    # On CPU-only machines, split the cores between compute and the DataLoader workers
+    cpu_fast_path = config_training.CPU_FAST_PATH and device.type == 'cpu'
+    if cpu_fast_path:
+        worker_init_fn = configure_cpu_threads(config_training.NUM_WORKERS, config_training.CPU_COMPUTE_SOCKETS, worker_init_fn)
+
+    # Find the micro-batch size
+    batch_size = config_training.BATCH_SIZE
+    if config_training.AUTO_BATCH_SIZE:
+        batch_size = find_max_batch_size(model, device, start_batch_size=config_training.BATCH_SIZE)
+        if config_training.USE_WANDB:
+            wandb.config.update({"batch_size": batch_size}, allow_val_change=True)
+
+    # Setup optimizer
+    accumulation_steps = config_training.ACCUMULATION_STEPS
+    optimizer = setup_optimizer(model, batch_size * accumulation_steps)
+    if cpu_fast_path:
+        model, optimizer = optimize_cpu_model(model, optimizer, config_training.CPU_BF16)
 
     # Create data loaders
+    train_sampler = None
+    loss_history_sampler = None
+    if config_training.CLASS_BALANCED_SAMPLING and config_training.HARD_EXAMPLE_MINING:
+        raise ValueError("CLASS_BALANCED_SAMPLING and HARD_EXAMPLE_MINING can't be used together")
+    if config_training.CLASS_BALANCED_SAMPLING:
+        train_sampler = create_class_balanced_sampler(
+            config_training.TRAIN_DATA, config_training.CLASS_BALANCE_TASK, config_training.CLASS_BALANCE_POWER, generator=generator
+        )
+    if config_training.HARD_EXAMPLE_MINING:
+        loss_history_sampler = create_loss_history_sampler(
+            config_training.TRAIN_DATA, config_training.HARD_EXAMPLE_TEMPERATURE,
+            config_training.HARD_EXAMPLE_EPOCH_FRACTION, config_training.HARD_EXAMPLE_UNIFORM_MIX, generator=generator
+        )
+        train_sampler = loss_history_sampler
+
+    # A sharded store grows during training, so steps per epoch (and the length of a cosine / one-cycle schedule) aren't known up front
+    if config_training.TRAIN_STORE is not None and (train_sampler is not None or config_training.LR_SCHEDULER not in STEP_COUNT_FREE_SCHEDULERS):
+        raise ValueError("TRAIN_STORE can't be used with CLASS_BALANCED_SAMPLING, HARD_EXAMPLE_MINING or the cosine / onecycle LR schedulers")
+
+    # The weighted samplers are built from the label index of TRAIN_DATA, which the dedup splits don't follow
+    if config_training.DEDUP_SPLITS is not None and train_sampler is not None:
+        raise ValueError("DEDUP_SPLITS can't be used with CLASS_BALANCED_SAMPLING or HARD_EXAMPLE_MINING")
+
+    # Patterns from the pattern pyramid, at the model's input length
+    input_length = None
+    if config_training.COARSE_RESOLUTION_SCHEDULE and config_training.MODEL_TYPE not in config_training.MULTI_RESOLUTION_MODELS:
+        raise ValueError(f"COARSE_RESOLUTION_SCHEDULE is not supported for {config_training.MODEL_TYPE}. Options: {config_training.MULTI_RESOLUTION_MODELS}")
+    if config_training.PATTERN_PYRAMID or config_training.COARSE_RESOLUTION_SCHEDULE:
+        input_length = model_input_length(model)
+
     train_loader, val_loader, test_loader = create_training_data_loaders(
         config_training.TRAIN_DATA, config_training.VAL_DATA, config_training.TEST_DATA, 
-        config_training.BATCH_SIZE, config_training.NUM_WORKERS
+        batch_size, config_training.NUM_WORKERS, return_indices=loss_history_sampler is not None, train_sampler=train_sampler,
+        intensity_codec=config_training.INTENSITY_CODEC, input_length=input_length, worker_init_fn=worker_init_fn,
+        train_store=config_training.TRAIN_STORE, split_file=config_training.DEDUP_SPLITS, dedup_train=config_training.DEDUP_TRAIN,
+        generator=generator
     )
 
-    # Setup model, loss, and optimizer
-    model, criterion, optimizer = setup_model()
+    # What determinism costs on this model and machine, so deterministic runs can be compared with the usual ones
+    if config_training.DETERMINISTIC and config_training.DETERMINISM_COST_STEPS:
+        determinism_cost = measure_determinism_cost(model, criterion, val_loader, device, config_training.DETERMINISM_COST_STEPS)
+        print(f"Deterministic algorithms: {determinism_cost['deterministic_samples_per_second']:.1f} samples/s, "
+              f"{determinism_cost['deterministic_slowdown']:.2f}x slower than without ({determinism_cost['nondeterministic_samples_per_second']:.1f} samples/s)")
+        experiment_logger.log({f"determinism/{key}": value for key, value in determinism_cost.items()})
 
-    # Setup device
-    model, device = setup_device(model)
+    resolution_schedule = None
+    if config_training.COARSE_RESOLUTION_SCHEDULE:
+        resolution_schedule = ResolutionSchedule(train_loader.dataset, config_training.COARSE_RESOLUTION_SCHEDULE, pyramid_level_for(input_length))
+
+    # Setup the LR schedule (stepped once per optimiser step), early stopping and best model tracking
+    epoch_steps = optimiser_steps_per_epoch(train_loader, accumulation_steps, loss_history_sampler)
+    scheduler, callbacks = setup_callbacks(optimizer, epoch_steps)
+
+    # Setup validation cadence
+    validation = ValidationScheduler(
+        val_loader, config_training.FULL_VAL_EVERY_EPOCHS, config_training.FAST_VAL_SUBSET_SIZE, config_training.FAST_VAL_EVERY_STEPS,
+        config_training.ASYNC_VALIDATION, config_training.VALIDATION_DEVICE, seed=config_training.SEED or 0
+    )
 
     # Log the model architecture
     if config_training.WANDB_LOG_ARCHITECTURE:
@@ -94,12 +271,12 @@ def main():
     if config_training.MULTI_TASK:
         trained_model, final_metrics = train_multitask(
             model, train_loader, val_loader, test_loader, criterion, optimizer, 
-            device, config_training.NUM_EPOCHS
+            device, config_training.NUM_EPOCHS, accumulation_steps, scheduler, loss_history_sampler, callbacks, validation, resolution_schedule
         )
     else:
         trained_model, test_loss, test_accuracy = train_spg(
             model, train_loader, val_loader, test_loader, criterion, optimizer, 
-            device, config_training.NUM_EPOCHS
+            device, config_training.NUM_EPOCHS, accumulation_steps, scheduler, loss_history_sampler, callbacks, validation, resolution_schedule
         )
         final_metrics = {'test_loss': test_loss, 'test_accuracy': test_accuracy}
 
@@ -110,8 +287,9 @@ def main():
     if config_training.SAVE_MODEL_TO_WANDB_SERVERS:
         wandb.save(save_path)
 
-    if config_training.USE_WANDB:
-        wandb_run.finish()
+    finish_logging(wandb_run, run_dir)
+
+    return save_path, final_metrics
 
 if __name__ == "__main__":
     check_gpus()
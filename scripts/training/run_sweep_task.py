@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+
+# Functions
+from src.utils.slurm_sweep import load_task, stage_dataset, cpu_allocation, slurm_cpus, save_task_result
+
+# One task of a SLURM array sweep (see submit_sweep.py). Run by job.sh as:
+#   python -m scripts.training.run_sweep_task <sweep_dir>
+# Stages the data to node-local scratch, sizes workers / threads to --cpus-per-task, applies the task's config overrides,
+# runs main_training.main() and saves the final metrics to <sweep_dir>/results/task_<SLURM_ARRAY_TASK_ID>.json.
+
+# Before torch is imported, so its OpenMP / MKL pools are sized to this task's CPUs rather than the whole node
+NUM_CPUS = slurm_cpus()
+for variable in ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]:
+    os.environ.setdefault(variable, str(NUM_CPUS))
+
+import torch
+
+# Config
+import scripts.training.config_training as config_training
+
+# Functions
+import scripts.training.main_training as main_training
+
+def main(sweep_dir):
+    task_id = int(os.environ['SLURM_ARRAY_TASK_ID'])
+    node = os.environ.get('SLURMD_NODENAME', os.uname().nodename)
+    overrides = load_task(sweep_dir, task_id)
+    print(f"Sweep task {task_id} on {node} with {NUM_CPUS} CPUs: {overrides}")
+
+    # Overrides first, so a task can also change the data it trains on
+    for key, value in overrides.items():
+        if not hasattr(config_training, key):
+            raise KeyError(f"Unknown config_training setting in sweep: {key}")
+        setattr(config_training, key, value)
+
+    # Only the databases are staged. TRAIN_STORE and DEDUP_SPLITS (and the databases a DEDUP_SPLITS file lists) are read from
+    # shared storage where they are.
+    start = time.perf_counter()
+    staged = stage_dataset([config_training.TRAIN_DATA, config_training.VAL_DATA, config_training.TEST_DATA], config_training.STAGING_DIR)
+    staging_time = time.perf_counter() - start
+    config_training.TRAIN_DATA = staged[config_training.TRAIN_DATA]
+    config_training.VAL_DATA = staged[config_training.VAL_DATA]
+    config_training.TEST_DATA = staged[config_training.TEST_DATA]
+
+    num_workers, num_threads = cpu_allocation(NUM_CPUS, torch.cuda.is_available())
+    config_training.NUM_WORKERS = num_workers
+    torch.set_num_threads(num_threads)
+    print(f"NUM_WORKERS = {num_workers}, torch threads = {num_threads}")
+
+    # Every task saves its models, detailed metrics and metric logs in its own directory
+    task_dir = os.path.join(sweep_dir, 'models', f"task_{task_id}")
+    os.makedirs(task_dir, exist_ok=True)
+    config_training.MODEL_SAVE_DIR = task_dir
+    config_training.DETAILED_METRICS_DIR = os.path.join(task_dir, 'metrics')
+    config_training.LOG_DIR = os.path.join(task_dir, 'logs')
+
+    start = time.perf_counter()
+    model_path, final_metrics = main_training.main()
+    save_task_result(sweep_dir, task_id, {
+        'overrides': overrides,
+        'metrics': final_metrics,
+        'model_path': model_path,
+        'node': node,
+        'num_cpus': NUM_CPUS,
+        'staging_seconds': staging_time,
+        'training_seconds': time.perf_counter() - start
+    })
+
+if __name__ == "__main__":
+    main(sys.argv[1])
@@ -0,0 +1,32 @@
+import sys
+
+# Config
+import scripts.training.config_training as config_training
+
+# Functions
+from src.utils.slurm_sweep import submit_sweep, gather_results
+
+# Submits SWEEP (config_training.py) as one SLURM job array, one task per entry:
+#   python -m scripts.training.submit_sweep
+# and once the tasks have finished, collects their final metrics into <sweep_dir>/results.csv:
+#   python -m scripts.training.submit_sweep gather <sweep_dir>
+# For a local test, set SBATCH_COMMAND to "python _monash_HPC_commands/fake_sbatch.py".
+# Build the preprocessed stores (label index, intensity store, ...) before submitting, so they are staged with the databases
+# instead of being rebuilt by every node.
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "gather":
+        rows = gather_results(sys.argv[2])
+        for row in rows:
+            print(row)
+        print(f"{sum(row['status'] == 'done' for row in rows)}/{len(rows)} tasks finished. Saved to {sys.argv[2]}/results.csv")
+        return
+
+    job_id = submit_sweep(
+        config_training.SWEEP, config_training.SWEEP_DIR, config_training.SLURM_OPTIONS, config_training.SLURM_SETUP_COMMANDS,
+        max_concurrent=config_training.SLURM_MAX_CONCURRENT, sbatch_command=config_training.SBATCH_COMMAND
+    )
+    print(f"Submitted {len(config_training.SWEEP)} tasks as array job {job_id}. Logs and results in {config_training.SWEEP_DIR}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+import sys
+
+# Config
+import scripts.training.config_training as config_training
+
+# Functions
+from src.utils.experiment_logger import sync_to_wandb
+
+# Uploads runs logged offline (WANDB_OFFLINE = True) to W&B, from a machine with network access:
+#   python -m scripts.training.sync_logs <run dir> [<run dir> ...]
+# Run directories are under LOG_DIR. Runs already synced are skipped.
+
+def main():
+    for run_dir in sys.argv[1:]:
+        sync_to_wandb(run_dir, config_training.WANDB_PROJECT_NAME)
+
+if __name__ == "__main__":
+    main()
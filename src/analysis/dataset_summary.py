@@ -0,0 +1,115 @@
+import os
+import numpy as np
+from multiprocessing import Pool
+from tqdm import tqdm
+
+from src.data_loading.simXRD_data_loader import ELEMENT_SET
+from src.data_loading.label_index import load_label_index, NUM_SPG, NUM_CRYSYSTEM, NUM_BLT
+from src.data_loading.intensity_store import load_intensity_store, PATTERN_LENGTH
+
+# Dataset summaries for EDA, without a notebook and without eval()-ing every row:
+# - spg / crystal system / Bravais lattice histograms and element frequencies come straight from the label index.
+# - Intensity statistics and mean patterns per class are chunked NumPy reductions over the intensity store,
+#   split across a process pool. Each worker returns partial sums which are combined at the end.
+
+# Usage: python -m src.analysis.dataset_summary <db_path> [<db_path> ...]
+
+CLASS_TASKS = {'spg': NUM_SPG, 'crysystem': NUM_CRYSYSTEM, 'blt': NUM_BLT}
+PEAK_BIN_WIDTH = 50
+PEAK_BINS = PATTERN_LENGTH // PEAK_BIN_WIDTH + 1
+
+def _reduce_chunk(args):
+    # chunk_labels: {task: labels of rows start:end}, sliced in the parent so workers don't each load the label index
+    db_path, start, end, chunk_labels = args
+    # Kept float32 (a float64 copy of a chunk is twice the size). Sums are accumulated in float64 without materialising one.
+    intensities = np.asarray(load_intensity_store(db_path)[start:end], dtype=np.float32)
+
+    partial = {
+        'sum': intensities.sum(axis=0, dtype=np.float64),
+        'sum_sq': np.square(intensities).sum(axis=0, dtype=np.float64),
+        'min': intensities.min(axis=0).astype(np.float64),
+        'max': intensities.max(axis=0).astype(np.float64),
+        'nonzero': np.count_nonzero(intensities > 0, axis=0),
+        # Points above 1% of the (max 100) pattern, a rough count of how much of each pattern is peaks
+        'points_above_1pct': np.bincount(np.count_nonzero(intensities > 1.0, axis=1) // PEAK_BIN_WIDTH, minlength=PEAK_BINS)
+    }
+
+    # Per-class pattern sums as one (num_classes, N) @ (N, 3501) float32 matmul per chunk, added up in float64
+    for task, num_classes in CLASS_TASKS.items():
+        task_labels = chunk_labels[task].astype(np.int64)
+        one_hot = np.zeros((num_classes, len(task_labels)), dtype=np.float32)
+        one_hot[task_labels, np.arange(len(task_labels))] = 1
+        partial[f'{task}_pattern_sum'] = (one_hot @ intensities).astype(np.float64)
+    return partial
+
+def summarise_dataset(db_path, num_workers=None, chunk_size=8192):
+    num_workers = num_workers or os.cpu_count() or 1
+
+    # Build (or load) the label index and intensity store up front, so workers only ever read them
+    labels = load_label_index(db_path, num_workers=num_workers)
+    num_samples = len(load_intensity_store(db_path, num_workers=num_workers))
+
+    chunks = [
+        (db_path, start, min(start + chunk_size, num_samples), {task: labels[task][start:start + chunk_size] for task in CLASS_TASKS})
+        for start in range(0, num_samples, chunk_size)
+    ]
+    total = None
+    with Pool(num_workers) as pool:
+        for partial in tqdm(pool.imap_unordered(_reduce_chunk, chunks), total=len(chunks), desc=f"Summarising {os.path.basename(db_path)}"):
+            if total is None:
+                total = partial
+                continue
+            for key, value in partial.items():
+                if key == 'min':
+                    total[key] = np.minimum(total[key], value)
+                elif key == 'max':
+                    total[key] = np.maximum(total[key], value)
+                else:
+                    total[key] = total[key] + value
+
+    mean_pattern = total['sum'] / num_samples
+    summary = {
+        'num_samples': num_samples,
+        'spg_hist': labels['spg_counts'],
+        'crysystem_hist': labels['crysystem_counts'],
+        'blt_hist': labels['blt_counts'],
+        'element_frequency': labels['element_counts'] / num_samples,
+        'mean_pattern': mean_pattern,
+        'std_pattern': np.sqrt(np.maximum(total['sum_sq'] / num_samples - mean_pattern ** 2, 0)),
+        'min_pattern': total['min'],
+        'max_pattern': total['max'],
+        'nonzero_fraction': total['nonzero'] / num_samples,
+        'points_above_1pct_hist': total['points_above_1pct']
+    }
+
+    # Mean pattern per class (zeros for classes with no samples)
+    for task in CLASS_TASKS:
+        counts = labels[f'{task}_counts'][:, None]
+        summary[f'{task}_mean_pattern'] = np.divide(total[f'{task}_pattern_sum'], counts, out=np.zeros_like(total[f'{task}_pattern_sum']), where=counts > 0)
+
+    return summary
+
+def print_summary(name, summary, top_n=10):
+    num_samples = summary['num_samples']
+    print(f"\n=== {name}: {num_samples:,} samples ===")
+
+    present_spg = np.flatnonzero(summary['spg_hist'])
+    print(f"Space groups present: {len(present_spg)} / {NUM_SPG}")
+    top_spg = np.argsort(-summary['spg_hist'])[:top_n]
+    print("Most common space groups: " + ", ".join(f"{spg + 1} ({100 * summary['spg_hist'][spg] / num_samples:.1f}%)" for spg in top_spg))
+
+    print("Crystal systems (1-7): " + ", ".join(f"{c + 1}: {n:,}" for c, n in enumerate(summary['crysystem_hist'])))
+    print("Bravais lattices: " + ", ".join(f"{blt}: {n:,}" for blt, n in zip("PIFABCR", summary['blt_hist'])))
+
+    top_elements = np.argsort(-summary['element_frequency'])[:top_n]
+    print("Most common elements: " + ", ".join(f"{ELEMENT_SET[e]} ({100 * summary['element_frequency'][e]:.1f}%)" for e in top_elements))
+
+    print(f"Intensity range: {summary['min_pattern'].min():.2f} - {summary['max_pattern'].max():.2f}, "
+          f"mean {summary['mean_pattern'].mean():.3f}, mean nonzero fraction {summary['nonzero_fraction'].mean():.3f}")
+
+if __name__ == "__main__":
+    import sys
+    for db_path in sys.argv[1:]:
+        summary = summarise_dataset(db_path)
+        print_summary(os.path.basename(db_path), summary)
+        np.savez(f"{db_path}.summary.npz", **summary)
@@ -0,0 +1,202 @@
+import os
+import numpy as np
+import torch
+import zstandard
+from collections import OrderedDict
+from multiprocessing import Pool
+from torch.utils.data import Dataset, Sampler
+from tqdm import tqdm
+
+from src.data_loading.intensity_store import load_intensity_store, PATTERN_LENGTH
+from src.data_loading.label_index import load_label_index, unpack_elements
+
+# Compressed intensity store: every pattern quantised against its own max, and shards of patterns compressed with zstd.
+#   "uint16":     q = round(x / max * 65535)                       (error <= max / 131070, i.e. < 0.001 for max 100)
+#   "uint8_log":  q = round(log1p(x) / log1p(max) * 255)           (relative error, fine near zero, coarser on tall peaks)
+# The bytes of each shard are split into planes (all high bytes, then all low bytes) before compression,
+# which is what lets zstd exploit the long zero runs between peaks.
+
+# Stored as <db_path>.<codec>.zst (concatenated compressed shards) + <db_path>.<codec>.npz (shard offsets, per-pattern max, settings).
+# Row i is ASE db id i + 1, as everywhere else.
+
+CODECS = {'uint16': np.uint16, 'uint8_log': np.uint8}
+
+def default_store_path(db_path, codec='uint16'):
+    return f"{db_path}.{codec}.zst"
+
+def quantize(intensities, codec='uint16'):
+    # (N, L) float -> ((N, L) uint, (N,) float32 per-pattern max)
+    intensities = np.clip(np.asarray(intensities, dtype=np.float32), 0, None)
+    scales = intensities.max(axis=1).astype(np.float32)
+    safe_scales = np.where(scales > 0, scales, 1.0)[:, None]
+    if codec == 'uint16':
+        return np.rint(intensities / safe_scales * 65535).astype(np.uint16), scales
+    if codec == 'uint8_log':
+        return np.rint(np.log1p(intensities) / np.log1p(safe_scales) * 255).astype(np.uint8), scales
+    raise ValueError(f"Unknown codec: {codec}. Options: {list(CODECS)}")
+
+def dequantize(quantized, scales, codec='uint16'):
+    # Vectorised inverse of quantize(). Works on NumPy arrays, or torch tensors (e.g. on the GPU after transfer).
+    if isinstance(quantized, torch.Tensor):
+        quantized = quantized.float()
+        scales = torch.as_tensor(scales, dtype=torch.float32, device=quantized.device)[:, None]
+        if codec == 'uint16':
+            return quantized * (scales / 65535)
+        return torch.expm1(quantized * (torch.log1p(scales) / 255))
+
+    quantized = quantized.astype(np.float32)
+    scales = np.asarray(scales, dtype=np.float32)[:, None]
+    if codec == 'uint16':
+        return quantized * (scales / 65535)
+    return np.expm1(quantized * (np.log1p(scales) / 255))
+
+def _compress_shard(args):
+    intensity_path, start, end, codec, level = args
+    quantized, scales = quantize(np.load(intensity_path, mmap_mode='r')[start:end], codec)
+    planes = quantized.view(np.uint8).reshape(*quantized.shape, -1).transpose(2, 0, 1)
+    return zstandard.ZstdCompressor(level=level).compress(np.ascontiguousarray(planes).tobytes()), scales
+
+def build_compressed_store(db_path, codec='uint16', shard_size=1024, level=9, num_workers=None):
+    num_workers = num_workers or os.cpu_count() or 1
+    store_path = default_store_path(db_path, codec)
+
+    # Parse the database once into the (uncompressed) intensity store, then compress that shard by shard
+    intensities = load_intensity_store(db_path, num_workers=num_workers)
+    intensity_path = intensities.filename
+    num_samples, length = intensities.shape
+
+    shards = [(intensity_path, start, min(start + shard_size, num_samples), codec, level) for start in range(0, num_samples, shard_size)]
+    offsets = [0]
+    scales = []
+    with open(store_path + '.tmp', 'wb') as f, Pool(num_workers) as pool:
+        for compressed, shard_scales in tqdm(pool.imap(_compress_shard, shards), total=len(shards), desc=f"Compressing {os.path.basename(db_path)}"):
+            f.write(compressed)
+            offsets.append(offsets[-1] + len(compressed))
+            scales.append(shard_scales)
+
+    np.savez(
+        store_path[:-len('.zst')] + '.npz',
+        offsets=np.array(offsets, dtype=np.int64), scales=np.concatenate(scales), codec=codec, shard_size=shard_size, length=length
+    )
+    os.replace(store_path + '.tmp', store_path)
+    return store_path
+
+class CompressedIntensityStore:
+    # Random / batched read access. Decoded shards are kept in a small LRU cache (per process, so per DataLoader worker).
+    def __init__(self, store_path, cache_shards=8):
+        self.store_path = store_path
+        with np.load(store_path[:-len('.zst')] + '.npz') as meta:
+            self.offsets = meta['offsets']
+            self.scales = meta['scales']
+            self.codec = str(meta['codec'])
+            self.shard_size = int(meta['shard_size'])
+            self.length = int(meta['length'])
+        self.cache_shards = cache_shards
+        self._cache = OrderedDict()
+        self._file = None
+        self._decompressor = None
+
+    def __len__(self):
+        return len(self.scales)
+
+    def __getstate__(self):
+        # Open file handles and the cache are not shared with DataLoader workers
+        state = self.__dict__.copy()
+        state.update(_cache=OrderedDict(), _file=None, _decompressor=None)
+        return state
+
+    def _shard(self, shard):
+        if shard in self._cache:
+            self._cache.move_to_end(shard)
+            return self._cache[shard]
+
+        if self._file is None:
+            self._file = open(self.store_path, 'rb')
+            self._decompressor = zstandard.ZstdDecompressor()
+        self._file.seek(self.offsets[shard])
+        raw = self._decompressor.decompress(self._file.read(self.offsets[shard + 1] - self.offsets[shard]))
+
+        dtype = CODECS[self.codec]
+        num_rows = min(self.shard_size, len(self) - shard * self.shard_size)
+        planes = np.frombuffer(raw, dtype=np.uint8).reshape(np.dtype(dtype).itemsize, num_rows, self.length)
+        quantized = np.ascontiguousarray(planes.transpose(1, 2, 0)).view(dtype).reshape(num_rows, self.length)
+
+        self._cache[shard] = quantized
+        if len(self._cache) > self.cache_shards:
+            self._cache.popitem(last=False)
+        return quantized
+
+    def get_quantized(self, indices):
+        # (len(indices), L) quantised rows and their scales, decoding each shard touched once
+        indices = np.asarray(indices, dtype=np.int64)
+        quantized = np.empty((len(indices), self.length), dtype=CODECS[self.codec])
+        shards = indices // self.shard_size
+        for shard in np.unique(shards):
+            rows = np.flatnonzero(shards == shard)
+            quantized[rows] = self._shard(shard)[indices[rows] - shard * self.shard_size]
+        return quantized, self.scales[indices]
+
+    def get(self, indices):
+        # (len(indices), L) float32 intensities
+        return dequantize(*self.get_quantized(indices), self.codec)
+
+def load_compressed_store(db_path, codec='uint16', num_workers=None):
+    # Builds the store first if it is missing or older than the database
+    store_path = default_store_path(db_path, codec)
+    if not os.path.exists(store_path) or os.path.getmtime(store_path) < os.path.getmtime(db_path):
+        build_compressed_store(db_path, codec, num_workers=num_workers)
+    return CompressedIntensityStore(store_path)
+
+# Drop-in replacement for simXRDDataset, reading the compressed store and the label index instead of the ASE database.
+# Implements __getitems__, so the DataLoader fetches (and dequantises) a whole batch at once.
+class CompressedXRDDataset(Dataset):
+    def __init__(self, db_path, codec='uint16'):
+        self.store = load_compressed_store(db_path, codec)
+        labels = load_label_index(db_path)
+        self.spg = torch.from_numpy(labels['spg'].astype(np.int64))
+        self.crysystem = torch.from_numpy(labels['crysystem'].astype(np.int64))
+        self.blt = torch.from_numpy(labels['blt'].astype(np.int64))
+        self.composition = torch.from_numpy(unpack_elements(labels).astype(np.float32))
+        assert self.store.length == PATTERN_LENGTH
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitems__(self, indices):
+        intensities = torch.from_numpy(self.store.get(indices))
+        indices = torch.as_tensor(indices)
+        return list(zip(intensities, self.spg[indices], self.crysystem[indices], self.blt[indices], self.composition[indices]))
+
+    def __getitem__(self, idx):
+        return self.__getitems__([idx])[0]
+
+# Shuffling that keeps reads local: shards are visited in random order, and samples are shuffled within groups of
+# shards_per_group shards. Each DataLoader worker then decodes every shard about once per epoch instead of once per sample.
+class ShardShuffleSampler(Sampler):
+    def __init__(self, num_samples, shard_size, shards_per_group=8, generator=None):
+        self.num_samples = num_samples
+        self.shard_size = shard_size
+        self.shards_per_group = shards_per_group
+        self.generator = generator
+
+    def __len__(self):
+        return self.num_samples
+
+    def __iter__(self):
+        num_shards = (self.num_samples + self.shard_size - 1) // self.shard_size
+        shard_order = torch.randperm(num_shards, generator=self.generator)
+        for group_start in range(0, num_shards, self.shards_per_group):
+            indices = torch.cat([
+                torch.arange(shard * self.shard_size, min((shard + 1) * self.shard_size, self.num_samples))
+                for shard in shard_order[group_start:group_start + self.shards_per_group].tolist()
+            ])
+            yield from indices[torch.randperm(len(indices), generator=self.generator)].tolist()
+
+if __name__ == "__main__":
+    # Usage: python -m src.data_loading.compressed_store <codec> <db_path> [<db_path> ...]
+    import sys
+    codec = sys.argv[1]
+    for db_path in sys.argv[2:]:
+        store_path = build_compressed_store(db_path, codec)
+        original = os.path.getsize(db_path)
+        print(f"{db_path}: {original / 1e6:.1f} MB database -> {os.path.getsize(store_path) / 1e6:.1f} MB {codec} store")
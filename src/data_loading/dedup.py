@@ -0,0 +1,166 @@
+import os
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import ConcatDataset, Subset
+from tqdm import tqdm
+
+from src.data_loading.intensity_store import load_intensity_store
+from src.data_loading.simXRD_data_loader import simXRDDataset
+
+# Near-duplicate detection and leakage-free splitting.
+# simXRD has many polymorphs and near-identical simulated patterns, so random splits put copies of train patterns in val / test.
+# 1. Sketch: the positions of every pattern's strongest peaks, binned to `bin_width` points, hashed into a MinHash signature.
+#    On synthetic patterns with peaks shifted by up to 3 points (tests/test_dedup.py), the defaults find >= 99% of near-duplicates and merge no distinct ones.
+#    Computed in batches straight from the intensity stores, with no Python loop over patterns.
+# 2. LSH: signatures are cut into bands; patterns sharing a band are candidates. Each candidate is checked against its
+#    bucket's first member (estimated Jaccard >= threshold), and matches are merged into connected components.
+#    Every step is linear in the number of patterns (apart from sorting the band keys), with no all-pairs comparison.
+# 3. Split: whole clusters are assigned to train / val / test, so no near-duplicate crosses a split. The deduplicated
+#    train subset keeps one pattern per cluster.
+
+# Saved in one .npz (see save_splits): sources (db paths), offsets, cluster (N,), split (N,) 0/1/2 = train/val/test, dedup_train.
+# Rows are numbered over the sources in order (row i of source s is offsets[s] + i).
+
+SPLITS = ('train', 'val', 'test')
+_PRIME = (1 << 31) - 1
+
+def peak_bins(intensities, num_peaks=20, min_intensity=1.0, bin_width=8):
+    # (N, L) tensor -> (rows, bins) of the num_peaks strongest local maxima >= min_intensity of every pattern.
+    # Every peak also adds the bins on either side, so a peak shifted across a bin edge still shares two of its three bins.
+    # Maxima of a window of +-bin_width points (so a noisy or flat peak top counts once), taking the first point of a tie
+    x = intensities.unsqueeze(1)
+    window_max = F.max_pool1d(x, 2 * bin_width + 1, stride=1, padding=bin_width).squeeze(1)
+    previous_max = F.max_pool1d(F.pad(x[:, :, :-1], (bin_width, 0), value=float('-inf')), bin_width, stride=1).squeeze(1)
+    is_peak = (intensities == window_max) & (intensities > previous_max) & (intensities >= min_intensity)
+    heights = torch.where(is_peak, intensities, torch.zeros_like(intensities))
+    top_heights, top_positions = heights.topk(min(num_peaks, intensities.shape[1]), dim=1)
+    rows, columns = torch.nonzero(top_heights > 0, as_tuple=True)
+    rows, bins = rows.numpy(), (top_positions[rows, columns] // bin_width).numpy()
+    return np.tile(rows, 3), np.concatenate([bins - 1, bins, bins + 1])
+
+def minhash_signatures(rows, bins, num_rows, num_hashes=64, seed=0):
+    # MinHash of every row's set of bins, (num_rows, num_hashes) int64. Rows without peaks get all -1.
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _PRIME, num_hashes, dtype=np.int64)
+    b = rng.integers(0, _PRIME, num_hashes, dtype=np.int64)
+    hashes = (bins[:, None].astype(np.int64) * a + b) % _PRIME
+
+    signatures = np.full((num_rows, num_hashes), -1, dtype=np.int64)
+    if len(rows):
+        order = np.argsort(rows, kind='stable')
+        rows, hashes = rows[order], hashes[order]
+        starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        signatures[rows[starts]] = np.minimum.reduceat(hashes, starts, axis=0)
+    return signatures
+
+def sketch_database(db_path, chunk_size=8192, num_hashes=64, seed=0, **peak_kwargs):
+    intensities = load_intensity_store(db_path)
+    signatures = np.empty((len(intensities), num_hashes), dtype=np.int64)
+    for start in tqdm(range(0, len(intensities), chunk_size), desc=f"Sketching {os.path.basename(db_path)}"):
+        chunk = torch.from_numpy(np.array(intensities[start:start + chunk_size]))
+        rows, bins = peak_bins(chunk, **peak_kwargs)
+        signatures[start:start + len(chunk)] = minhash_signatures(rows, bins, len(chunk), num_hashes, seed)
+    return signatures
+
+def cluster_signatures(signatures, num_bands=16, threshold=0.6):
+    # -> (N,) cluster ids, numbered by the first row of each cluster
+    num_rows, num_hashes = signatures.shape
+    rows_per_band = num_hashes // num_bands
+    has_peaks = signatures[:, 0] >= 0
+    multipliers = np.random.default_rng(num_bands).integers(1, 1 << 62, rows_per_band, dtype=np.int64) | 1
+    edges = []
+
+    for band in tqdm(range(num_bands), desc="LSH bands"):
+        # One int64 key per band (wrapping arithmetic). A rare collision only adds a candidate, which the check below rejects.
+        keys = (signatures[:, band * rows_per_band:(band + 1) * rows_per_band] * multipliers).sum(axis=1)
+        _, bucket = np.unique(keys, return_inverse=True)
+        order = np.argsort(bucket, kind='stable')
+        first = order[np.r_[0, np.flatnonzero(np.diff(bucket[order])) + 1]]
+        heads = np.empty(bucket.max() + 1, dtype=np.int64)
+        heads[bucket[first]] = first
+        head = heads[bucket]
+
+        # Star check against the bucket's first member, vectorised over all candidates of the band
+        candidates = np.flatnonzero((head != np.arange(num_rows)) & has_peaks)
+        similarity = (signatures[candidates] == signatures[head[candidates]]).mean(axis=1)
+        matches = candidates[similarity >= threshold]
+        edges.append(np.stack([matches, head[matches]]))
+
+    # Union of all matches (scipy comes with scikit-learn)
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+    edges = np.concatenate(edges, axis=1)
+    graph = coo_matrix((np.ones(edges.shape[1], dtype=np.int8), (edges[0], edges[1])), shape=(num_rows, num_rows))
+    _, labels = connected_components(graph, directed=False)
+    first_row = np.full(labels.max() + 1, num_rows, dtype=np.int64)
+    np.minimum.at(first_row, labels, np.arange(num_rows))
+    return first_row[labels]
+
+def assign_splits(cluster, fractions=(0.8, 0.1, 0.1), seed=0):
+    # Every cluster goes to one split, drawn with the given probabilities -> (N,) 0 / 1 / 2
+    cluster_ids, inverse = np.unique(cluster, return_inverse=True)
+    cluster_split = np.random.default_rng(seed).choice(len(SPLITS), size=len(cluster_ids), p=np.asarray(fractions) / sum(fractions))
+    return cluster_split[inverse].astype(np.int8)
+
+def representatives(cluster, indices):
+    # The first row of every cluster among indices
+    _, first = np.unique(cluster[indices], return_index=True)
+    return np.sort(indices[first])
+
+def leakage_report(cluster, offsets, sources):
+    # For the splits the sources already are (e.g. train.db, val.db, test.db): the fraction of each later source's rows with a
+    # near-duplicate in the first one, and the duplicate rate within each source
+    first_clusters = set(cluster[offsets[0]:offsets[1]].tolist())
+    report = {}
+    for s, source in enumerate(sources):
+        source_cluster = cluster[offsets[s]:offsets[s + 1]]
+        report[source] = {'rows': len(source_cluster), 'duplicate_fraction': 1 - len(np.unique(source_cluster)) / max(len(source_cluster), 1)}
+        if s > 0:
+            report[source]['leaked_from_first'] = float(np.isin(source_cluster, list(first_clusters)).mean())
+    return report
+
+def deduplicate(db_paths, fractions=(0.8, 0.1, 0.1), num_hashes=64, num_bands=16, threshold=0.6, seed=0, **peak_kwargs):
+    signatures = np.concatenate([sketch_database(db_path, num_hashes=num_hashes, seed=seed, **peak_kwargs) for db_path in db_paths])
+    offsets = np.cumsum([0] + [len(load_intensity_store(db_path)) for db_path in db_paths])
+    cluster = cluster_signatures(signatures, num_bands, threshold)
+    split = assign_splits(cluster, fractions, seed)
+    return {
+        'sources': np.array([os.path.abspath(db_path) for db_path in db_paths]),
+        'offsets': offsets,
+        'cluster': cluster,
+        'split': split,
+        'dedup_train': representatives(cluster, np.flatnonzero(split == 0)),
+    }
+
+def save_splits(path, splits):
+    np.savez(path, **splits)
+
+def load_splits(path):
+    with np.load(path) as data:
+        return {key: data[key] for key in data.files}
+
+def split_datasets(split_path, deduplicated=True):
+    # (train, val, test) datasets over the pooled sources. deduplicated: train on one pattern per cluster.
+    splits = load_splits(split_path)
+    pooled = ConcatDataset([simXRDDataset(str(source)) for source in splits['sources']])
+    train_indices = splits['dedup_train'] if deduplicated else np.flatnonzero(splits['split'] == 0)
+    return tuple(
+        Subset(pooled, (train_indices if i == 0 else np.flatnonzero(splits['split'] == i)).tolist()) for i in range(len(SPLITS))
+    )
+
+if __name__ == "__main__":
+    # Usage: python -m src.data_loading.dedup <output.npz> <db_path> [<db_path> ...]
+    # Pass train.db first to also report how much of the other databases leaks from it.
+    import sys
+    output_path, db_paths = sys.argv[1], sys.argv[2:]
+    splits = deduplicate(db_paths)
+    save_splits(output_path, splits)
+
+    num_rows = len(splits['cluster'])
+    print(f"{num_rows} patterns in {len(np.unique(splits['cluster']))} near-duplicate clusters")
+    for source, stats in leakage_report(splits['cluster'], splits['offsets'], db_paths).items():
+        print(f"  {source}: {stats}")
+    for i, name in enumerate(SPLITS):
+        print(f"  {name}: {(splits['split'] == i).sum()} patterns")
+    print(f"  deduplicated train: {len(splits['dedup_train'])} patterns. Saved to {output_path}")
@@ -0,0 +1,51 @@
+import os
+import numpy as np
+from multiprocessing import Pool
+from ase.db import connect
+from tqdm import tqdm
+
+# Binary intensity store: the intensity strings of an ASE database parsed ONCE (in parallel) into a float32
+# (N, 3501) .npy file next to it. Readers memory-map it, so slicing rows costs a disk read instead of an eval().
+# Row i is ASE db id i + 1, the same as simXRDDataset and the label index.
+
+PATTERN_LENGTH = 3501
+
+def default_store_path(db_path):
+    return f"{db_path}.intensity.npy"
+
+def parse_intensity(intensity_string):
+    # Much faster than eval() on "[0.0, 1.2, ...]"
+    return np.asarray(intensity_string.strip()[1:-1].split(','), dtype=np.float32)
+
+def _read_id_range(args):
+    db_path, store_path, first_id, last_id = args
+    store = np.load(store_path, mmap_mode='r+')
+    for row in connect(db_path).select(f'id>={first_id},id<{last_id}', sort='id'):
+        store[row.id - 1] = parse_intensity(row.intensity)
+    store.flush()
+    return last_id - first_id
+
+def build_intensity_store(db_path, store_path=None, num_workers=None, chunk_size=5000):
+    store_path = store_path or default_store_path(db_path)
+    num_workers = num_workers or os.cpu_count() or 1
+    num_rows = connect(db_path).count()
+
+    # Allocate the file, then every worker fills in its own rows
+    tmp_path = store_path + '.tmp.npy'
+    np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(num_rows, PATTERN_LENGTH)).flush()
+
+    chunks = [(db_path, tmp_path, first_id, min(first_id + chunk_size, num_rows + 1)) for first_id in range(1, num_rows + 1, chunk_size)]
+    with Pool(num_workers) as pool:
+        for _ in tqdm(pool.imap_unordered(_read_id_range, chunks), total=len(chunks), desc=f"Storing intensities of {os.path.basename(db_path)}"):
+            pass
+
+    # Only appears once complete, so an interrupted build is never mistaken for a finished one
+    os.replace(tmp_path, store_path)
+    return np.load(store_path, mmap_mode='r')
+
+def load_intensity_store(db_path, store_path=None, num_workers=None):
+    # Memory-mapped (N, 3501) float32 intensities, building the store first if it is missing or older than the database.
+    store_path = store_path or default_store_path(db_path)
+    if not os.path.exists(store_path) or os.path.getmtime(store_path) < os.path.getmtime(db_path):
+        return build_intensity_store(db_path, store_path, num_workers)
+    return np.load(store_path, mmap_mode='r')
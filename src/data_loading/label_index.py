@@ -0,0 +1,103 @@
+import os
+import numpy as np
+import torch
+from multiprocessing import Pool
+from ase.db import connect
+from torch.utils.data import WeightedRandomSampler
+from tqdm import tqdm
+
+from src.data_loading.simXRD_data_loader import ELEMENT_SET, BLT_ENCODING
+
+# Label index: scans an ASE database ONCE (in parallel) and stores compact per-row label arrays and per-class counts.
+# Anything that only needs labels (class counts, sampling weights, analysis) should read this instead of re-scanning the db.
+
+# Stored in <db_path>.labels.npz:
+#   spg        (N,) int16  0-229 (same encoding as simXRDDataset)
+#   crysystem  (N,) int8   0-6
+#   blt        (N,) int8   0-6 (BLT_ENCODING)
+#   elements   (N, 15) uint8, bit-packed (N, 118) element presence (np.unpackbits(..., axis=1, count=118))
+#   *_counts   per-class counts of each of the above
+
+NUM_SPG = 230
+NUM_CRYSYSTEM = 7
+NUM_BLT = 7
+NUM_ELEMENTS = len(ELEMENT_SET)
+
+_ELEMENT_TO_INDEX = {elem: i for i, elem in enumerate(ELEMENT_SET)}
+
+def default_index_path(db_path):
+    return f"{db_path}.labels.npz"
+
+def row_labels(row):
+    # (spg, crysystem, blt, element indices) of one database row, in the index's encoding
+    tager = eval(row.tager)
+    return tager[0] - 1, tager[1] - 1, BLT_ENCODING[tager[2]], [_ELEMENT_TO_INDEX[elem] for elem in row.symbols if elem in _ELEMENT_TO_INDEX]
+
+def _read_id_range(args):
+    # Worker: read the labels of rows first_id <= id < last_id
+    db_path, first_id, last_id = args
+    num_rows = last_id - first_id
+    spg = np.zeros(num_rows, dtype=np.int16)
+    crysystem = np.zeros(num_rows, dtype=np.int8)
+    blt = np.zeros(num_rows, dtype=np.int8)
+    elements = np.zeros((num_rows, NUM_ELEMENTS), dtype=bool)
+
+    for row in connect(db_path).select(f'id>={first_id},id<{last_id}', sort='id'):
+        i = row.id - first_id
+        spg[i], crysystem[i], blt[i], element_indices = row_labels(row)
+        elements[i, element_indices] = True
+
+    return spg, crysystem, blt, np.packbits(elements, axis=1)
+
+def build_label_index(db_path, index_path=None, num_workers=None, chunk_size=5000):
+    # Assumes contiguous ids 1..N, as simXRDDataset does.
+    index_path = index_path or default_index_path(db_path)
+    num_workers = num_workers or os.cpu_count() or 1
+    num_rows = connect(db_path).count()
+
+    chunks = [(db_path, first_id, min(first_id + chunk_size, num_rows + 1)) for first_id in range(1, num_rows + 1, chunk_size)]
+    with Pool(num_workers) as pool:
+        results = list(tqdm(pool.imap(_read_id_range, chunks), total=len(chunks), desc=f"Indexing {os.path.basename(db_path)}"))
+
+    spg, crysystem, blt, elements = (np.concatenate(arrays) for arrays in zip(*results))
+    index = {
+        'spg': spg,
+        'crysystem': crysystem,
+        'blt': blt,
+        'elements': elements,
+        'spg_counts': np.bincount(spg, minlength=NUM_SPG),
+        'crysystem_counts': np.bincount(crysystem, minlength=NUM_CRYSYSTEM),
+        'blt_counts': np.bincount(blt, minlength=NUM_BLT),
+        'element_counts': np.unpackbits(elements, axis=1, count=NUM_ELEMENTS).sum(axis=0, dtype=np.int64)
+    }
+    np.savez(index_path, **index)
+    return index
+
+def load_label_index(db_path, index_path=None, num_workers=None):
+    # Loads the index, building it first if it is missing or older than the database.
+    index_path = index_path or default_index_path(db_path)
+    if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(db_path):
+        return build_label_index(db_path, index_path, num_workers)
+
+    with np.load(index_path) as data:
+        return {key: data[key] for key in data.files}
+
+def unpack_elements(index):
+    # (N, 118) bool element presence
+    return np.unpackbits(index['elements'], axis=1, count=NUM_ELEMENTS).astype(bool)
+
+def class_balanced_weights(labels, counts, power=0.5):
+    # Per-sample weights proportional to count[class]^-power.
+    # power=0 keeps the natural distribution, power=1 samples every class equally often.
+    class_weights = np.zeros(len(counts), dtype=np.float64)
+    present = counts > 0
+    class_weights[present] = counts[present].astype(np.float64) ** -power
+    return class_weights[labels]
+
+def create_class_balanced_sampler(db_path, task='spg', power=0.5, num_samples=None, generator=None):
+    # WeightedRandomSampler over a database, re-balancing the (heavily skewed) class distribution of `task`.
+    index = load_label_index(db_path)
+    weights = class_balanced_weights(index[task], index[f'{task}_counts'], power)
+    return WeightedRandomSampler(
+        torch.from_numpy(weights), num_samples=num_samples or len(weights), replacement=True, generator=generator
+    )
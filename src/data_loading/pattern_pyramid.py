@@ -0,0 +1,142 @@
+import os
+import math
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch.utils.data import Dataset
+from tqdm import tqdm
+
+from src.data_loading.intensity_store import load_intensity_store, PATTERN_LENGTH
+from src.data_loading.label_index import load_label_index, unpack_elements
+
+# Multi-resolution pattern pyramid: downsampled copies of the intensity store, computed ONCE and stored as float32
+# <db_path>.intensity.<length>.npy memmaps next to it (the full 3501 level is the intensity store itself).
+# Models declare the input length they need (model_input_length) and the loaders read the matching level,
+# so nothing is resampled per batch.
+
+# Downsampling is anti-aliased, peak-preserving pooling:
+# 1. a triangular low-pass about one output bin wide, so a peak is never split between bins or dropped between them,
+# 2. the max over each (fractional) output bin, so peaks keep their height instead of being averaged into the background,
+# 3. renormalisation of every pattern to a max of 100, as the full resolution patterns are.
+
+PYRAMID_LENGTHS = (3501, 1750, 1024, 875)
+
+def default_level_path(db_path, length):
+    return f"{db_path}.intensity.{length}.npy"
+
+def downsample_patterns(intensities, out_length):
+    # (N, L) tensor -> (N, out_length)
+    in_length = intensities.shape[-1]
+    if out_length >= in_length:
+        return intensities.clone()
+
+    half_width = math.ceil(in_length / out_length / 2)
+    kernel = 1 - torch.arange(-half_width, half_width + 1, dtype=intensities.dtype).abs() / (half_width + 1)
+    smoothed = F.conv1d(intensities.unsqueeze(1), (kernel / kernel.sum()).view(1, 1, -1).to(intensities.device), padding=half_width)
+
+    pooled = F.adaptive_max_pool1d(smoothed, out_length).squeeze(1)
+    peak = pooled.amax(dim=-1, keepdim=True)
+    return torch.where(peak > 0, pooled * (100.0 / peak.clamp(min=1e-12)), pooled)
+
+def build_pattern_pyramid(db_path, lengths=PYRAMID_LENGTHS, chunk_size=4096):
+    intensities = load_intensity_store(db_path)
+    for length in lengths:
+        if length == PATTERN_LENGTH:
+            continue
+        level_path = default_level_path(db_path, length)
+
+        # Only appears once complete, as with the intensity store
+        tmp_path = level_path + '.tmp.npy'
+        level = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(len(intensities), length))
+        for start in tqdm(range(0, len(intensities), chunk_size), desc=f"Downsampling {os.path.basename(db_path)} to {length}"):
+            chunk = torch.from_numpy(np.array(intensities[start:start + chunk_size]))
+            level[start:start + chunk_size] = downsample_patterns(chunk, length).numpy()
+        level.flush()
+        del level
+        os.replace(tmp_path, level_path)
+
+def load_pattern_level(db_path, length):
+    # Memory-mapped (N, length) float32 patterns, building the level first if it is missing or older than the database
+    if length == PATTERN_LENGTH:
+        return load_intensity_store(db_path)
+    if length not in PYRAMID_LENGTHS:
+        raise ValueError(f"No pyramid level of length {length}. Options: {PYRAMID_LENGTHS}")
+
+    level_path = default_level_path(db_path, length)
+    if not os.path.exists(level_path) or os.path.getmtime(level_path) < os.path.getmtime(db_path):
+        build_pattern_pyramid(db_path, [length])
+    return np.load(level_path, mmap_mode='r')
+
+def pyramid_level_for(input_length):
+    # Smallest stored level with at least input_length points (e.g. 3500 for the ViTs -> 3501, 1024 for CrystalNet -> 1024)
+    return min((length for length in PYRAMID_LENGTHS if length >= input_length), default=PATTERN_LENGTH)
+
+def model_input_length(model):
+    # Models that need a specific input length say so with an input_length attribute, everything else takes full patterns
+    return getattr(getattr(model, 'module', model), 'input_length', PATTERN_LENGTH)
+
+# Like CompressedXRDDataset, but serving one level of the pyramid. set_length() switches level (e.g. between epochs,
+# see ResolutionSchedule). Levels are memory-mapped on first use, so switching costs nothing after the first epoch.
+class PyramidXRDDataset(Dataset):
+    def __init__(self, db_path, length=PATTERN_LENGTH):
+        self.db_path = db_path
+        self.levels = {}
+        labels = load_label_index(db_path)
+        self.spg = torch.from_numpy(labels['spg'].astype(np.int64))
+        self.crysystem = torch.from_numpy(labels['crysystem'].astype(np.int64))
+        self.blt = torch.from_numpy(labels['blt'].astype(np.int64))
+        self.composition = torch.from_numpy(unpack_elements(labels).astype(np.float32))
+        self.set_length(length)
+
+    def set_length(self, length):
+        self.length = pyramid_level_for(length)
+        # Building in the main process means DataLoader workers only ever open finished levels
+        load_pattern_level(self.db_path, self.length)
+
+    def __getstate__(self):
+        # Memmaps are re-opened by each DataLoader worker
+        state = self.__dict__.copy()
+        state['levels'] = {}
+        return state
+
+    def __len__(self):
+        return len(self.spg)
+
+    def __getitems__(self, indices):
+        if self.length not in self.levels:
+            self.levels[self.length] = load_pattern_level(self.db_path, self.length)
+        indices = np.asarray(indices, dtype=np.int64)
+        intensities = torch.from_numpy(self.levels[self.length][indices])
+        indices = torch.from_numpy(indices)
+        return list(zip(intensities, self.spg[indices], self.crysystem[indices], self.blt[indices], self.composition[indices]))
+
+    def __getitem__(self, idx):
+        return self.__getitems__([idx])[0]
+
+# Coarse-to-fine training: schedule is a list of (length, num_epochs), e.g. [(875, 2), (1750, 2)] trains the first two epochs
+# on 875 point patterns, the next two on 1750 and the rest at the model's own input length.
+# The trainers call set_epoch() before each epoch. Only for models that accept variable input lengths (see MULTI_RESOLUTION_MODELS).
+class ResolutionSchedule:
+    def __init__(self, dataset, schedule, full_length=PATTERN_LENGTH):
+        self.dataset = getattr(dataset, 'dataset', dataset)   # Unwraps IndexedDataset
+        self.schedule = schedule
+        self.full_length = full_length
+
+    def length_for_epoch(self, epoch):
+        for length, num_epochs in self.schedule:
+            if epoch < num_epochs:
+                return length
+            epoch -= num_epochs
+        return self.full_length
+
+    def set_epoch(self, epoch):
+        length = pyramid_level_for(self.length_for_epoch(epoch))
+        if length != self.dataset.length:
+            print(f"Epoch {epoch + 1}: training on {length} point patterns")
+            self.dataset.set_length(length)
+
+if __name__ == "__main__":
+    # Usage: python -m src.data_loading.pattern_pyramid <db_path> [<db_path> ...]
+    import sys
+    for db_path in sys.argv[1:]:
+        build_pattern_pyramid(db_path)
@@ -0,0 +1,283 @@
+import os
+import csv
+import json
+import time
+import fcntl
+import numpy as np
+import torch
+from multiprocessing import Pool
+from ase.db import connect
+from torch.utils.data import Dataset
+from tqdm import tqdm
+
+from src.data_loading.simXRD_data_loader import ELEMENT_SET, BLT_ENCODING
+from src.data_loading.intensity_store import parse_intensity, PATTERN_LENGTH
+from src.data_loading.label_index import NUM_SPG, NUM_CRYSYSTEM, NUM_BLT, NUM_ELEMENTS, row_labels, unpack_elements
+
+# Append-only sharded dataset store, so new simulations can be added without rebuilding (or re-combining) whole databases.
+# A store is a directory of immutable shards plus a manifest listing them:
+#   manifest.json                  shards in order, rows ingested per source, running label counts
+#   shard_<n>.intensity.npy        (rows, 3501) float32, memory-mapped like the intensity store
+#   shard_<n>.labels.npz           the label index arrays of the shard's rows (same format as <db>.labels.npz)
+#   latt_dis.npy                   the d-spacing grid of the patterns (from the first database), for converting .xy files
+# Appending writes new shard files and then replaces the manifest, so readers only ever see complete shards.
+# Label counts in the manifest are updated from each new shard's counts, never by re-scanning.
+
+# Sources:
+# - ASE databases: only rows after the last one ingested from that database are appended, so a database that is still
+#   being written to can be ingested again and again (ids are assumed contiguous from 1, as everywhere else).
+# - .xy batches: a labels CSV (file,spg,crysystem,blt,elements, e.g. "ZINCITE.xy,186,4,P,Zn O", spg / crysystem numbered
+#   from 1 as in the databases' tager) next to its .xy files (2theta, intensity). Each CSV is ingested once.
+# ingest_directory() picks up every new database row and CSV under a directory, optionally in a loop (streaming ingestion).
+
+MANIFEST_NAME = 'manifest.json'
+COUNT_KEYS = ('spg_counts', 'crysystem_counts', 'blt_counts', 'element_counts')
+CU_K_ALPHA = 1.5406
+
+def manifest_path(store_dir):
+    return os.path.join(store_dir, MANIFEST_NAME)
+
+def load_manifest(store_dir):
+    if not os.path.exists(manifest_path(store_dir)):
+        return {'pattern_length': PATTERN_LENGTH, 'num_rows': 0, 'shards': [], 'sources': {},
+                'counts': {key: [0] * size for key, size in zip(COUNT_KEYS, (NUM_SPG, NUM_CRYSYSTEM, NUM_BLT, NUM_ELEMENTS))}}
+    with open(manifest_path(store_dir)) as f:
+        return json.load(f)
+
+def _save_manifest(store_dir, manifest):
+    tmp_path = manifest_path(store_dir) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path(store_dir))
+
+def label_counts(store_dir):
+    # Per-class counts over the whole store, as in the label index ({'spg_counts': (230,) array, ...})
+    return {key: np.asarray(value, dtype=np.int64) for key, value in load_manifest(store_dir)['counts'].items()}
+
+def _shard_labels(spg, crysystem, blt, elements):
+    return {
+        'spg': spg, 'crysystem': crysystem, 'blt': blt, 'elements': elements,
+        'spg_counts': np.bincount(spg, minlength=NUM_SPG),
+        'crysystem_counts': np.bincount(crysystem, minlength=NUM_CRYSYSTEM),
+        'blt_counts': np.bincount(blt, minlength=NUM_BLT),
+        'element_counts': np.unpackbits(elements, axis=1, count=NUM_ELEMENTS).sum(axis=0, dtype=np.int64)
+    }
+
+def _write_shard(store_dir, name, intensities, labels):
+    # Files appear only once complete. Nothing refers to them until the manifest does.
+    base = os.path.join(store_dir, name)
+    np.save(base + '.intensity.tmp.npy', intensities)
+    np.savez(base + '.labels.tmp.npz', **labels)
+    os.replace(base + '.intensity.tmp.npy', base + '.intensity.npy')
+    os.replace(base + '.labels.tmp.npz', base + '.labels.npz')
+    return {key: labels[key] for key in COUNT_KEYS}
+
+def _write_db_shard(args):
+    # Worker: one shard from db rows first_id <= id < last_id, reading each row once for its intensities and labels
+    db_path, store_dir, name, first_id, last_id = args
+    num_rows = last_id - first_id
+    intensities = np.zeros((num_rows, PATTERN_LENGTH), dtype=np.float32)
+    spg = np.zeros(num_rows, dtype=np.int16)
+    crysystem = np.zeros(num_rows, dtype=np.int8)
+    blt = np.zeros(num_rows, dtype=np.int8)
+    elements = np.zeros((num_rows, NUM_ELEMENTS), dtype=bool)
+    for row in connect(db_path).select(f'id>={first_id},id<{last_id}', sort='id'):
+        i = row.id - first_id
+        intensities[i] = parse_intensity(row.intensity)
+        spg[i], crysystem[i], blt[i], element_indices = row_labels(row)
+        elements[i, element_indices] = True
+    labels = _shard_labels(spg, crysystem, blt, np.packbits(elements, axis=1))
+    return name, first_id, last_id, _write_shard(store_dir, name, intensities, labels)
+
+class _StoreLock:
+    # One writer at a time (shard numbering and the manifest). Readers don't need it.
+    def __init__(self, store_dir):
+        os.makedirs(store_dir, exist_ok=True)
+        self.path = os.path.join(store_dir, 'manifest.lock')
+
+    def __enter__(self):
+        self.file = open(self.path, 'w')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+def _commit_shard(store_dir, manifest, name, num_rows, source, counts):
+    manifest['shards'].append({'name': name, 'num_rows': num_rows, 'source': source})
+    manifest['num_rows'] += num_rows
+    for key in COUNT_KEYS:
+        manifest['counts'][key] = (np.asarray(manifest['counts'][key]) + counts[key]).tolist()
+    _save_manifest(store_dir, manifest)
+
+def append_database(store_dir, db_path, shard_size=16384, num_workers=None):
+    # Appends the rows of an ASE database not yet in the store. Returns the number of rows appended.
+    # Shards are committed as they finish, so an interrupted append keeps its finished shards and resumes from there.
+    num_workers = num_workers or os.cpu_count() or 1
+    source = os.path.abspath(db_path)
+    with _StoreLock(store_dir):
+        manifest = load_manifest(store_dir)
+        if not os.path.exists(os.path.join(store_dir, 'latt_dis.npy')):
+            np.save(os.path.join(store_dir, 'latt_dis.npy'), np.asarray(eval(connect(db_path).get(1).latt_dis), dtype=np.float64))
+
+        first_new_id = manifest['sources'].get(source, 0) + 1
+        num_rows = connect(db_path).count()
+        next_shard = len(manifest['shards'])
+        chunks = [
+            (db_path, store_dir, f"shard_{next_shard + i:06d}", first_id, min(first_id + shard_size, num_rows + 1))
+            for i, first_id in enumerate(range(first_new_id, num_rows + 1, shard_size))
+        ]
+        if not chunks:
+            return 0
+
+        with Pool(min(num_workers, len(chunks))) as pool:
+            for name, first_id, last_id, counts in tqdm(pool.imap(_write_db_shard, chunks), total=len(chunks), desc=f"Appending {os.path.basename(db_path)}"):
+                manifest['sources'][source] = last_id - 1
+                _commit_shard(store_dir, manifest, name, last_id - first_id, f"{source}:{first_id}-{last_id - 1}", counts)
+    return num_rows + 1 - first_new_id
+
+def xy_to_pattern(two_theta, intensity, latt_dis, wavelength=CU_K_ALPHA):
+    # Measured / simulated 2theta pattern -> the database format: intensities on the d-spacing grid latt_dis, normalised to 100
+    # (as in analysis/analysis.ipynb)
+    d_spacing = wavelength / (2 * np.sin(np.radians(two_theta) / 2))
+    order = np.argsort(d_spacing)
+    pattern = np.interp(latt_dis, d_spacing[order], intensity[order], left=0, right=0)
+    return (pattern * (100.0 / max(pattern.max(), 1e-12))).astype(np.float32)
+
+def append_xy_batch(store_dir, labels_csv, wavelength=CU_K_ALPHA):
+    # Appends the .xy files listed in labels_csv as one shard. Returns the number of rows appended (0 if already ingested).
+    source = os.path.abspath(labels_csv)
+    element_to_index = {elem: i for i, elem in enumerate(ELEMENT_SET)}
+    with _StoreLock(store_dir):
+        manifest = load_manifest(store_dir)
+        if source in manifest['sources']:
+            return 0
+        latt_dis_path = os.path.join(store_dir, 'latt_dis.npy')
+        if not os.path.exists(latt_dis_path):
+            raise ValueError(f"{store_dir} has no d-spacing grid yet. Append a database before any .xy batches.")
+        latt_dis = np.load(latt_dis_path)
+
+        with open(labels_csv, newline='') as f:
+            rows = list(csv.DictReader(f))
+        intensities = np.zeros((len(rows), PATTERN_LENGTH), dtype=np.float32)
+        elements = np.zeros((len(rows), NUM_ELEMENTS), dtype=bool)
+        for i, row in enumerate(rows):
+            data = np.loadtxt(os.path.join(os.path.dirname(labels_csv), row['file']))
+            intensities[i] = xy_to_pattern(data[:, 0], data[:, 1], latt_dis, wavelength)
+            for elem in row['elements'].split():
+                elements[i, element_to_index[elem]] = True
+
+        labels = _shard_labels(
+            np.array([int(row['spg']) - 1 for row in rows], dtype=np.int16),
+            np.array([int(row['crysystem']) - 1 for row in rows], dtype=np.int8),
+            np.array([BLT_ENCODING[row['blt']] for row in rows], dtype=np.int8),
+            np.packbits(elements, axis=1)
+        )
+        name = f"shard_{len(manifest['shards']):06d}"
+        counts = _write_shard(store_dir, name, intensities, labels)
+        manifest['sources'][source] = len(rows)
+        _commit_shard(store_dir, manifest, name, len(rows), source, counts)
+    return len(rows)
+
+def ingest_directory(store_dir, incoming_dir, shard_size=16384, num_workers=None, wavelength=CU_K_ALPHA):
+    # Appends everything new under incoming_dir: new rows of every .db and every not yet ingested labels CSV
+    num_appended = 0
+    for root, _, files in sorted(os.walk(incoming_dir)):
+        for file in sorted(files):
+            path = os.path.join(root, file)
+            if file.endswith('.db'):
+                num_appended += append_database(store_dir, path, shard_size, num_workers)
+            elif file.endswith('.csv'):
+                num_appended += append_xy_batch(store_dir, path, wavelength)
+    return num_appended
+
+def watch_directory(store_dir, incoming_dir, interval=60, **kwargs):
+    # Streaming ingestion: ingest_directory() every `interval` seconds, until interrupted
+    while True:
+        num_appended = ingest_directory(store_dir, incoming_dir, **kwargs)
+        if num_appended:
+            print(f"Appended {num_appended} rows. {store_dir} now has {load_manifest(store_dir)['num_rows']} rows")
+        time.sleep(interval)
+
+# Training set over a store, with the same samples as simXRDDataset. refresh() picks up shards appended since the last call.
+# The trainers call set_epoch() before each epoch, so new shards join training at the next epoch (DataLoader workers are
+# re-created every epoch and get the refreshed dataset).
+class ShardedXRDDataset(Dataset):
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.shard_names = []
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.labels = {key: [] for key in ('spg', 'crysystem', 'blt', 'composition')}
+        self.shards = {}
+        self.refresh()
+
+    def refresh(self):
+        # Returns the number of new rows
+        new_shards = load_manifest(self.store_dir)['shards'][len(self.shard_names):]
+        for shard in new_shards:
+            with np.load(os.path.join(self.store_dir, shard['name'] + '.labels.npz')) as data:
+                labels = {key: data[key] for key in data.files}
+            self.labels['spg'].append(torch.from_numpy(labels['spg'].astype(np.int64)))
+            self.labels['crysystem'].append(torch.from_numpy(labels['crysystem'].astype(np.int64)))
+            self.labels['blt'].append(torch.from_numpy(labels['blt'].astype(np.int64)))
+            self.labels['composition'].append(torch.from_numpy(unpack_elements(labels).astype(np.float32)))
+            self.shard_names.append(shard['name'])
+            self.offsets = np.append(self.offsets, self.offsets[-1] + shard['num_rows'])
+
+        if new_shards:
+            self.spg, self.crysystem, self.blt, self.composition = (torch.cat(self.labels[key]) for key in ('spg', 'crysystem', 'blt', 'composition'))
+        return sum(shard['num_rows'] for shard in new_shards)
+
+    def set_epoch(self, epoch):
+        num_new = self.refresh()
+        if num_new and epoch > 0:
+            print(f"Epoch {epoch + 1}: {num_new} new samples from {self.store_dir} ({len(self)} in total)")
+
+    def __getstate__(self):
+        # Memmaps are re-opened by each DataLoader worker
+        state = self.__dict__.copy()
+        state['shards'] = {}
+        return state
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def _shard(self, i):
+        if i not in self.shards:
+            self.shards[i] = np.load(os.path.join(self.store_dir, self.shard_names[i] + '.intensity.npy'), mmap_mode='r')
+        return self.shards[i]
+
+    def __getitems__(self, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        shard_ids = np.searchsorted(self.offsets, indices, side='right') - 1
+        intensities = np.empty((len(indices), PATTERN_LENGTH), dtype=np.float32)
+        for i in np.unique(shard_ids):
+            in_shard = shard_ids == i
+            intensities[in_shard] = self._shard(i)[indices[in_shard] - self.offsets[i]]
+        intensities = torch.from_numpy(intensities)
+        indices = torch.from_numpy(indices)
+        return list(zip(intensities, self.spg[indices], self.crysystem[indices], self.blt[indices], self.composition[indices]))
+
+    def __getitem__(self, idx):
+        return self.__getitems__([idx])[0]
+
+if __name__ == "__main__":
+    # Usage: python -m src.data_loading.sharded_store <store_dir> <db / labels csv / directory> [...] [--watch SECONDS]
+    import sys
+    args = sys.argv[1:]
+    interval = None
+    if '--watch' in args:
+        interval = int(args[args.index('--watch') + 1])
+        args = args[:args.index('--watch')] + args[args.index('--watch') + 2:]
+    store_dir, paths = args[0], args[1:]
+
+    if interval is not None:
+        watch_directory(store_dir, paths[0], interval)
+    for path in paths:
+        if os.path.isdir(path):
+            ingest_directory(store_dir, path)
+        elif path.endswith('.csv'):
+            append_xy_batch(store_dir, path)
+        else:
+            append_database(store_dir, path)
+    print(f"{store_dir}: {load_manifest(store_dir)['num_rows']} rows in {len(load_manifest(store_dir)['shards'])} shards")
@@ -3,26 +3,34 @@ import numpy as np
 from ase.db import connect
 from torch.utils.data import Dataset, DataLoader
 
+# For converting element list to a composition vector
+ELEMENT_SET = [
+    'H', 'He', 'Li', 'Be', 'B', 'C', 'N', 'O', 'F', 'Ne',
+    'Na', 'Mg', 'Al', 'Si', 'P', 'S', 'Cl', 'Ar', 'K', 'Ca',
+    'Sc', 'Ti', 'V', 'Cr', 'Mn', 'Fe', 'Co', 'Ni', 'Cu', 'Zn',
+    'Ga', 'Ge', 'As', 'Se', 'Br', 'Kr', 'Rb', 'Sr', 'Y', 'Zr',
+    'Nb', 'Mo', 'Tc', 'Ru', 'Rh', 'Pd', 'Ag', 'Cd', 'In', 'Sn',
+    'Sb', 'Te', 'I', 'Xe', 'Cs', 'Ba', 'La', 'Ce', 'Pr', 'Nd',
+    'Pm', 'Sm', 'Eu', 'Gd', 'Tb', 'Dy', 'Ho', 'Er', 'Tm', 'Yb',
+    'Lu', 'Hf', 'Ta', 'W', 'Re', 'Os', 'Ir', 'Pt', 'Au', 'Hg',
+    'Tl', 'Pb', 'Bi', 'Po', 'At', 'Rn', 'Fr', 'Ra', 'Ac', 'Th',
+    'Pa', 'U', 'Np', 'Pu', 'Am', 'Cm', 'Bk', 'Cf', 'Es', 'Fm',
+    'Md', 'No', 'Lr', 'Rf', 'Db', 'Sg', 'Bh', 'Hs', 'Mt', 'Ds',
+    'Rg', 'Cn', 'Nh', 'Fl', 'Mc', 'Lv', 'Ts', 'Og'
+]
+
+# Convert Bravais lattice type to numerical encoding
+# TODO: ENCODING ARE A, B, and C, PHYSICALLY EQUIVALENT? some sources say yes which confuse me
+# TODO: http://pd.chem.ucl.ac.uk/pdnn/symm3/allsgp.htm
+BLT_ENCODING = {"P": 0, "I": 1, "F": 2, "A": 3, "B": 4, "C": 5, "R": 6}
+
 class simXRDDataset(Dataset):
     def __init__(self, db_path):
         self.db = connect(db_path)
         self.length = self.db.count()
 
         # For converting element list to a composition vector
-        self.element_set = [
-            'H', 'He', 'Li', 'Be', 'B', 'C', 'N', 'O', 'F', 'Ne',
-            'Na', 'Mg', 'Al', 'Si', 'P', 'S', 'Cl', 'Ar', 'K', 'Ca',
-            'Sc', 'Ti', 'V', 'Cr', 'Mn', 'Fe', 'Co', 'Ni', 'Cu', 'Zn',
-            'Ga', 'Ge', 'As', 'Se', 'Br', 'Kr', 'Rb', 'Sr', 'Y', 'Zr',
-            'Nb', 'Mo', 'Tc', 'Ru', 'Rh', 'Pd', 'Ag', 'Cd', 'In', 'Sn',
-            'Sb', 'Te', 'I', 'Xe', 'Cs', 'Ba', 'La', 'Ce', 'Pr', 'Nd',
-            'Pm', 'Sm', 'Eu', 'Gd', 'Tb', 'Dy', 'Ho', 'Er', 'Tm', 'Yb',
-            'Lu', 'Hf', 'Ta', 'W', 'Re', 'Os', 'Ir', 'Pt', 'Au', 'Hg',
-            'Tl', 'Pb', 'Bi', 'Po', 'At', 'Rn', 'Fr', 'Ra', 'Ac', 'Th',
-            'Pa', 'U', 'Np', 'Pu', 'Am', 'Cm', 'Bk', 'Cf', 'Es', 'Fm',
-            'Md', 'No', 'Lr', 'Rf', 'Db', 'Sg', 'Bh', 'Hs', 'Mt', 'Ds',
-            'Rg', 'Cn', 'Nh', 'Fl', 'Mc', 'Lv', 'Ts', 'Og'
-        ]
+        self.element_set = ELEMENT_SET
         self.element_to_index = {elem: i for i, elem in enumerate(self.element_set)}
 
     def __len__(self):
@@ -47,10 +55,7 @@ class simXRDDataset(Dataset):
         space_group -= 1
 
         # Convert Bravais lattice type to numerical encoding
-        # TODO: ENCODING ARE A, B, and C, PHYSICALLY EQUIVALENT? some sources say yes which confuse me
-        # TODO: http://pd.chem.ucl.ac.uk/pdnn/symm3/allsgp.htm
-        blt_encoding = {"P": 0, "I": 1, "F": 2, "A": 3, "B": 4, "C": 5, "R": 6}
-        blt_num = blt_encoding[bravis_latt_type]
+        blt_num = BLT_ENCODING[bravis_latt_type]
 
         # Convert element list to composition vector (Elements are currently one hot encoded)   
         composition = np.zeros(len(self.element_set), dtype=np.float32)
@@ -67,15 +72,61 @@ class simXRDDataset(Dataset):
         
         return intensity_tensor, space_group_tensor, crysystem_tensor, blt_tensor, element_composition_tensor
 
+# Wraps a dataset so each sample also returns its index (e.g. for looking up cached per-sample values)
+class IndexedDataset(Dataset):
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        return (idx, *self.dataset[idx])
+
 # Data loaders for training
-def create_training_data_loaders(train_path, val_path, test_path, batch_size=32, num_workers=3):
-    train_dataset = simXRDDataset(train_path)
-    val_dataset = simXRDDataset(val_path)
-    test_dataset = simXRDDataset(test_path)
+# return_indices: If True, train batches are (indices, intensity, spg, crysystem, blt, composition)
+# train_sampler: Optional sampler for the train set (e.g. create_class_balanced_sampler in label_index.py). Replaces shuffling.
+# intensity_codec: If set ("uint16" or "uint8_log"), read the quantised zstd stores of compressed_store.py instead of the ASE databases
+#                  (built on first use). Without a train_sampler, the train set is then shuffled shard by shard.
+# input_length: If set, read the matching level of the pattern pyramid (pattern_pyramid.py, e.g. 1024 for CrystalNet) instead of the ASE databases.
+#               The train set is a PyramidXRDDataset, so a ResolutionSchedule can switch its level between epochs.
+# train_store: If set, the train set is the sharded store in this directory (sharded_store.py) instead of train_path. Shards appended
+#              during training are picked up between epochs.
+# generator: Optional torch.Generator for the train shuffling / sampling order and the workers' seeds (see reproducibility.py)
+# split_file: If set, the train / val / test sets are the near-duplicate-free splits of dedup.py (pooling its source databases)
+#             instead of train_path, val_path and test_path. dedup_train: train on one pattern per near-duplicate cluster.
+def create_training_data_loaders(train_path, val_path, test_path, batch_size=32, num_workers=3, return_indices=False, train_sampler=None, intensity_codec=None, input_length=None, worker_init_fn=None, train_store=None, split_file=None, dedup_train=True, generator=None):
+    if intensity_codec is not None and input_length is not None:
+        raise ValueError("intensity_codec and input_length can't be used together")
+    if train_store is not None and (intensity_codec is not None or input_length is not None):
+        raise ValueError("train_store can't be used with intensity_codec or input_length")
+    if split_file is not None and (intensity_codec is not None or input_length is not None or train_store is not None):
+        raise ValueError("split_file can't be used with intensity_codec, input_length or train_store")
+
+    # Imported in place as compressed_store.py, pattern_pyramid.py, sharded_store.py and dedup.py themselves build on this module
+    if intensity_codec is not None:
+        from src.data_loading.compressed_store import CompressedXRDDataset, ShardShuffleSampler
+        train_dataset, val_dataset, test_dataset = (CompressedXRDDataset(path, intensity_codec) for path in (train_path, val_path, test_path))
+        if train_sampler is None:
+            train_sampler = ShardShuffleSampler(len(train_dataset), train_dataset.store.shard_size, generator=generator)
+    elif input_length is not None:
+        from src.data_loading.pattern_pyramid import PyramidXRDDataset
+        train_dataset, val_dataset, test_dataset = (PyramidXRDDataset(path, input_length) for path in (train_path, val_path, test_path))
+    elif split_file is not None:
+        from src.data_loading.dedup import split_datasets
+        train_dataset, val_dataset, test_dataset = split_datasets(split_file, dedup_train)
+    elif train_store is not None:
+        from src.data_loading.sharded_store import ShardedXRDDataset
+        train_dataset = ShardedXRDDataset(train_store)
+        val_dataset, test_dataset = simXRDDataset(val_path), simXRDDataset(test_path)
+    else:
+        train_dataset, val_dataset, test_dataset = (simXRDDataset(path) for path in (train_path, val_path, test_path))
+    if return_indices:
+        train_dataset = IndexedDataset(train_dataset)
     
-    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers)
-    val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
-    test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+    train_loader = DataLoader(train_dataset, batch_size=batch_size, shuffle=train_sampler is None, sampler=train_sampler, num_workers=num_workers, worker_init_fn=worker_init_fn, generator=generator)
+    val_loader = DataLoader(val_dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers, worker_init_fn=worker_init_fn)
+    test_loader = DataLoader(test_dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers, worker_init_fn=worker_init_fn)
     
     return train_loader, val_loader, test_loader
 
@@ -0,0 +1,96 @@
+import numpy as np
+import torch
+
+# Cascaded (early-exit) inference: models from cheap to expensive, e.g. smallCNN10_MultiTask -> CNN11_MultiTask.
+# Every pattern goes through the first model. Patterns it is confident about exit there, the rest are compacted into a
+# smaller batch for the next model, and so on. The last model answers whatever is left.
+# Confidence is the smallest top-1 softmax probability over confidence_tasks (e.g. spg and crysystem), so a pattern only
+# exits early if every one of those heads is sure.
+
+# Thresholds are calibrated on val data (calibrate_thresholds), backwards from the last stage: each threshold is the lowest one
+# for which the cascade from that stage on is still at least as accurate as the last model alone (minus max_accuracy_drop).
+
+def confidence(logits, confidence_tasks=('spg', 'crysystem')):
+    # {task: (N, C) logits} -> (N,) confidence
+    return torch.stack([torch.softmax(torch.as_tensor(logits[task]).float(), dim=-1).amax(dim=-1) for task in confidence_tasks]).amin(dim=0)
+
+def _exit_threshold(stage_confidence, stage_correct, fallback_correct, target_accuracy):
+    # Lowest threshold with accuracy >= target_accuracy when the samples at or above it exit here and the others fall back.
+    # Samples are accepted most confident first, so the accuracy after accepting k of them is a cumulative sum.
+    order = np.argsort(-stage_confidence, kind='stable')
+    accepted_correct = np.r_[0, np.cumsum(stage_correct[order])]
+    fallback_left = fallback_correct.sum() - np.r_[0, np.cumsum(fallback_correct[order])]
+    accuracy = (accepted_correct + fallback_left) / len(order)
+
+    # Only cut between distinct confidences, so the threshold accepts exactly the counted samples
+    cuts = np.r_[np.flatnonzero(np.diff(stage_confidence[order]) != 0) + 1, len(order)]
+    valid = cuts[accuracy[cuts] >= target_accuracy - 1e-12]
+    if len(valid) == 0:
+        return float('inf')
+    return float(stage_confidence[order][valid.max() - 1])
+
+def calibrate_thresholds(stage_logits, labels, task='spg', confidence_tasks=('spg', 'crysystem'), max_accuracy_drop=0.0):
+    # stage_logits: [{task: (N, C) logits}] of every stage on the same val patterns. labels: (N,) labels of `task`.
+    # max_accuracy_drop: allowed drop in `task` accuracy (percentage points) below the last stage's.
+    # Returns the exit thresholds of all stages but the last. inf = that stage never answers.
+    correct = [np.asarray(logits[task]).argmax(axis=1) == labels for logits in stage_logits]
+    target_accuracy = correct[-1].mean() - max_accuracy_drop / 100
+
+    thresholds = [None] * (len(stage_logits) - 1)
+    fallback_correct = correct[-1]
+    for stage in reversed(range(len(stage_logits) - 1)):
+        stage_confidence = confidence(stage_logits[stage], confidence_tasks).numpy()
+        thresholds[stage] = _exit_threshold(stage_confidence, correct[stage], fallback_correct, target_accuracy)
+        fallback_correct = np.where(stage_confidence >= thresholds[stage], correct[stage], fallback_correct)
+    return thresholds
+
+class CascadePredictor:
+    # models: Loaded models (e.g. from load_model), cheapest first. thresholds: One per model except the last.
+    # predict() has the TorchPredictor interface ({task: (N, C) logits}). The stage each pattern exited at is in self.last_exits.
+    # Only tasks every stage predicts with the same number of classes are returned (smallFCN_MultiTask has a 6-way blt head).
+    def __init__(self, models, thresholds, device, batch_size=256, confidence_tasks=('spg', 'crysystem')):
+        if len(thresholds) != len(models) - 1:
+            raise ValueError(f"{len(models)} models need {len(models) - 1} thresholds, got {len(thresholds)}")
+        self.models = [model.to(device).eval() for model in models]
+        self.thresholds = thresholds
+        self.device = device
+        self.batch_size = batch_size
+        self.confidence_tasks = confidence_tasks
+        self.last_exits = None
+
+        with torch.no_grad():
+            example = [model(torch.zeros(1, 1, 3501, device=device)) for model in self.models]
+        self.tasks = [task for task in example[-1] if all(task in out and out[task].shape[-1] == example[-1][task].shape[-1] for out in example)]
+        self.num_classes = {task: example[-1][task].shape[-1] for task in self.tasks}
+
+    def _predict_batch(self, batch):
+        outputs = {task: torch.empty(len(batch), self.num_classes[task], device=self.device) for task in self.tasks}
+        exits = torch.full((len(batch),), len(self.models) - 1, dtype=torch.long, device=self.device)
+        remaining = torch.arange(len(batch), device=self.device)
+
+        for stage, model in enumerate(self.models):
+            stage_outputs = model(batch[remaining])
+            if stage < len(self.thresholds):
+                done = confidence(stage_outputs, self.confidence_tasks) >= self.thresholds[stage]
+            else:
+                done = torch.ones(len(remaining), dtype=torch.bool, device=self.device)
+
+            for task in self.tasks:
+                outputs[task][remaining[done]] = stage_outputs[task][done].float()
+            exits[remaining[done]] = stage
+            remaining = remaining[~done]
+            if len(remaining) == 0:
+                break
+        return outputs, exits
+
+    def predict(self, intensities):
+        intensities = torch.as_tensor(np.asarray(intensities), dtype=torch.float32)
+        outputs, exits = [], []
+        with torch.no_grad():
+            for start in range(0, len(intensities), self.batch_size):
+                batch_outputs, batch_exits = self._predict_batch(intensities[start:start + self.batch_size].unsqueeze(1).to(self.device))
+                outputs.append({task: out.cpu().numpy() for task, out in batch_outputs.items()})
+                exits.append(batch_exits.cpu().numpy())
+
+        self.last_exits = np.concatenate(exits)
+        return {task: np.concatenate([out[task] for out in outputs]) for task in self.tasks}
@@ -0,0 +1,42 @@
+import torch
+
+# Batched voxel-grid inference for CrystalNet.ChargeDensityRegressor.
+# ChargeDensityRegressor.forward() takes the pattern / formula / lattice / spacegroup of every query position,
+# so a 64^3 grid would re-run all the embedders and FiLM networks 262,144 times for the same crystal.
+# Here the conditioning embedding and FiLM scale / bias are computed ONCE per crystal,
+# and only the position embedding + regressor blocks run per position, in chunks sized to a memory budget.
+
+# Rough per-position activation size (floats) in the position embedder and regressor blocks, used to size the chunks
+def _floats_per_position(model):
+    return 2 * model.num_freq + 8 * 512
+
+def chunk_size_for_budget(model, memory_budget_mb, dtype=torch.float32):
+    bytes_per_position = _floats_per_position(model) * torch.finfo(dtype).bits // 8
+    return max(1, int(memory_budget_mb * 1024 ** 2) // bytes_per_position)
+
+def grid_positions(resolution, device=None):
+    # (resolution^3, 3) fractional coordinates in [0, 1), ordered so the result reshapes to (x, y, z)
+    axis = torch.arange(resolution, device=device, dtype=torch.float32) / resolution
+    return torch.stack(torch.meshgrid(axis, axis, axis, indexing='ij'), dim=-1).reshape(-1, 3)
+
+def predict_density_grid(model, diffraction_pattern, formula_vector, lattice_vector, spacegroup_vector, resolution=64, memory_budget_mb=256, sample=False):
+    # Inputs are batches of crystals, as for ChargeDensityRegressor.forward (one row per crystal instead of per position).
+    # Returns (num_crystals, resolution, resolution, resolution) densities.
+    model.eval()
+    positions = grid_positions(resolution, formula_vector.device)
+    chunk_size = chunk_size_for_budget(model, memory_budget_mb)
+
+    with torch.no_grad():
+        conditioning_vector = model.conditioning_embedding(diffraction_pattern, formula_vector, lattice_vector, spacegroup_vector, sample)
+        cond_scale, cond_bias = model.film(conditioning_vector)
+
+        densities = torch.empty(len(conditioning_vector), len(positions), device=formula_vector.device)
+        for start in range(0, len(positions), chunk_size):
+            # The position embedding is the same for every crystal, so it is shared across the batch
+            position_embedding = model.position_embedder(positions[start:start + chunk_size])
+            for crystal in range(len(conditioning_vector)):
+                densities[crystal, start:start + chunk_size] = model.regress(
+                    position_embedding, cond_scale[crystal:crystal + 1], cond_bias[crystal:crystal + 1]
+                ).squeeze(1)
+
+    return densities.reshape(-1, resolution, resolution, resolution)
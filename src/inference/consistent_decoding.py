@@ -0,0 +1,79 @@
+from functools import lru_cache
+import numpy as np
+import torch
+import torch.nn.functional as F
+from ase.spacegroup import Spacegroup
+
+from src.data_loading.simXRD_data_loader import BLT_ENCODING
+
+# Physics-consistent decoding of the spg / crysystem / blt heads.
+# An independent argmax per head can give e.g. a cubic space group with a monoclinic crystal system.
+# Instead, every space group is scored with the log-probabilities of itself AND of its (fixed) crystal system and lattice centering:
+#   score[s] = w_spg * log p_spg[s] + w_crysystem * log p_crysystem[crysystem(s)] + w_blt * log p_blt[blt(s)]
+# and the top-k space groups by score come with their crystal system and lattice, so all three always agree.
+# Written with the 230x7 compatibility masks (log of p @ mask.T), so it is one batched matmul + topk on the device.
+
+NUM_SPG = 230
+
+# Crystal system encoding of the simXRD labels (tager[1] - 1), as used in analysis/analysis.ipynb
+CRYSTAL_SYSTEM_ENCODING = {"Cubic": 0, "Hexagonal": 1, "Tetragonal": 2, "Orthorhombic": 3, "Trigonal": 4, "Monoclinic": 5, "Triclinic": 6}
+CRYSTAL_SYSTEM_SPG_RANGES = {
+    "Triclinic": (1, 2), "Monoclinic": (3, 15), "Orthorhombic": (16, 74), "Tetragonal": (75, 142),
+    "Trigonal": (143, 167), "Hexagonal": (168, 194), "Cubic": (195, 230)
+}
+
+@lru_cache(maxsize=None)
+def compatibility_masks():
+    # (230, 7) bool masks: spg -> crystal system, and spg -> lattice centering (first letter of the Hermann-Mauguin symbol)
+    spg_crysystem = np.zeros((NUM_SPG, len(CRYSTAL_SYSTEM_ENCODING)), dtype=bool)
+    for system, (first, last) in CRYSTAL_SYSTEM_SPG_RANGES.items():
+        spg_crysystem[first - 1:last, CRYSTAL_SYSTEM_ENCODING[system]] = True
+
+    spg_blt = np.zeros((NUM_SPG, len(BLT_ENCODING)), dtype=bool)
+    for spg in range(1, NUM_SPG + 1):
+        spg_blt[spg - 1, BLT_ENCODING[Spacegroup(spg).symbol[0]]] = True
+
+    return spg_crysystem, spg_blt
+
+@lru_cache(maxsize=None)
+def _device_masks(device):
+    spg_crysystem, spg_blt = compatibility_masks()
+    return (
+        torch.from_numpy(spg_crysystem).float().to(device),
+        torch.from_numpy(spg_blt).float().to(device),
+        torch.from_numpy(spg_crysystem.argmax(axis=1)).to(device),
+        torch.from_numpy(spg_blt.argmax(axis=1)).to(device)
+    )
+
+def _compatible_log_prob(logits, mask):
+    # (B, C) logits, (230, C) mask -> (B, 230) log of the probability mass compatible with each space group
+    return torch.log((F.softmax(logits.float(), dim=1) @ mask.T).clamp(min=1e-30))
+
+def consistent_decode(spg_logits, crysystem_logits, blt_logits=None, k=1, weights=(1.0, 1.0, 1.0)):
+    # Returns {'spg', 'crysystem', 'blt': (B, k) class indices, 'score': (B, k)}, best first.
+    # blt_logits is ignored if it is None or not 7-way (smallFCN_MultiTask has a 6-way blt head).
+    crysystem_mask, blt_mask, spg_to_crysystem, spg_to_blt = _device_masks(spg_logits.device)
+
+    scores = weights[0] * F.log_softmax(spg_logits.float(), dim=1)
+    scores = scores + weights[1] * _compatible_log_prob(crysystem_logits, crysystem_mask)
+    if blt_logits is not None and blt_logits.shape[1] == blt_mask.shape[1]:
+        scores = scores + weights[2] * _compatible_log_prob(blt_logits, blt_mask)
+
+    top_scores, top_spg = scores.topk(k, dim=1)
+    return {'spg': top_spg, 'crysystem': spg_to_crysystem[top_spg], 'blt': spg_to_blt[top_spg], 'score': top_scores}
+
+def inconsistent_predictions(spg_pred, crysystem_pred, blt_pred=None):
+    # (B,) bool: independent per-head predictions that contradict each other
+    _, _, spg_to_crysystem, spg_to_blt = _device_masks(spg_pred.device)
+    inconsistent = spg_to_crysystem[spg_pred] != crysystem_pred
+    if blt_pred is not None:
+        inconsistent |= spg_to_blt[spg_pred] != blt_pred
+    return inconsistent
+
+def decode_predictions(outputs, k=1, weights=(1.0, 1.0, 1.0)):
+    # Inference path: {task: (N, C) NumPy logits} from TorchPredictor / OnnxPredictor -> {task: (N, k) NumPy indices, 'score': ...}.
+    # For averaged probabilities (EnsemblePredictor) pass np.log(probabilities) instead of logits.
+    as_tensor = lambda x: torch.from_numpy(np.asarray(x, dtype=np.float32))
+    blt_logits = as_tensor(outputs['blt']) if 'blt' in outputs else None
+    decoded = consistent_decode(as_tensor(outputs['spg']), as_tensor(outputs['crysystem']), blt_logits, k, weights)
+    return {key: value.numpy() for key, value in decoded.items()}
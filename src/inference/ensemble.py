@@ -0,0 +1,149 @@
+import copy
+import numpy as np
+import torch
+from torch.func import functional_call, stack_module_state, vmap
+
+# Test-time augmentation (TTA) and checkpoint ensembling.
+# Every pattern is expanded into shifted / stretched views, and all views of a chunk of patterns go through every model
+# as ONE batch. Models of the same architecture are stacked with torch.func and run with vmap over their parameters,
+# so an ensemble of M same-architecture checkpoints costs one (larger) forward pass instead of M.
+
+# predict() returns {task: (N, num_classes) float32 probabilities}: the average over members and views of
+# softmax(logits / T_task) for spg / crysystem / blt (T fitted on val data by fit_temperatures), and of sigmoid(logits) for composition.
+
+CLASSIFICATION_TASKS = ['spg', 'crysystem', 'blt']
+
+def tta_views(intensities, shifts=(0,), stretches=(1.0,)):
+    # (N, L) -> (N, V, L) with V = len(stretches) * len(shifts).
+    # View (stretch, shift) samples the input at (i - shift) / stretch, with linear interpolation and zeros outside the pattern,
+    # imitating small zero offset errors (shift, in points) and lattice strain (stretch). Each view is renormalised to a max of 100.
+    length = intensities.shape[-1]
+    positions = torch.arange(length, device=intensities.device, dtype=torch.float32)
+    src = torch.stack([(positions - shift) / stretch for stretch in stretches for shift in shifts])
+
+    idx0 = src.floor().clamp(0, length - 1).long()
+    idx1 = (idx0 + 1).clamp(max=length - 1)
+    weight = src - src.floor()
+    inside = ((src >= 0) & (src <= length - 1)).float()
+
+    views = (intensities[:, idx0] * (1 - weight) + intensities[:, idx1] * weight) * inside
+    peak = views.amax(dim=-1, keepdim=True)
+    return torch.where(peak > 0, views * (100.0 / peak.clamp(min=1e-12)), views)
+
+def _architecture_key(model):
+    return type(model), tuple((k, tuple(v.shape)) for k, v in model.state_dict().items())
+
+class _ModelGroup:
+    # Same-architecture models, run together with vmap where possible (else one after another)
+    def __init__(self, models):
+        self.models = models
+        self.stacked = None
+        self.logged_path = None
+        if len(models) > 1:
+            params, buffers = stack_module_state(models)
+            base = copy.deepcopy(models[0]).to('meta')
+
+            def call(params, buffers, x):
+                return functional_call(base, (params, buffers), (x,))
+
+            self.stacked = (vmap(call, in_dims=(0, 0, None)), params, buffers)
+
+    def __call__(self, x):
+        # -> {task: (num_models, batch, num_classes)}
+        if self.stacked is not None:
+            try:
+                forward, params, buffers = self.stacked
+                outputs = forward(params, buffers, x)
+                self._log_path("vmap")
+                return outputs if isinstance(outputs, dict) else {'spg': outputs}
+            except RuntimeError as error:
+                # Some ops have no vmap (batching) rule, in which case fall back to looping over the models. Anything else is a real error.
+                message = str(error).lower()
+                if 'vmap' not in message and 'batching rule' not in message:
+                    raise
+                print(f"vmap over {type(self.models[0]).__name__} failed ({error}). Running its models one by one.")
+                self.stacked = None
+
+        outputs = [model(x) for model in self.models]
+        self._log_path("one by one")
+        outputs = [out if isinstance(out, dict) else {'spg': out} for out in outputs]
+        return {task: torch.stack([out[task] for out in outputs]) for task in outputs[0]}
+
+    def _log_path(self, path):
+        # Printed once, and again if the path changes
+        if self.logged_path != path:
+            print(f"Ensemble: {len(self.models)} x {type(self.models[0]).__name__} run {path}")
+            self.logged_path = path
+
+class EnsemblePredictor:
+    # models: Loaded models (e.g. from load_model), in eval mode.
+    # batch_size: Patterns per chunk. Each chunk runs as batch_size * num_views samples through every model.
+    # temperatures: {task: T}. Fitted with fit_temperatures(), 1.0 if not given.
+    def __init__(self, models, device, batch_size=256, shifts=(0,), stretches=(1.0,), temperatures=None):
+        self.device = device
+        self.batch_size = batch_size
+        self.shifts = shifts
+        self.stretches = stretches
+        self.temperatures = dict(temperatures or {})
+
+        groups = {}
+        for model in models:
+            groups.setdefault(_architecture_key(model), []).append(model.to(device).eval())
+        self.groups = [_ModelGroup(group) for group in groups.values()]
+
+        # Only tasks that every member predicts with the same number of classes can be averaged
+        # (e.g. smallFCN_MultiTask has a 6-way blt head, the other multi-task models a 7-way one)
+        with torch.no_grad():
+            example = [group(torch.zeros(1, 1, 3501, device=device)) for group in self.groups]
+        self.tasks = [task for task in example[0] if all(task in out and out[task].shape[-1] == example[0][task].shape[-1] for out in example)]
+        dropped = set(task for out in example for task in out) - set(self.tasks)
+        if dropped:
+            print(f"Ensemble members disagree on the heads for {sorted(dropped)}. These tasks are not predicted.")
+
+    def member_logits(self, intensities):
+        # {task: (num_members * num_views, N, num_classes) float32 logits}
+        intensities = torch.as_tensor(np.asarray(intensities), dtype=torch.float32)
+        outputs = {task: [] for task in self.tasks}
+        with torch.no_grad():
+            for start in range(0, len(intensities), self.batch_size):
+                batch = intensities[start:start + self.batch_size].to(self.device)
+                views = tta_views(batch, self.shifts, self.stretches)
+                num_patterns, num_views, length = views.shape
+                flat_views = views.reshape(num_patterns * num_views, 1, length)
+
+                group_outputs = [group(flat_views) for group in self.groups]
+                for task in self.tasks:
+                    # (num_models, N * V, C) -> (num_models * V, N, C)
+                    logits = torch.cat([out[task] for out in group_outputs])
+                    logits = logits.reshape(len(logits), num_patterns, num_views, -1).transpose(1, 2).reshape(-1, num_patterns, logits.shape[-1])
+                    outputs[task].append(logits.float().cpu())
+
+        return {task: torch.cat(chunks, dim=1).numpy() for task, chunks in outputs.items()}
+
+    def _average_probabilities(self, task, logits):
+        logits = torch.from_numpy(logits)
+        if task == 'composition':
+            return torch.sigmoid(logits).mean(dim=0).numpy()
+        return torch.softmax(logits / self.temperatures.get(task, 1.0), dim=-1).mean(dim=0).numpy()
+
+    def predict(self, intensities):
+        logits = self.member_logits(intensities)
+        return {task: self._average_probabilities(task, task_logits) for task, task_logits in logits.items()}
+
+    def fit_temperatures(self, intensities, labels, grid=np.logspace(-1, 1, 41)):
+        # Temperature scaling of the averaged probabilities: per task, the T on the grid with the lowest NLL on (val) labels.
+        # labels: {task: (N,) int class labels}. Returns the fitted {task: T}.
+        logits = self.member_logits(intensities)
+        for task in CLASSIFICATION_TASKS:
+            if task not in logits or task not in labels:
+                continue
+            task_logits = torch.from_numpy(logits[task])
+            task_labels = torch.as_tensor(np.asarray(labels[task]), dtype=torch.long)
+
+            nll = []
+            for temperature in grid:
+                probabilities = torch.softmax(task_logits / temperature, dim=-1).mean(dim=0)
+                nll.append(-torch.log(probabilities[torch.arange(len(task_labels)), task_labels].clamp(min=1e-12)).mean().item())
+            self.temperatures[task] = float(grid[int(np.argmin(nll))])
+
+        return dict(self.temperatures)
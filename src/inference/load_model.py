@@ -0,0 +1,27 @@
+import torch
+
+# Config
+import scripts.training.config_training as config_training
+
+# Functions
+from src.training.pruning import PRUNABLE_CONVS, resize_to_state_dict
+
+# Loads a trained state dict saved by save_model() in main_training.py into a fresh MODEL_CLASS model.
+def load_model(model_type, model_path, device, **model_kwargs):
+    model_class = config_training.MODEL_CLASS[model_type]
+    model = model_class(**model_kwargs)
+
+    state_dict = torch.load(model_path, map_location=device)
+
+    # Models trained with nn.DataParallel have their keys prefixed with 'module.'
+    state_dict = {k[len('module.'):] if k.startswith('module.') else k: v for k, v in state_dict.items()}
+
+    # Pruned models have smaller trunk layers than the default architecture
+    default_shapes = {k: v.shape for k, v in model.state_dict().items()}
+    if model_type in PRUNABLE_CONVS and any(state_dict[k].shape != shape for k, shape in default_shapes.items() if k in state_dict):
+        model = resize_to_state_dict(model, model_type, state_dict)
+
+    model.load_state_dict(state_dict)
+    model = model.to(device)
+    model.eval()
+    return model
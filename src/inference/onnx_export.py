@@ -0,0 +1,55 @@
+import numpy as np
+import torch
+import torch.nn as nn
+
+from src.inference.predictor import TorchPredictor
+from src.inference.onnx_predictor import OnnxPredictor
+
+# Exports any MODEL_CLASS model to ONNX with a dynamic batch axis.
+# The multi-task dict outputs become named graph outputs ('spg', 'crysystem', 'blt', 'composition').
+# Single-task models get one output named 'spg'.
+
+class _NamedOutputs(nn.Module):
+    # ONNX graphs return tuples, so fix the order of the dict outputs
+    def __init__(self, model, output_names):
+        super(_NamedOutputs, self).__init__()
+        self.model = model
+        self.output_names = output_names
+
+    def forward(self, x):
+        outputs = self.model(x)
+        if isinstance(outputs, dict):
+            return tuple(outputs[name] for name in self.output_names)
+        return outputs
+
+def export_to_onnx(model, onnx_path, input_length=3501, opset_version=17):
+    model = model.cpu().eval()
+    example_input = torch.zeros(2, 1, input_length)
+
+    with torch.no_grad():
+        example_outputs = model(example_input)
+    output_names = list(example_outputs.keys()) if isinstance(example_outputs, dict) else ['spg']
+
+    dynamic_axes = {name: {0: 'batch'} for name in ['intensity'] + output_names}
+    torch.onnx.export(
+        _NamedOutputs(model, output_names), (example_input,), onnx_path,
+        input_names=['intensity'], output_names=output_names, dynamic_axes=dynamic_axes,
+        opset_version=opset_version, dynamo=False
+    )
+    return output_names
+
+def check_onnx_parity(model, onnx_path, batch_size=7, input_length=3501, atol=1e-4, rtol=1e-3):
+    # Compares the ONNX Runtime outputs against eager PyTorch on random patterns.
+    # An odd batch size checks that the batch axis really is dynamic.
+    intensities = np.random.default_rng(0).random((batch_size, input_length), dtype=np.float32) * 100
+
+    torch_outputs = TorchPredictor(model, torch.device("cpu")).predict(intensities)
+    onnx_outputs = OnnxPredictor(onnx_path).predict(intensities)
+
+    max_errors = {}
+    for task, expected in torch_outputs.items():
+        max_errors[task] = float(np.abs(onnx_outputs[task] - expected).max())
+        if not np.allclose(onnx_outputs[task], expected, atol=atol, rtol=rtol):
+            raise AssertionError(f"ONNX output '{task}' does not match PyTorch (max abs error {max_errors[task]:.2e})")
+
+    return max_errors
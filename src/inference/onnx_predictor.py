@@ -0,0 +1,27 @@
+import os
+import numpy as np
+import onnxruntime as ort
+
+# ONNX Runtime inference backend. Same interface as TorchPredictor, but only needs numpy + onnxruntime (no torch install).
+# Runs with all graph optimisations (constant folding, op fusion) and multithreaded kernels.
+
+class OnnxPredictor:
+    # num_threads: Intra-op threads. None = use all cores.
+    def __init__(self, onnx_path, batch_size=256, num_threads=None, providers=None):
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads if num_threads is not None else (os.cpu_count() or 1)
+
+        self.session = ort.InferenceSession(onnx_path, options, providers=providers or ['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_names = [output.name for output in self.session.get_outputs()]
+        self.batch_size = batch_size
+
+    def predict(self, intensities):
+        intensities = np.asarray(intensities, dtype=np.float32)
+        outputs = []
+        for start in range(0, len(intensities), self.batch_size):
+            batch = intensities[start:start + self.batch_size, None, :]
+            outputs.append(self.session.run(self.output_names, {self.input_name: batch}))
+
+        return {name: np.concatenate([out[i] for out in outputs]) for i, name in enumerate(self.output_names)}
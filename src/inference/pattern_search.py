@@ -0,0 +1,221 @@
+import time
+import numpy as np
+import torch
+from tqdm import tqdm
+from ase.db import connect
+
+# FAISS is optional. Without it the search runs on the NumPy IVF index below.
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# Nearest-neighbour pattern search: "which known phases look like this pattern?"
+# 1. Run a trained model's shared trunk over a database and keep the L2-normalised embeddings.
+# 2. Build an inverted file (IVF) index: k-means the embeddings into lists, and at query time only
+#    score the lists whose centroids are closest to the query.
+# Since embeddings are normalised, inner product = cosine similarity.
+
+# The shared trunk output of each model is the input to its spg head, so we grab it with a forward pre-hook.
+EMBEDDING_LAYER = {
+    "CNN10": "fcl2",
+    "CNN10_MultiTask": "fcl_spg",
+    "CNN11": "MLP",
+    "CNN11_MultiTask": "MLP_spg_out",
+    "smallCNN10_MultiTask": "fcl_spg",
+    "smallFCN": "spg_conv_1",
+    "smallFCN_MultiTask": "spg_conv_1",
+    "smallFCN_SelfAttention_MultiTask": "spg_conv_1",
+    "experimentalFCN": "spg_out",
+    "MLP10": "fc5",
+    "ViT1D_MultiTask": "spg_head",
+    "ViT1D_MultiTask_Patch35": "spg_head",
+    "ViT1D_MultiTask_Patch50": "spg_head",
+    "ViT1D_MultiTask_Patch100": "spg_head"
+}
+
+def extract_embeddings(model, model_type, data):
+    # data: (batch_size, 1, 3501). Returns (batch_size, embedding_dim), L2-normalised.
+    layer = model.get_submodule(EMBEDDING_LAYER[model_type])
+    captured = {}
+
+    def hook(module, inputs):
+        captured['embedding'] = inputs[0].flatten(start_dim=1)
+
+    handle = layer.register_forward_pre_hook(hook)
+    try:
+        model(data)
+    finally:
+        handle.remove()
+
+    return torch.nn.functional.normalize(captured['embedding'].float(), dim=1)
+
+def export_embeddings(model, model_type, data_loader, device, save_path=None):
+    # Embeds a whole database in batches. If save_path is given, the embeddings are written straight to a
+    # .npy memmap so the full array never has to be held in memory.
+    model.eval()
+    num_samples = len(data_loader.dataset)
+    embeddings = None
+    space_groups = np.zeros(num_samples, dtype=np.int16)
+
+    start = 0
+    with torch.no_grad():
+        for data, spg, *_ in tqdm(data_loader, desc="Exporting embeddings"):
+            batch_embeddings = extract_embeddings(model, model_type, data.unsqueeze(1).to(device)).cpu().numpy()
+
+            if embeddings is None:
+                shape = (num_samples, batch_embeddings.shape[1])
+                if save_path is not None:
+                    embeddings = np.lib.format.open_memmap(save_path, mode='w+', dtype=np.float32, shape=shape)
+                else:
+                    embeddings = np.zeros(shape, dtype=np.float32)
+
+            end = start + len(batch_embeddings)
+            embeddings[start:end] = batch_embeddings
+            space_groups[start:end] = spg.numpy() + 1  # Add the one back in (labels are 0-229 in the dataset)
+            start = end
+
+    if save_path is not None:
+        embeddings.flush()
+    return embeddings, space_groups
+
+def read_formulas(db_path):
+    # Chemical formulas in database order (ASE db ids start at 1, our row indices start at 0)
+    return np.array([row.chem_form for row in connect(db_path).select()], dtype=object)
+
+def _kmeans(vectors, num_clusters, num_iters=10, sample_size=100000, seed=0):
+    # Spherical k-means on a random sample (centroids are re-normalised every iteration)
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), size=min(sample_size, len(vectors)), replace=False)]
+    centroids = sample[rng.choice(len(sample), size=num_clusters, replace=False)].copy()
+
+    for _ in range(num_iters):
+        assignments = _assign(sample, centroids)
+
+        # Sum the members of each cluster in one pass (empty clusters keep their old centroid)
+        order = np.argsort(assignments, kind='stable')
+        clusters, starts = np.unique(assignments[order], return_index=True)
+        centroids[clusters] = np.add.reduceat(sample[order], starts, axis=0)
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+    return centroids
+
+def _assign(vectors, centroids, chunk_size=65536):
+    return np.concatenate([
+        np.argmax(vectors[i:i + chunk_size] @ centroids.T, axis=1)
+        for i in range(0, len(vectors), chunk_size)
+    ])
+
+class PatternSearchIndex:
+    # embeddings: (N, D) L2-normalised float32. formulas / space_groups: (N,) metadata returned with each match.
+    # num_lists: Number of IVF lists. Defaults to ~4 * sqrt(N). Use 1 for exact (brute force) search.
+    # num_probe: Number of lists scored per query. Higher = better recall, slower.
+    def __init__(self, embeddings, formulas, space_groups, num_lists=None, num_probe=8, use_faiss=True, seed=0):
+        self.formulas = np.asarray(formulas, dtype=object)
+        self.space_groups = np.asarray(space_groups)
+        self.num_probe = num_probe
+
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if num_lists is None:
+            num_lists = max(1, min(int(4 * np.sqrt(len(embeddings))), len(embeddings) // 39))
+
+        # Build the inverted lists. Vectors are reordered so that each list is a contiguous block.
+        if num_lists > 1:
+            self.centroids = _kmeans(embeddings, num_lists, seed=seed)
+        else:
+            self.centroids = embeddings.mean(axis=0, keepdims=True)
+        assignments = _assign(embeddings, self.centroids)
+        self.row_ids = np.argsort(assignments, kind='stable')
+        self.embeddings = embeddings[self.row_ids]
+        self.list_offsets = np.searchsorted(assignments[self.row_ids], np.arange(len(self.centroids) + 1))
+
+        self.faiss_index = self._build_faiss_index() if (use_faiss and faiss is not None) else None
+
+    def _build_faiss_index(self):
+        # Reuse our centroids as the coarse quantizer so both backends return the same candidates.
+        dim = self.embeddings.shape[1]
+        quantizer = faiss.IndexFlatIP(dim)
+        quantizer.add(self.centroids.astype(np.float32))
+        index = faiss.IndexIVFFlat(quantizer, dim, len(self.centroids), faiss.METRIC_INNER_PRODUCT)
+        index.is_trained = True
+        index.add(self.embeddings)
+        index.nprobe = self.num_probe
+        index.quantizer_ref = quantizer  # Keep the quantizer alive
+        return index
+
+    def __len__(self):
+        return len(self.embeddings)
+
+    def search(self, queries, k=5):
+        # queries: (Q, D) L2-normalised embeddings. Returns (similarities, row_ids), both (Q, k).
+        # Row ids index the original database order (row_id + 1 is the ASE db id). Missing matches are -1.
+        queries = np.ascontiguousarray(np.atleast_2d(queries), dtype=np.float32)
+
+        if self.faiss_index is not None:
+            similarities, positions = self.faiss_index.search(queries, k)
+            row_ids = np.where(positions >= 0, self.row_ids[np.maximum(positions, 0)], -1)
+            return similarities, row_ids
+
+        num_probe = min(self.num_probe, len(self.centroids))
+        probe_lists = np.argpartition(-(queries @ self.centroids.T), num_probe - 1, axis=1)[:, :num_probe]
+
+        similarities = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        row_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for q, lists in enumerate(probe_lists):
+            candidates = np.concatenate([np.arange(self.list_offsets[l], self.list_offsets[l + 1]) for l in lists])
+            if len(candidates) == 0:
+                continue
+            scores = self.embeddings[candidates] @ queries[q]
+            top = min(k, len(candidates))
+            best = np.argpartition(-scores, top - 1)[:top]
+            best = best[np.argsort(-scores[best])]
+            similarities[q, :top] = scores[best]
+            row_ids[q, :top] = self.row_ids[candidates[best]]
+
+        return similarities, row_ids
+
+    def matches(self, queries, k=5):
+        # Same as search, but returns a list (per query) of dicts with the matching rows' metadata.
+        similarities, row_ids = self.search(queries, k)
+        return [
+            [
+                {'row_id': int(r), 'formula': self.formulas[r], 'spg': int(self.space_groups[r]), 'similarity': float(s)}
+                for s, r in zip(query_similarities, query_row_ids) if r >= 0
+            ]
+            for query_similarities, query_row_ids in zip(similarities, row_ids)
+        ]
+
+    def save(self, path):
+        np.savez(
+            path,
+            embeddings=self.embeddings, row_ids=self.row_ids, centroids=self.centroids, list_offsets=self.list_offsets,
+            formulas=self.formulas.astype(str), space_groups=self.space_groups, num_probe=self.num_probe
+        )
+
+    @classmethod
+    def load(cls, path, use_faiss=True):
+        # Restores a saved index without re-clustering
+        data = np.load(path)
+        index = cls.__new__(cls)
+        index.embeddings = data['embeddings']
+        index.row_ids = data['row_ids']
+        index.centroids = data['centroids']
+        index.list_offsets = data['list_offsets']
+        index.formulas = data['formulas'].astype(object)
+        index.space_groups = data['space_groups']
+        index.num_probe = int(data['num_probe'])
+        index.faiss_index = index._build_faiss_index() if (use_faiss and faiss is not None) else None
+        return index
+
+def query_patterns(model, model_type, index, intensities, device, k=5):
+    # intensities: (Q, 3501) raw patterns (normalised to 100, as in the database). Returns index.matches() for each.
+    model.eval()
+    data = torch.as_tensor(np.asarray(intensities), dtype=torch.float32).unsqueeze(1).to(device)
+
+    start_time = time.time()
+    with torch.no_grad():
+        queries = extract_embeddings(model, model_type, data).cpu().numpy()
+    results = index.matches(queries, k)
+    print(f"Queried {len(queries)} patterns in {1000 * (time.time() - start_time):.1f} ms")
+
+    return results
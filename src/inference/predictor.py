@@ -0,0 +1,25 @@
+import numpy as np
+import torch
+
+# PyTorch inference backend.
+# predict() takes raw patterns (N, 3501) and returns {task: (N, num_classes) float32 logits} as NumPy arrays.
+# Single-task models return {'spg': logits}. OnnxPredictor in onnx_predictor.py has the same interface.
+
+class TorchPredictor:
+    def __init__(self, model, device, batch_size=256):
+        self.model = model.to(device).eval()
+        self.device = device
+        self.batch_size = batch_size
+
+    def predict(self, intensities):
+        intensities = torch.as_tensor(np.asarray(intensities), dtype=torch.float32)
+        outputs = []
+        with torch.no_grad():
+            for start in range(0, len(intensities), self.batch_size):
+                batch = intensities[start:start + self.batch_size].unsqueeze(1).to(self.device)
+                batch_outputs = self.model(batch)
+                if not isinstance(batch_outputs, dict):
+                    batch_outputs = {'spg': batch_outputs}
+                outputs.append({task: out.float().cpu().numpy() for task, out in batch_outputs.items()})
+
+        return {task: np.concatenate([out[task] for out in outputs]) for task in outputs[0]}
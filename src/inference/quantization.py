@@ -0,0 +1,117 @@
+import io
+import time
+import copy
+import torch
+import torch.nn as nn
+from tqdm import tqdm
+from torch.ao.quantization import quantize_dynamic, get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+from torch.ao.quantization.fx.custom_config import PrepareCustomConfig
+
+# Config
+import scripts.training.config_training as config_training
+
+from src.models.CNN11 import FixedLinearUpsample, LinearUpsample
+
+# int8 quantized CPU inference.
+# - "dynamic": Linear weights are stored as int8 and activations are quantized on the fly. No calibration needed.
+#              Good for the Linear-heavy models (MLP10, CNN10's 4992->2000 layer, CNN11's 12160->2300 heads).
+# - "static":  FX graph mode quantization of the whole model (Conv1d trunks + Linears). Activation ranges are
+#              calibrated once on a slice of data, so everything runs on int8 kernels.
+
+# Note: Quantized models only run on CPU.
+# Note: The ViT models use einops and are not FX traceable, so only use "dynamic" for them.
+
+QUANTIZATION_MODES = ["dynamic", "static"]
+
+def _prepare_custom_config():
+    # CNN11's upsampling stays a float leaf module: the fixed one has shape dependent control flow, and there is no quantized linear interpolation
+    return PrepareCustomConfig().set_non_traceable_module_classes([FixedLinearUpsample, LinearUpsample])
+
+def calibrate(model, data_loader, num_batches):
+    # Run a few batches through the observers of a prepared model to record activation ranges
+    with torch.no_grad():
+        for batch_idx, (data, *_) in enumerate(tqdm(data_loader, desc="Calibrating", total=min(num_batches, len(data_loader)))):
+            if batch_idx >= num_batches:
+                break
+            model(data.unsqueeze(1))
+
+def quantize_model(model, mode, calibration_loader=None, num_calibration_batches=32, backend="x86"):
+    # Returns an int8 copy of a float model (the float model is left untouched)
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode: {mode}. Options: {QUANTIZATION_MODES}")
+
+    torch.backends.quantized.engine = backend
+    model = copy.deepcopy(model).cpu().eval()
+
+    if mode == "dynamic":
+        return quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+    if calibration_loader is None:
+        raise ValueError("Static quantization needs a calibration_loader")
+
+    example_inputs = (torch.zeros(1, 1, 3501),)
+    prepared = prepare_fx(model, get_default_qconfig_mapping(backend), example_inputs, prepare_custom_config=_prepare_custom_config())
+    calibrate(prepared, calibration_loader, num_calibration_batches)
+    return convert_fx(prepared)
+
+def load_quantized_model(model_type, model_path, mode, backend="x86"):
+    # Rebuilds the quantized architecture and loads a state dict saved from quantize_model()
+    torch.backends.quantized.engine = backend
+    model = config_training.MODEL_CLASS[model_type]().eval()
+
+    if mode == "dynamic":
+        model = quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    else:
+        # Observers are uncalibrated here, but every scale / zero point is overwritten by the state dict
+        example_inputs = (torch.zeros(1, 1, 3501),)
+        prepared = prepare_fx(model, get_default_qconfig_mapping(backend), example_inputs, prepare_custom_config=_prepare_custom_config())
+        prepared(*example_inputs)
+        model = convert_fx(prepared)
+
+    model.load_state_dict(torch.load(model_path, map_location="cpu"))
+    return model
+
+def model_size_mb(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes / 1024**2
+
+def compare_with_float(float_model, quantized_model, data_loader, num_batches=None):
+    # Top-1 spg accuracy, agreement and CPU latency of the quantized model against the fp32 model
+    float_model = float_model.cpu().eval()
+    correct = {'fp32': 0, 'int8': 0}
+    times = {'fp32': 0.0, 'int8': 0.0}
+    agree = 0
+    total = 0
+
+    with torch.no_grad():
+        for batch_idx, (data, spg, *_) in enumerate(tqdm(data_loader, desc="Comparing fp32 vs int8")):
+            if num_batches is not None and batch_idx >= num_batches:
+                break
+            data = data.unsqueeze(1)
+
+            preds = {}
+            for name, model in [('fp32', float_model), ('int8', quantized_model)]:
+                start_time = time.perf_counter()
+                outputs = model(data)
+                times[name] += time.perf_counter() - start_time
+
+                spg_out = outputs['spg'] if isinstance(outputs, dict) else outputs
+                preds[name] = spg_out.argmax(dim=1)
+                correct[name] += preds[name].eq(spg).sum().item()
+
+            agree += preds['fp32'].eq(preds['int8']).sum().item()
+            total += data.size(0)
+
+    report = {
+        'fp32_spg_accuracy': 100. * correct['fp32'] / total,
+        'int8_spg_accuracy': 100. * correct['int8'] / total,
+        'spg_agreement': 100. * agree / total,
+        'fp32_ms_per_sample': 1000 * times['fp32'] / total,
+        'int8_ms_per_sample': 1000 * times['int8'] / total,
+        'fp32_size_mb': model_size_mb(float_model),
+        'int8_size_mb': model_size_mb(quantized_model)
+    }
+    report['speedup'] = report['fp32_ms_per_sample'] / report['int8_ms_per_sample']
+    return report
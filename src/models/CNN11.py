@@ -1,5 +1,7 @@
+import torch
 from torch import nn
 import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
 
 # Model from:
 # https://github.com/compasszzn/XRDBench/blob/main/model/CNN11.py
@@ -8,25 +10,31 @@ import torch.nn.functional as F
 
 # Mofidications:
 # A basic augmentation to make CNNeleven a multi-task learner in CNNeleven_MultiTask.
-# 
+# An opt-in memory_efficient mode. The upsampling to 8500 points uses precomputed indices and weights (FixedLinearUpsample,
+# equal to F.interpolate up to float32 rounding), and the upsampling + conv trunk is activation checkpointed during training
+# (recomputed in the backward pass). Without it, the models compute exactly as before (F.interpolate, no checkpointing).
+# This means only the 12160 flattened features are kept in memory for each sample. State dicts are unchanged.
 
 class CNN11(nn.Module):
-    def __init__(self):
+    def __init__(self, memory_efficient=False):
         super(CNN11, self).__init__()
+        self.memory_efficient = memory_efficient
+        self.upsample = FixedLinearUpsample(3501, 8500) if memory_efficient else LinearUpsample(8500)
         self.cnn = NoPoolCNN()
         mlp_in_features = 12160
         self.MLP = Predictor(mlp_in_features, 230)
         
     def forward(self, x):
-        x = F.interpolate(x,size=8500,mode='linear', align_corners=False)
-        x = self.cnn(x)
+        x = upsample_and_cnn(self, x)
         x = self.MLP(x)
         return x
     
 class CNN11_MultiTask(nn.Module):
-    def __init__(self):
+    def __init__(self, memory_efficient=False):
         super(CNN11_MultiTask, self).__init__()
 
+        self.memory_efficient = memory_efficient
+        self.upsample = FixedLinearUpsample(3501, 8500) if memory_efficient else LinearUpsample(8500)
         self.cnn = NoPoolCNN()
 
         mlp_in_features = 12160
@@ -37,8 +45,7 @@ class CNN11_MultiTask(nn.Module):
         self.MLP_composition_out = Predictor(mlp_in_features, 118)
         
     def forward(self, x):
-        x = F.interpolate(x,size=8500,mode='linear', align_corners=False)
-        x = self.cnn(x)
+        x = upsample_and_cnn(self, x)
 
         spg_out = self.MLP_spg_out(x)
         crysystem_out = self.MLP_crysystem_out(x)
@@ -54,6 +61,50 @@ class CNN11_MultiTask(nn.Module):
     
 ################# Classes ##################
 
+def upsample_and_cnn(model, x):
+    def trunk(x):
+        return model.cnn(model.upsample(x))
+
+    # Checkpointing only pays off when there is a backward pass to save activations for
+    if model.memory_efficient and model.training and torch.is_grad_enabled():
+        return checkpoint(trunk, x, use_reentrant=False)
+    return trunk(x)
+
+class LinearUpsample(nn.Module):
+    # The original F.interpolate upsampling, as a module (no parameters) so it can be swapped for FixedLinearUpsample
+    def __init__(self, out_length):
+        super(LinearUpsample, self).__init__()
+        self.out_length = out_length
+
+    def forward(self, x):
+        return F.interpolate(x, size=self.out_length, mode='linear', align_corners=False)
+
+class FixedLinearUpsample(nn.Module):
+    # Matches F.interpolate(x, size=out_length, mode='linear', align_corners=False) to float32 rounding of the source coordinates
+    # (max abs diff ~6e-5 on inputs in [0, 1], checked in tests/test_fixed_linear_upsample.py),
+    # but with the source indices and weights precomputed once for the expected input length.
+    # Buffers are non-persistent so the state dict is the same as before.
+    def __init__(self, in_length, out_length):
+        super(FixedLinearUpsample, self).__init__()
+        self.in_length = in_length
+        self.out_length = out_length
+
+        # Same source coordinate rule as PyTorch's linear interpolation with align_corners=False
+        scale = in_length / out_length
+        src = ((torch.arange(out_length, dtype=torch.float32) + 0.5) * scale - 0.5).clamp(min=0)
+        idx0 = src.floor().long().clamp(max=in_length - 1)
+        idx1 = (idx0 + 1).clamp(max=in_length - 1)
+
+        self.register_buffer('idx0', idx0, persistent=False)
+        self.register_buffer('idx1', idx1, persistent=False)
+        self.register_buffer('weight', src - idx0, persistent=False)
+
+    def forward(self, x):
+        if x.shape[-1] != self.in_length:
+            return F.interpolate(x, size=self.out_length, mode='linear', align_corners=False)
+        weight = self.weight.to(x.dtype)
+        return x[..., self.idx0] * (1 - weight) + x[..., self.idx1] * weight
+
 class NoPoolCNN(nn.Module):
     def __init__(self):
         super(NoPoolCNN, self).__init__()
@@ -136,6 +136,8 @@ class SpaceGroupEmbedder(nn.Module):
         return x
 
 class DiffractionPatternEmbedder(nn.Module):
+    input_length = 1024   # Pattern length the layer norms are built for (see pattern_pyramid.py)
+
     def __init__(self, num_blocks=6, num_channels=2):
         super(DiffractionPatternEmbedder, self).__init__()
 
@@ -351,6 +353,8 @@ Notes:
 -> num_formula_blocks=0 means we don't consider formula
 """
 class ChargeDensityRegressor(nn.Module):
+    input_length = DiffractionPatternEmbedder.input_length
+
     def __init__(self, num_channels=2, num_conv_blocks=4, num_formula_blocks=4, num_lattice_blocks=4, num_spacegroup_blocks=4,
                  num_regressor_blocks=3, num_freq=128, sigma=3, dropout_prob=0):
         super(ChargeDensityRegressor, self).__init__()
@@ -521,11 +525,26 @@ class ChargeDensityRegressor(nn.Module):
             position_embedding = self.position_embedder(position)
         assert position_embedding.shape[1] == 512#2 * self.num_freq
 
-        # create film
+        # create film, then condition the coordinates on it and do the main processing blocks
+        cond_scale, cond_bias = self.film(conditioning_vector)
+        x_final = self.regress(position_embedding, cond_scale, cond_bias)
+
+        return x_final.squeeze()
+
+    """
+    (B, 1024) conditioning vector -> (B, 512) FiLM scale and bias
+    """
+    def film(self, conditioning_vector):
         cond_scale = self.film_scale(conditioning_vector)
         assert cond_scale.shape[1] == 512#2 * self.num_freq
         cond_bias = self.film_bias(conditioning_vector)
         assert cond_bias.shape[1] == 512#2 * self.num_freq
+        return cond_scale, cond_bias
+
+    """
+    (N, 512) position embeddings and FiLM scale / bias (either (N, 512), or (1, 512) shared by all N positions) -> (N, 1) density
+    """
+    def regress(self, position_embedding, cond_scale, cond_bias):
         # condition coordinates on FiLM
         x_input = cond_scale * position_embedding + cond_bias
         assert x_input.shape[1] == 512#2 * self.num_freq
@@ -541,5 +560,35 @@ class ChargeDensityRegressor(nn.Module):
 
         assert x_final.shape[1] == 1
         assert len(x_final.shape) == 2
+        return x_final
 
-        return x_final.squeeze()
\ No newline at end of file
+    """
+    Conditioning vector of whole crystals (one row each), computed once instead of once per query position.
+    sample=False uses the means of the variational XRD / formula embeddings (deterministic), sample=True draws one sample per crystal.
+    """
+    def conditioning_embedding(self, diffraction_pattern, formula_vector, lattice_vector, spacegroup_vector, sample=False):
+        batch_size = formula_vector.shape[0]
+        device = formula_vector.device
+
+        def variational(embedder_mean, embedder_std, x):
+            mean = embedder_mean(x)
+            if not sample:
+                return mean
+            return mean + torch.randn_like(mean) * embedder_std(x)
+
+        if self.num_channels > 0 and self.num_conv_blocks > 0:
+            diffraction_embedding = variational(self.diffraction_embedder_mean, self.diffraction_embedder_std, diffraction_pattern)
+        else:
+            diffraction_embedding = torch.zeros(batch_size, 512, device=device)
+        if self.num_formula_blocks > 0:
+            formula_embedding = variational(self.formula_embedder_mean, self.formula_embedder_std, formula_vector)
+        else:
+            formula_embedding = torch.zeros(batch_size, 512, device=device)
+
+        if self.num_spacegroup_blocks > 0 and self.num_lattice_blocks > 0:
+            conditioning_vector = torch.cat((diffraction_embedding, formula_embedding,
+                                            self.lattice_embedder(lattice_vector), self.spacegroup_embedder(spacegroup_vector)), dim=1)
+        else:
+            conditioning_vector = torch.cat((diffraction_embedding, formula_embedding), dim=1)
+        assert conditioning_vector.shape[1] == 1024
+        return conditioning_vector
\ No newline at end of file
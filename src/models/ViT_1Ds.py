@@ -1,5 +1,7 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
+from torch.utils.checkpoint import checkpoint
 
 from einops import rearrange, repeat, pack, unpack
 from einops.layers.torch import Rearrange
@@ -16,11 +18,16 @@ from einops.layers.torch import Rearrange
 
 # Modifications:
 # I have altererd the basic ViT final layers to be a basic multi-task model.
+# An opt-in memory_efficient mode that activation checkpoints each transformer block during training.
+# Attention uses the fused scaled_dot_product_attention kernels (flash/memory-efficient) when available.
+# Patch size variants of ViT1D_MultiTask (bigger patches = shorter sequence = higher throughput).
+# ViT1D_MultiTask also takes shorter (downsampled, see pattern_pyramid.py) patterns, with its position embedding linearly
+# interpolated to the number of patches, so it can be trained coarse-to-fine.
 
 # TODO: Make these a comparable param count to the FCN.
 
 class ViT1D(nn.Module):
-    def __init__(self, *, seq_len=3501, patch_size=20, dim=1024, depth=6, heads=8, mlp_dim=2048, channels=1, dim_head=64, dropout=0.2, emb_dropout=0.2):
+    def __init__(self, *, seq_len=3501, patch_size=20, dim=1024, depth=6, heads=8, mlp_dim=2048, channels=1, dim_head=64, dropout=0.2, emb_dropout=0.2, memory_efficient=False):
         super().__init__()
 
         # Calculate number of patches based on the first 3500 elements (We exclude the last element here)
@@ -38,7 +45,7 @@ class ViT1D(nn.Module):
         self.cls_token = nn.Parameter(torch.randn(dim))
         self.dropout = nn.Dropout(emb_dropout)
 
-        self.transformer = Transformer(dim, depth, heads, dim_head, mlp_dim, dropout)
+        self.transformer = Transformer(dim, depth, heads, dim_head, mlp_dim, dropout, checkpoint_layers=memory_efficient)
 
         # Output head
         self.spg_head = nn.Sequential(
@@ -64,12 +71,15 @@ class ViT1D(nn.Module):
         return self.spg_head(cls_tokens)
 
 class ViT1D_MultiTask(nn.Module):
-    def __init__(self, *, seq_len=3501, patch_size=20, dim=128, depth=6, heads=6, mlp_dim=1024, channels=1, dim_head=32, dropout=0.2, emb_dropout=0.2):
+    def __init__(self, *, seq_len=3501, patch_size=20, dim=128, depth=6, heads=6, mlp_dim=1024, channels=1, dim_head=32, dropout=0.2, emb_dropout=0.2, memory_efficient=False):
         super().__init__()
 
         # Calculate number of patches based on the first 3500 elements (We exclude the last element here)
         num_patches = (seq_len-1) // patch_size
         patch_dim = channels * patch_size
+        self.patch_size = patch_size
+        self.num_patches = num_patches
+        self.input_length = num_patches * patch_size
 
         self.to_patch_embedding = nn.Sequential(
             Rearrange('b c (n p) -> b n (p c)', p=patch_size),
@@ -82,7 +92,7 @@ class ViT1D_MultiTask(nn.Module):
         self.cls_token = nn.Parameter(torch.randn(dim))
         self.dropout = nn.Dropout(emb_dropout)
 
-        self.transformer = Transformer(dim, depth, heads, dim_head, mlp_dim, dropout)
+        self.transformer = Transformer(dim, depth, heads, dim_head, mlp_dim, dropout, checkpoint_layers=memory_efficient)
 
         # Multi-task output heads
         self.crysystem_head = nn.Sequential(
@@ -104,8 +114,8 @@ class ViT1D_MultiTask(nn.Module):
 
     def forward(self, series):
 
-        # Slice off the last element
-        series = series[:, :, :3500]
+        # Slice off the last element (and any remainder that doesn't fill a patch)
+        series = series[:, :, :min(self.input_length, series.shape[-1] // self.patch_size * self.patch_size)]
 
         x = self.to_patch_embedding(series)
         b, n, _ = x.shape
@@ -114,7 +124,7 @@ class ViT1D_MultiTask(nn.Module):
 
         x, ps = pack([cls_tokens, x], 'b * d')
 
-        x += self.pos_embedding[:, :(n + 1)]
+        x += self.position_embedding(n)
         x = self.dropout(x)
 
         x = self.transformer(x)
@@ -127,6 +137,26 @@ class ViT1D_MultiTask(nn.Module):
             'spg': self.spg_head(cls_tokens),
             'composition': self.composition_head(cls_tokens)
         }
+
+    def position_embedding(self, num_patches):
+        # Patches of a shorter (downsampled) pattern cover the same 2theta range as the full resolution patches at the same relative position
+        if num_patches == self.num_patches:
+            return self.pos_embedding
+        patch_embedding = F.interpolate(self.pos_embedding[:, 1:].transpose(1, 2), size=num_patches, mode='linear', align_corners=False)
+        return torch.cat([self.pos_embedding[:, :1], patch_embedding.transpose(1, 2)], dim=1)
+
+# Patch size variants. 3500 / patch_size tokens (+ cls), attention cost is quadratic in this.
+class ViT1D_MultiTask_Patch35(ViT1D_MultiTask):
+    def __init__(self, **kwargs):
+        super().__init__(patch_size=35, **kwargs)
+
+class ViT1D_MultiTask_Patch50(ViT1D_MultiTask):
+    def __init__(self, **kwargs):
+        super().__init__(patch_size=50, **kwargs)
+
+class ViT1D_MultiTask_Patch100(ViT1D_MultiTask):
+    def __init__(self, **kwargs):
+        super().__init__(patch_size=100, **kwargs)
     
 # Transformer classes:
 class FeedForward(nn.Module):
@@ -144,13 +174,16 @@ class FeedForward(nn.Module):
         return self.net(x)
 
 class Attention(nn.Module):
-    def __init__(self, dim, heads = 8, dim_head = 64, dropout = 0.):
+    # use_sdpa: Use the fused F.scaled_dot_product_attention kernel, which never materialises the (b, h, n, n) matrix on the flash/memory-efficient backends.
+    #           Falls back to the explicit softmax(q @ k^T) @ v when unavailable (torch < 2.0). Both have no extra parameters so weights are interchangeable.
+    def __init__(self, dim, heads = 8, dim_head = 64, dropout = 0., use_sdpa = True):
         super().__init__()
         inner_dim = dim_head *  heads
         project_out = not (heads == 1 and dim_head == dim)
 
         self.heads = heads
         self.scale = dim_head ** -0.5
+        self.use_sdpa = use_sdpa and hasattr(F, 'scaled_dot_product_attention')
 
         self.norm = nn.LayerNorm(dim)
         self.attend = nn.Softmax(dim = -1)
@@ -168,27 +201,43 @@ class Attention(nn.Module):
         qkv = self.to_qkv(x).chunk(3, dim = -1)
         q, k, v = map(lambda t: rearrange(t, 'b n (h d) -> b h n d', h = self.heads), qkv)
 
-        dots = torch.matmul(q, k.transpose(-1, -2)) * self.scale
+        if self.use_sdpa:
+            dropout_p = self.dropout.p if self.training else 0.
+            out = F.scaled_dot_product_attention(q, k, v, dropout_p = dropout_p)  # Default scale is dim_head ** -0.5
+        else:
+            dots = torch.matmul(q, k.transpose(-1, -2)) * self.scale
+
+            attn = self.attend(dots)
+            attn = self.dropout(attn)
 
-        attn = self.attend(dots)
-        attn = self.dropout(attn)
+            out = torch.matmul(attn, v)
 
-        out = torch.matmul(attn, v)
         out = rearrange(out, 'b h n d -> b n (h d)')
         return self.to_out(out)
 
 class Transformer(nn.Module):
-    def __init__(self, dim, depth, heads, dim_head, mlp_dim, dropout = 0.):
+    def __init__(self, dim, depth, heads, dim_head, mlp_dim, dropout = 0., checkpoint_layers = False):
         super().__init__()
+        self.checkpoint_layers = checkpoint_layers
         self.layers = nn.ModuleList([])
         for _ in range(depth):
             self.layers.append(nn.ModuleList([
                 Attention(dim, heads = heads, dim_head = dim_head, dropout = dropout),
                 FeedForward(dim, mlp_dim, dropout = dropout)
             ]))
+    @staticmethod
+    def block(attn, ff, x):
+        x = attn(x) + x
+        x = ff(x) + x
+        return x
+
     def forward(self, x):
+        # Only checkpoint when there is a backward pass to save activations for
+        use_checkpoint = self.checkpoint_layers and self.training and torch.is_grad_enabled()
         for attn, ff in self.layers:
-            x = attn(x) + x
-            x = ff(x) + x
+            if use_checkpoint:
+                x = checkpoint(self.block, attn, ff, x, use_reentrant=False)
+            else:
+                x = self.block(attn, ff, x)
         return x
     
\ No newline at end of file
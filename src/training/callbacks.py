@@ -0,0 +1,131 @@
+import math
+from torch.optim.lr_scheduler import LambdaLR, OneCycleLR, ReduceLROnPlateau
+
+# Functions
+from src.training.large_batch import build_warmup_scheduler
+
+# Epoch-end callbacks for train_spg and train_multitask.
+# After each end-of-epoch validation the trainers call on_epoch_end() with the val metrics (as "val_..." keys, see validation.py),
+# stop if any callback sets stop_training, and call on_train_end() before the final test evaluation.
+
+class Callback:
+    stop_training = False
+
+    def on_epoch_end(self, epoch, metrics, model):
+        pass
+
+    def on_train_end(self, model):
+        pass
+
+def _is_improvement(value, best, mode, min_delta):
+    if best is None:
+        return True
+    if mode == "max":
+        return value > best + min_delta
+    return value < best - min_delta
+
+def _monitored_value(metrics, monitor):
+    if monitor not in metrics:
+        raise KeyError(f"Monitored metric '{monitor}' not found. Available: {sorted(metrics.keys())}")
+    return metrics[monitor]
+
+# Stops training after `patience` epochs without the monitored metric improving by more than min_delta
+class EarlyStopping(Callback):
+    def __init__(self, monitor="val_spg_accuracy", mode="max", patience=10, min_delta=0.0):
+        self.monitor = monitor
+        self.mode = mode
+        self.patience = patience
+        self.min_delta = min_delta
+        self.best = None
+        self.epochs_without_improvement = 0
+
+    def on_epoch_end(self, epoch, metrics, model):
+        value = _monitored_value(metrics, self.monitor)
+        if _is_improvement(value, self.best, self.mode, self.min_delta):
+            self.best = value
+            self.epochs_without_improvement = 0
+            return
+
+        self.epochs_without_improvement += 1
+        if self.epochs_without_improvement >= self.patience:
+            print(f"Early stopping: {self.monitor} has not improved on {self.best:.4f} for {self.patience} epochs")
+            self.stop_training = True
+
+# Keeps an in-memory (CPU) copy of the weights from the best epoch, and loads them back into the model at the end of training.
+# Stored without any nn.DataParallel wrapper, so it also accepts unwrapped weight snapshots (e.g. from async validation).
+class BestModelTracker(Callback):
+    def __init__(self, monitor="val_spg_accuracy", mode="max", restore=True):
+        self.monitor = monitor
+        self.mode = mode
+        self.restore = restore
+        self.best = None
+        self.best_epoch = None
+        self.best_state = None
+
+    def on_epoch_end(self, epoch, metrics, model):
+        value = _monitored_value(metrics, self.monitor)
+        if _is_improvement(value, self.best, self.mode, 0.0):
+            self.best = value
+            self.best_epoch = epoch
+            self.best_state = {k: v.detach().to('cpu', copy=True) for k, v in getattr(model, 'module', model).state_dict().items()}
+
+    def on_train_end(self, model):
+        if self.restore and self.best_state is not None:
+            print(f"Restoring the best model from epoch {self.best_epoch+1} ({self.monitor}: {self.best:.4f})")
+            getattr(model, 'module', model).load_state_dict(self.best_state)
+
+# Steps ReduceLROnPlateau on the monitored val metric once per epoch
+class PlateauLRScheduler(Callback):
+    def __init__(self, scheduler, monitor="val_spg_accuracy"):
+        self.scheduler = scheduler
+        self.monitor = monitor
+
+    def on_epoch_end(self, epoch, metrics, model):
+        self.scheduler.step(_monitored_value(metrics, self.monitor))
+
+# LR schedules that don't depend on the total number of steps, so they also work when the train set grows during training
+# (TRAIN_STORE). Cosine and one-cycle are sized from the starting length and would reach their final LR early.
+STEP_COUNT_FREE_SCHEDULERS = (None, "plateau")
+
+def build_lr_scheduler(optimizer, scheduler_type, num_epochs, steps_per_epoch, warmup_steps=0, monitor="val_spg_accuracy", mode="max",
+                       plateau_factor=0.5, plateau_patience=3, total_steps=None):
+    # Returns (step_scheduler, epoch_callback). The step scheduler is stepped by the trainers once per optimiser step,
+    # the callback (if any) once per epoch. Warmup is included in both.
+    # total_steps: Optimiser steps of the whole run, if the epochs differ in length (e.g. hard example mining). Default num_epochs * steps_per_epoch.
+    #   None:       constant LR (after warmup)
+    #   "plateau":  multiply the LR by plateau_factor when the monitored metric stalls for plateau_patience epochs
+    #   "cosine":   cosine decay to zero over the remaining steps after warmup
+    #   "onecycle": OneCycleLR, using the warmup as its ramp-up phase (30% of training if there is no warmup)
+    total_steps = total_steps or num_epochs * steps_per_epoch
+
+    if scheduler_type is None:
+        return build_warmup_scheduler(optimizer, warmup_steps), None
+
+    if scheduler_type == "plateau":
+        plateau = ReduceLROnPlateau(optimizer, mode=mode, factor=plateau_factor, patience=plateau_patience)
+        return build_warmup_scheduler(optimizer, warmup_steps), PlateauLRScheduler(plateau, monitor)
+
+    if scheduler_type == "cosine":
+        def cosine_with_warmup(step):
+            if step < warmup_steps:
+                return (step + 1) / warmup_steps
+            progress = min(1.0, (step - warmup_steps) / max(1, total_steps - warmup_steps))
+            return 0.5 * (1 + math.cos(math.pi * progress))
+        return LambdaLR(optimizer, cosine_with_warmup), None
+
+    if scheduler_type == "onecycle":
+        max_lrs = [group['lr'] for group in optimizer.param_groups]
+        pct_start = warmup_steps / total_steps if warmup_steps > 0 else 0.3
+        return OneCycleLR(optimizer, max_lr=max_lrs, total_steps=total_steps, pct_start=pct_start), None
+
+    raise ValueError(f"Unknown LR scheduler: {scheduler_type}. Options: None, 'plateau', 'cosine', 'onecycle'")
+
+def run_epoch_end(callbacks, epoch, metrics, model):
+    # Returns True if any callback wants training to stop
+    for callback in callbacks:
+        callback.on_epoch_end(epoch, metrics, model)
+    return any(callback.stop_training for callback in callbacks)
+
+def run_train_end(callbacks, model):
+    for callback in callbacks:
+        callback.on_train_end(model)
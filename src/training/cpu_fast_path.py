@@ -0,0 +1,141 @@
+import os
+import glob
+import torch
+import torch.nn as nn
+
+# CPU-only training fast path.
+# By default, torch intra-op threads, every DataLoader worker's NumPy/BLAS threads and the workers themselves all
+# compete for the same cores (and on a multi-socket node, the intra-op threads spread over both sockets).
+# Here the allowed cores are split between compute and data loading:
+# - compute: the main process is pinned to whole NUMA nodes (largest first), with one torch thread per core.
+# - loading: each DataLoader worker is pinned to its own core(s) on what is left, with BLAS limited to one thread.
+# On top of that, the model runs under bf16 autocast on CPUs with native bf16 (AVX512-BF16 / AMX), and is optimised with
+# Intel Extension for PyTorch (fused oneDNN Conv1d + ReLU, prepacked weights) if it is installed.
+# (Channels-last only exists for 2D / 3D convs. For Conv1d, oneDNN chooses its own blocked layout.)
+
+def allowed_cpus():
+    return sorted(os.sched_getaffinity(0))
+
+def numa_nodes():
+    # {node: [allowed cpus]}, largest first. One node if the topology isn't exposed.
+    allowed = set(allowed_cpus())
+    nodes = {}
+    for path in sorted(glob.glob('/sys/devices/system/node/node[0-9]*/cpulist')):
+        cpus = set()
+        with open(path) as f:
+            for part in f.read().strip().split(','):
+                if part:
+                    first, _, last = part.partition('-')
+                    cpus.update(range(int(first), int(last or first) + 1))
+        if cpus & allowed:
+            nodes[int(path.split('/node')[-1].split('/')[0])] = sorted(cpus & allowed)
+    nodes = nodes or {0: sorted(allowed)}
+    return dict(sorted(nodes.items(), key=lambda item: -len(item[1])))
+
+def partition_cpus(num_workers, compute_nodes=None):
+    # -> (compute cpus, worker cpus).
+    # compute_nodes: Number of NUMA nodes (sockets) for compute. None = all of them.
+    # Worker cores are taken from the end of the last node in use, so compute keeps whole nodes where possible.
+    # Nodes not used for compute are given to the workers.
+    nodes = list(numa_nodes().values())
+    compute_nodes = len(nodes) if compute_nodes is None else max(1, min(compute_nodes, len(nodes)))
+    cpus = [cpu for node in nodes[:compute_nodes] for cpu in node]
+    spare = [cpu for node in nodes[compute_nodes:] for cpu in node]
+
+    num_reserved = max(min(num_workers, len(cpus) - 1) - len(spare), 0)
+    compute = cpus[:len(cpus) - num_reserved]
+    workers = spare + cpus[len(cpus) - num_reserved:]
+    return compute, workers
+
+def limit_blas_threads(num_threads):
+    # NumPy's BLAS pool is sized to the whole node when NumPy is first imported. threadpoolctl (an sklearn dependency) resizes it.
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return
+    threadpool_limits(num_threads)
+
+class PinnedWorkerInit:
+    # worker_init_fn for the DataLoader: pins worker i to its share of worker_cpus and limits it to one BLAS thread.
+    # A class rather than a closure, so it also pickles for spawned workers. Chains an existing worker_init_fn.
+    def __init__(self, worker_cpus, num_workers, worker_init_fn=None):
+        self.worker_cpus = worker_cpus
+        self.num_workers = num_workers
+        self.worker_init_fn = worker_init_fn
+
+    def __call__(self, worker_id):
+        if self.worker_cpus:
+            share = self.worker_cpus[worker_id::self.num_workers] or [self.worker_cpus[worker_id % len(self.worker_cpus)]]
+            os.sched_setaffinity(0, share)
+        torch.set_num_threads(1)
+        limit_blas_threads(1)
+        if self.worker_init_fn is not None:
+            self.worker_init_fn(worker_id)
+
+def configure_cpu_threads(num_workers, compute_nodes=None, worker_init_fn=None):
+    # Pins this process to the compute cores and sizes torch's thread pool to them. Returns the worker_init_fn for the DataLoaders
+    # (which also calls worker_init_fn, if given).
+    # Call before anything runs on the thread pool (threads started later inherit the pinning).
+    compute, workers = partition_cpus(num_workers, compute_nodes)
+    os.sched_setaffinity(0, compute)
+    torch.set_num_threads(len(compute))
+    limit_blas_threads(1)
+    print(f"CPU fast path: {len(compute)} compute threads on CPUs {_cpu_ranges(compute)}, "
+          f"{num_workers} loader workers on CPUs {_cpu_ranges(workers) or 'shared'}")
+    return PinnedWorkerInit(workers, max(num_workers, 1), worker_init_fn)
+
+def _cpu_ranges(cpus):
+    ranges, start = [], None
+    for i, cpu in enumerate(cpus):
+        start = cpu if start is None else start
+        if i + 1 == len(cpus) or cpus[i + 1] != cpu + 1:
+            ranges.append(f"{start}-{cpu}" if cpu != start else f"{cpu}")
+            start = None
+    return ",".join(ranges)
+
+def cpu_supports_bf16():
+    # Native bf16 dot products (AVX512-BF16 or AMX). Without them bf16 is emulated and slower than fp32.
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        with open('/proc/cpuinfo') as f:
+            flags = f.read()
+        return 'avx512_bf16' in flags or 'amx_bf16' in flags
+
+class CPUAutocast(nn.Module):
+    # Runs the wrapped model under CPU bf16 autocast and returns float32 outputs, so losses and metrics are unchanged.
+    # The model is kept as .module (like nn.DataParallel, which BestModelTracker and validation unwrap),
+    # and state dicts are the wrapped model's own, so saved checkpoints load without the wrapper.
+    def __init__(self, module, dtype=torch.bfloat16):
+        super().__init__()
+        self.module = module
+        self.dtype = dtype
+
+    def forward(self, x):
+        with torch.autocast('cpu', dtype=self.dtype):
+            outputs = self.module(x)
+        if isinstance(outputs, dict):
+            return {task: output.float() for task, output in outputs.items()}
+        return outputs.float()
+
+    def state_dict(self, *args, **kwargs):
+        return self.module.state_dict(*args, **kwargs)
+
+    def load_state_dict(self, state_dict, *args, **kwargs):
+        return self.module.load_state_dict(state_dict, *args, **kwargs)
+
+def optimize_cpu_model(model, optimizer, bf16=None):
+    # -> (model, optimizer). bf16=None uses bf16 if the CPU supports it natively.
+    bf16 = cpu_supports_bf16() if bf16 is None else bf16
+    try:
+        import intel_extension_for_pytorch as ipex
+        model.train()
+        model, optimizer = ipex.optimize(model, optimizer=optimizer, dtype=torch.bfloat16 if bf16 else torch.float32)
+        print("CPU fast path: model optimised with Intel Extension for PyTorch")
+    except ImportError:
+        pass
+
+    if bf16:
+        print("CPU fast path: bf16 autocast")
+        model = CPUAutocast(model)
+    return model, optimizer
@@ -0,0 +1,75 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+from ase.db import connect
+from torch.utils.data import Sampler
+
+# Hard example mining: the training step records each sample's loss as it goes (no extra forward passes),
+# and the next epochs draw samples with probability rising with that loss.
+# Easy patterns (e.g. the many Fm-3m cubics learned early) are sub-sampled, hard ones are seen more often.
+
+# The train loader must return indices (create_training_data_loaders(..., return_indices=True)) so losses can be recorded.
+class LossHistorySampler(Sampler):
+    # num_samples_total: Size of the train set.
+    # temperature: Sample probability is proportional to (loss / mean loss)^(1 / temperature). Higher = closer to uniform.
+    # epoch_fraction: Fraction of the train set drawn per epoch (without replacement) once mining starts.
+    # uniform_mix: Fraction of the probability mass spread uniformly, so no sample is ever starved.
+    # momentum: Loss history is an EMA over the times a sample is seen (0 = keep only the latest loss).
+    # warmup_epochs: Full uniform passes before mining starts, so every sample has a recorded loss.
+    def __init__(self, num_samples_total, temperature=1.0, epoch_fraction=0.5, uniform_mix=0.1, momentum=0.5, warmup_epochs=1, generator=None):
+        self.num_samples_total = num_samples_total
+        self.temperature = temperature
+        self.epoch_fraction = epoch_fraction
+        self.uniform_mix = uniform_mix
+        self.momentum = momentum
+        self.warmup_epochs = warmup_epochs
+        self.generator = generator
+
+        # NaN = not seen yet
+        self.loss_history = np.full(num_samples_total, np.nan, dtype=np.float32)
+        self.epoch = 0
+
+    def update(self, indices, losses):
+        # Called from the training step with the batch indices and the per-sample losses of that batch
+        indices = indices.cpu().numpy()
+        losses = losses.detach().float().cpu().numpy()
+        previous = self.loss_history[indices]
+        self.loss_history[indices] = np.where(np.isnan(previous), losses, self.momentum * previous + (1 - self.momentum) * losses)
+
+    def probabilities(self):
+        seen = ~np.isnan(self.loss_history)
+        if not seen.any():
+            return np.full(self.num_samples_total, 1.0 / self.num_samples_total)
+
+        # Unseen samples are treated as the hardest seen so far
+        losses = np.where(seen, self.loss_history, self.loss_history[seen].max()).astype(np.float64)
+        relative_losses = np.maximum(losses / max(losses[seen].mean(), 1e-12), 1e-12)
+        weights = relative_losses ** (1.0 / self.temperature)
+
+        probabilities = weights / weights.sum()
+        return (1 - self.uniform_mix) * probabilities + self.uniform_mix / self.num_samples_total
+
+    def _is_mining(self):
+        return self.epoch >= self.warmup_epochs
+
+    def __len__(self):
+        if self._is_mining():
+            return max(1, int(self.epoch_fraction * self.num_samples_total))
+        return self.num_samples_total
+
+    def __iter__(self):
+        num_samples = len(self)
+        if self._is_mining():
+            probabilities = torch.from_numpy(self.probabilities())
+            indices = torch.multinomial(probabilities, num_samples, replacement=False, generator=self.generator)
+        else:
+            indices = torch.randperm(self.num_samples_total, generator=self.generator)
+        self.epoch += 1
+        return iter(indices.tolist())
+
+def create_loss_history_sampler(db_path, temperature=1.0, epoch_fraction=0.5, uniform_mix=0.1, generator=None):
+    return LossHistorySampler(connect(db_path).count(), temperature, epoch_fraction, uniform_mix, generator=generator)
+
+def per_sample_loss(output, target):
+    # Hardness signal recorded by the sampler: per-sample spg cross entropy of logits already computed in the training step
+    return F.cross_entropy(output.detach(), target, reduction='none')
@@ -0,0 +1,137 @@
+import math
+import torch
+from torch.optim import Optimizer
+from torch.optim.lr_scheduler import LambdaLR
+
+# Helpers for large-batch training:
+# - Learning rate scaling rules for when the effective batch size is changed.
+# - A per-step linear warmup scheduler.
+# - The LARS and LAMB layer-wise adaptive optimisers.
+
+# LARS paper: https://arxiv.org/abs/1708.03888
+# LAMB paper: https://arxiv.org/abs/1904.00962
+
+# Note: Biases and norm weights (1D params) are excluded from the trust ratio, as is standard practice for both.
+
+def scale_learning_rate(base_lr, batch_size, base_batch_size, rule=None):
+    # Scale a learning rate tuned at base_batch_size to a new effective batch size.
+    if rule is None:
+        return base_lr
+    ratio = batch_size / base_batch_size
+    if rule == "linear":
+        return base_lr * ratio
+    if rule == "sqrt":
+        return base_lr * math.sqrt(ratio)
+    raise ValueError(f"Unknown LR scaling rule: {rule}. Options: None, 'linear', 'sqrt'")
+
+class LinearWarmup(LambdaLR):
+    # Stops touching the LR once warmup is over, so it can be combined with epoch-level schedulers (e.g. ReduceLROnPlateau)
+    def __init__(self, optimizer, warmup_steps):
+        self.warmup_steps = warmup_steps
+        super(LinearWarmup, self).__init__(optimizer, lambda step: min(1.0, (step + 1) / warmup_steps))
+
+    def step(self, epoch=None):
+        if self.last_epoch < self.warmup_steps:
+            super(LinearWarmup, self).step(epoch)
+
+def build_warmup_scheduler(optimizer, warmup_steps):
+    # Linearly ramps the LR from lr/warmup_steps up to lr over the first warmup_steps optimiser steps.
+    # This should be stepped once per optimiser step (not per micro-batch).
+    if warmup_steps <= 0:
+        return None
+    return LinearWarmup(optimizer, warmup_steps)
+
+def accumulation_group_size(batch_idx, num_batches, accumulation_steps):
+    # Number of micro-batches in the accumulation group that batch_idx belongs to.
+    # The last group of an epoch can be smaller than accumulation_steps.
+    group_start = (batch_idx // accumulation_steps) * accumulation_steps
+    return min(accumulation_steps, num_batches - group_start)
+
+def _trust_ratio(param_norm, update_norm, trust_coefficient=1.0):
+    # Falls back to 1 when either norm is zero (e.g. freshly zero-initialised layers).
+    ratio = trust_coefficient * param_norm / update_norm
+    return torch.where((param_norm > 0) & (update_norm > 0), ratio, torch.ones_like(ratio))
+
+class LARS(Optimizer):
+    def __init__(self, params, lr=0.1, momentum=0.9, weight_decay=0.0, trust_coefficient=0.001, eps=1e-8):
+        if lr < 0.0:
+            raise ValueError(f"Invalid learning rate: {lr}")
+        defaults = dict(lr=lr, momentum=momentum, weight_decay=weight_decay, trust_coefficient=trust_coefficient, eps=eps)
+        super(LARS, self).__init__(params, defaults)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+                grad = p.grad
+
+                if p.ndim > 1:
+                    if group['weight_decay'] != 0:
+                        grad = grad.add(p, alpha=group['weight_decay'])
+                    param_norm = torch.norm(p)
+                    update_norm = torch.norm(grad) + group['eps']
+                    grad = grad.mul(_trust_ratio(param_norm, update_norm, group['trust_coefficient']))
+
+                state = self.state[p]
+                if 'momentum_buffer' not in state:
+                    state['momentum_buffer'] = torch.clone(grad).detach()
+                else:
+                    state['momentum_buffer'].mul_(group['momentum']).add_(grad)
+
+                p.add_(state['momentum_buffer'], alpha=-group['lr'])
+
+        return loss
+
+class LAMB(Optimizer):
+    def __init__(self, params, lr=1e-3, betas=(0.9, 0.999), eps=1e-6, weight_decay=0.0):
+        if lr < 0.0:
+            raise ValueError(f"Invalid learning rate: {lr}")
+        defaults = dict(lr=lr, betas=betas, eps=eps, weight_decay=weight_decay)
+        super(LAMB, self).__init__(params, defaults)
+
+    @torch.no_grad()
+    def step(self, closure=None):
+        loss = None
+        if closure is not None:
+            with torch.enable_grad():
+                loss = closure()
+
+        for group in self.param_groups:
+            beta1, beta2 = group['betas']
+            for p in group['params']:
+                if p.grad is None:
+                    continue
+                grad = p.grad
+
+                state = self.state[p]
+                if len(state) == 0:
+                    state['step'] = 0
+                    state['exp_avg'] = torch.zeros_like(p)
+                    state['exp_avg_sq'] = torch.zeros_like(p)
+
+                state['step'] += 1
+                exp_avg, exp_avg_sq = state['exp_avg'], state['exp_avg_sq']
+                exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+                exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+
+                # Bias corrected Adam step
+                bias_correction1 = 1 - beta1 ** state['step']
+                bias_correction2 = 1 - beta2 ** state['step']
+                update = (exp_avg / bias_correction1) / ((exp_avg_sq / bias_correction2).sqrt() + group['eps'])
+
+                if group['weight_decay'] != 0:
+                    update.add_(p, alpha=group['weight_decay'])
+
+                if p.ndim > 1:
+                    update.mul_(_trust_ratio(torch.norm(p), torch.norm(update)))
+
+                p.add_(update, alpha=-group['lr'])
+
+        return loss
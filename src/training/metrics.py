@@ -0,0 +1,111 @@
+import os
+import numpy as np
+import torch
+
+# Functions
+import src.utils.experiment_logger as experiment_logger
+from src.inference.consistent_decoding import compatibility_masks, CRYSTAL_SYSTEM_ENCODING
+from src.data_loading.simXRD_data_loader import ELEMENT_SET, BLT_ENCODING
+
+# Detailed multi-task evaluation metrics, accumulated on the device batch by batch (no per-sample outputs are kept):
+# - Confusion matrices for spg (230x230), crysystem and blt (7x7). Rows are targets, columns predictions.
+# - Top-k spg accuracy.
+# - Per-element composition true / false positives and false negatives.
+# Everything else (per-class accuracy, accuracy per crystal system, per-element precision / recall) is derived from these.
+
+NUM_CLASSES = {'spg': 230, 'crysystem': len(CRYSTAL_SYSTEM_ENCODING), 'blt': len(BLT_ENCODING)}
+
+class MultiTaskMetrics:
+    def __init__(self, device, top_k=(1, 3, 5), composition_threshold=0.5):
+        self.top_k = top_k
+        self.composition_threshold = composition_threshold
+        self.confusion = {task: torch.zeros(n * n, dtype=torch.long, device=device) for task, n in NUM_CLASSES.items()}
+        self.top_k_correct = torch.zeros(len(top_k), dtype=torch.long, device=device)
+        self.element_tp = torch.zeros(len(ELEMENT_SET), dtype=torch.long, device=device)
+        self.element_fp = torch.zeros(len(ELEMENT_SET), dtype=torch.long, device=device)
+        self.element_fn = torch.zeros(len(ELEMENT_SET), dtype=torch.long, device=device)
+        self.total = 0
+
+    @torch.no_grad()
+    def update(self, outputs, targets):
+        for task, n in NUM_CLASSES.items():
+            pred = outputs[task].argmax(dim=1)
+            self.confusion[task] += torch.bincount(targets[task] * n + pred, minlength=n * n)
+
+        top_spg = outputs['spg'].topk(max(self.top_k), dim=1).indices
+        hits = top_spg.eq(targets['spg'].unsqueeze(1)).cumsum(dim=1).clamp(max=1)
+        self.top_k_correct += hits[:, [k - 1 for k in self.top_k]].sum(dim=0)
+
+        # The composition heads output logits (BCEWithLogitsLoss). Same threshold as the composition F1 in evaluate_multi_task
+        pred = torch.sigmoid(outputs['composition']) > self.composition_threshold
+        target = targets['composition'] > 0.5
+        self.element_tp += (pred & target).sum(dim=0)
+        self.element_fp += (pred & ~target).sum(dim=0)
+        self.element_fn += (~pred & target).sum(dim=0)
+
+        self.total += targets['spg'].size(0)
+
+    def arrays(self):
+        # Compact NumPy arrays of everything, e.g. for np.savez
+        results = {}
+        for task, n in NUM_CLASSES.items():
+            confusion = self.confusion[task].view(n, n).cpu().numpy()
+            support = confusion.sum(axis=1)
+            results[f'{task}_confusion'] = confusion.astype(np.int32)
+            results[f'{task}_support'] = support
+            results[f'{task}_class_accuracy'] = np.divide(np.diag(confusion), support, out=np.full(n, np.nan), where=support > 0) * 100
+
+        # spg accuracy per (true) crystal system
+        spg_crysystem, _ = compatibility_masks()
+        spg_correct = np.diag(results['spg_confusion'])
+        crysystem_support = results['spg_support'] @ spg_crysystem
+        results['spg_accuracy_by_crysystem'] = np.divide(
+            spg_correct @ spg_crysystem, crysystem_support, out=np.full(len(crysystem_support), np.nan), where=crysystem_support > 0
+        ) * 100
+
+        results['spg_top_k'] = np.array(self.top_k)
+        results['spg_top_k_accuracy'] = self.top_k_correct.cpu().numpy() / max(self.total, 1) * 100
+
+        tp, fp, fn = (x.cpu().numpy() for x in (self.element_tp, self.element_fp, self.element_fn))
+        results['element_precision'] = np.divide(tp, tp + fp, out=np.full(len(tp), np.nan), where=(tp + fp) > 0) * 100
+        results['element_recall'] = np.divide(tp, tp + fn, out=np.full(len(tp), np.nan), where=(tp + fn) > 0) * 100
+        results['element_support'] = tp + fn
+        return results
+
+    def summary(self):
+        # Scalars for the metrics dict of evaluate_multi_task
+        arrays = self.arrays()
+        metrics = {f"spg_top{k}_accuracy": float(acc) for k, acc in zip(self.top_k, arrays['spg_top_k_accuracy']) if k != 1}
+        for task in NUM_CLASSES:
+            # Mean over the classes present, so rare classes count as much as common ones
+            metrics[f"{task}_macro_accuracy"] = float(np.nanmean(arrays[f'{task}_class_accuracy']))
+        return metrics
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez_compressed(path, **self.arrays())
+
+    def log_tables(self, prefix):
+        # Per-class tables, logged through the experiment logger (metrics.jsonl, and W&B if it's in use)
+        arrays = self.arrays()
+        spg_table = experiment_logger.table(
+            columns=["spg", "support", "accuracy"],
+            data=[[spg + 1, int(s), float(a)] for spg, (s, a) in enumerate(zip(arrays['spg_support'], arrays['spg_class_accuracy'])) if s > 0]
+        )
+        crysystem_table = experiment_logger.table(
+            columns=["crystal_system", "crysystem_accuracy", "spg_accuracy"],
+            data=[[name, float(arrays['crysystem_class_accuracy'][i]), float(arrays['spg_accuracy_by_crysystem'][i])] for name, i in CRYSTAL_SYSTEM_ENCODING.items()]
+        )
+        element_table = experiment_logger.table(
+            columns=["element", "support", "precision", "recall"],
+            data=[[elem, int(s), float(p), float(r)] for elem, s, p, r in zip(ELEMENT_SET, arrays['element_support'], arrays['element_precision'], arrays['element_recall']) if s > 0]
+        )
+        experiment_logger.log({
+            f"{prefix}_spg_class_accuracy": spg_table,
+            f"{prefix}_crysystem_accuracy": crysystem_table,
+            f"{prefix}_element_precision_recall": element_table,
+            f"{prefix}_crysystem_confusion": experiment_logger.table(
+                columns=["true \\ predicted"] + list(CRYSTAL_SYSTEM_ENCODING.keys()),
+                data=[[name] + arrays['crysystem_confusion'][i].tolist() for name, i in CRYSTAL_SYSTEM_ENCODING.items()]
+            )
+        })
@@ -0,0 +1,102 @@
+import copy
+import torch
+import torch.nn as nn
+
+# Structured channel pruning for the Conv1d trunks.
+# Whole output channels with the smallest L1 weight magnitude are removed from each conv, along with the matching
+# input channels/features of whatever consumes that conv's output. The result is a genuinely smaller dense model
+# (not a masked one), so it runs faster without sparse kernels. It should be fine-tuned afterwards.
+
+# Paper: https://arxiv.org/abs/1608.08710
+
+# Note: Only models where each conv is followed by elementwise ops (ReLU, pooling, dropout) before its consumers
+#       are supported. Models with BatchNorm or attention on the trunk output (experimentalFCN, smallFCN_SelfAttention) are not.
+
+def _chain(convs, final_consumers):
+    # Each conv feeds the next one, and the last conv feeds final_consumers
+    consumers = [[conv] for conv in convs[1:]] + [final_consumers]
+    return list(zip(convs, consumers))
+
+_FCN_CONVS = [f'conv{i}' for i in range(1, 11)]
+_CNN10_CONVS = ['conv1', 'conv2', 'conv3', 'conv4']
+_CNN11_CONVS = ['cnn.CNN.0', 'cnn.CNN.3', 'cnn.CNN.6']
+
+# {model_type: [(conv name, [consumer names]), ...]} in forward order.
+# Multi-task models only, as main_pruning.py fine-tunes with train_multitask.
+PRUNABLE_CONVS = {
+    "smallFCN_MultiTask": _chain(_FCN_CONVS, ['crysystem_conv_1', 'blt_conv_1', 'spg_conv_1', 'composition_conv_1']),
+    "CNN10_MultiTask": _chain(_CNN10_CONVS, ['fcl1']),
+    "smallCNN10_MultiTask": _chain(_CNN10_CONVS, ['fcl1']),
+    "CNN11_MultiTask": _chain(_CNN11_CONVS, [f'{head}.MLP.1' for head in ['MLP_spg_out', 'MLP_crysystem_out', 'MLP_blt_out', 'MLP_composition_out']])
+}
+
+def _set_submodule(model, name, module):
+    parent_name, _, child_name = name.rpartition('.')
+    parent = model.get_submodule(parent_name) if parent_name else model
+    setattr(parent, child_name, module)
+
+def _new_conv(conv, in_channels, out_channels):
+    return nn.Conv1d(
+        in_channels, out_channels, conv.kernel_size, stride=conv.stride, padding=conv.padding,
+        dilation=conv.dilation, bias=conv.bias is not None
+    ).to(conv.weight.device, conv.weight.dtype)
+
+def _new_linear(linear, in_features, out_features):
+    return nn.Linear(in_features, out_features, bias=linear.bias is not None).to(linear.weight.device, linear.weight.dtype)
+
+def _slice_output_channels(conv, keep):
+    new_conv = _new_conv(conv, conv.in_channels, len(keep))
+    with torch.no_grad():
+        new_conv.weight.copy_(conv.weight[keep])
+        if conv.bias is not None:
+            new_conv.bias.copy_(conv.bias[keep])
+    return new_conv
+
+def _slice_input_channels(consumer, keep, old_channels):
+    if isinstance(consumer, nn.Conv1d):
+        new_consumer = _new_conv(consumer, len(keep), consumer.out_channels)
+        columns = keep
+    else:
+        # A Linear on the flattened (channels, length) conv output. Keep every position of the kept channels.
+        length = consumer.in_features // old_channels
+        columns = (keep.unsqueeze(1) * length + torch.arange(length, device=keep.device)).flatten()
+        new_consumer = _new_linear(consumer, len(columns), consumer.out_features)
+
+    with torch.no_grad():
+        new_consumer.weight.copy_(consumer.weight[:, columns])
+        if consumer.bias is not None:
+            new_consumer.bias.copy_(consumer.bias)
+    return new_consumer
+
+def prune_conv_channels(model, model_type, amount):
+    # Returns a pruned copy of the model with `amount` (0-1) of the output channels removed from every trunk conv.
+    if model_type not in PRUNABLE_CONVS:
+        raise ValueError(f"Channel pruning is not supported for {model_type}. Options: {list(PRUNABLE_CONVS.keys())}")
+
+    model = copy.deepcopy(model)
+    for conv_name, consumer_names in PRUNABLE_CONVS[model_type]:
+        conv = model.get_submodule(conv_name)
+        num_keep = max(1, int(round(conv.out_channels * (1 - amount))))
+
+        # Rank output channels by the L1 norm of their filters, keep the largest (in their original order)
+        importance = conv.weight.detach().abs().sum(dim=(1, 2))
+        keep = torch.sort(torch.topk(importance, num_keep).indices).values
+
+        _set_submodule(model, conv_name, _slice_output_channels(conv, keep))
+        for consumer_name in consumer_names:
+            consumer = model.get_submodule(consumer_name)
+            _set_submodule(model, consumer_name, _slice_input_channels(consumer, keep, conv.out_channels))
+
+    return model
+
+def resize_to_state_dict(model, model_type, state_dict):
+    # Rebuilds the prunable layers of a fresh model with the shapes in a pruned state dict, so it can be loaded.
+    for conv_name, consumer_names in PRUNABLE_CONVS[model_type]:
+        for name in [conv_name] + consumer_names:
+            module = model.get_submodule(name)
+            out_size, in_size = state_dict[f'{name}.weight'].shape[:2]
+            if isinstance(module, nn.Conv1d):
+                _set_submodule(model, name, _new_conv(module, in_size, out_size))
+            else:
+                _set_submodule(model, name, _new_linear(module, in_size, out_size))
+    return model
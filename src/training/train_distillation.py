@@ -0,0 +1,163 @@
+import os
+import json
+import numpy as np
+import torch
+import torch.nn.functional as F
+from tqdm import tqdm
+from torch.utils.data import DataLoader
+
+# Functions
+from src.training.train_multitask import evaluate_multi_task
+import src.utils.experiment_logger as experiment_logger
+
+# Knowledge distillation: a small student is trained against the hard labels and the soft multi-task logits of a frozen teacher.
+# Paper: https://arxiv.org/abs/1503.02531
+
+# The teacher logits are computed once, in batches, and cached to disk as one .npy per task (float16).
+# The training loop then looks them up by sample index, so the teacher never runs during training.
+# metadata.json next to them records what they were computed from (teacher and dataset), and the cache is rebuilt if that changes.
+
+TASKS = ['spg', 'crysystem', 'blt', 'composition']
+
+def cache_metadata(teacher_path, data_path, **extra):
+    # What a cache depends on: the teacher checkpoint and the train data (paths and modification times), plus anything in extra
+    return {
+        'teacher_path': os.path.abspath(teacher_path), 'teacher_mtime': os.path.getmtime(teacher_path),
+        'data_path': os.path.abspath(data_path), 'data_mtime': os.path.getmtime(data_path), **extra
+    }
+
+def cache_teacher_logits(teacher, dataset, cache_dir, device, batch_size=256, num_workers=3, metadata=None):
+    # Returns {task: (num_samples, num_classes) memmap}. Reuses an existing cache with the same metadata (see cache_metadata)
+    # and length, otherwise (re)computes it.
+    paths = {task: os.path.join(cache_dir, f'{task}.npy') for task in TASKS}
+    metadata_path = os.path.join(cache_dir, 'metadata.json')
+    metadata = {**(metadata or {}), 'num_samples': len(dataset)}
+    if os.path.exists(metadata_path) and all(os.path.exists(path) for path in paths.values()):
+        with open(metadata_path) as f:
+            cached_metadata = json.load(f)
+        if cached_metadata == metadata:
+            print(f"Using cached teacher logits from '{cache_dir}'")
+            return {task: np.load(path, mmap_mode='r') for task, path in paths.items()}
+        print(f"Teacher logits in '{cache_dir}' are from another teacher or dataset. Recomputing them.")
+
+    # The metadata is written last, so an interrupted cache is never reused
+    os.makedirs(cache_dir, exist_ok=True)
+    if os.path.exists(metadata_path):
+        os.remove(metadata_path)
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+
+    teacher.eval()
+    cached = None
+    start = 0
+    with torch.no_grad():
+        for data, *_ in tqdm(loader, desc="Caching teacher logits"):
+            outputs = teacher(data.unsqueeze(1).to(device))
+
+            if cached is None:
+                cached = {
+                    task: np.lib.format.open_memmap(paths[task], mode='w+', dtype=np.float16, shape=(len(dataset), outputs[task].shape[1]))
+                    for task in TASKS
+                }
+
+            end = start + data.size(0)
+            for task in TASKS:
+                cached[task][start:end] = outputs[task].cpu().numpy()
+            start = end
+
+    for logits in cached.values():
+        logits.flush()
+    with open(metadata_path, 'w') as f:
+        json.dump(metadata, f, indent=2)
+    return {task: np.load(path, mmap_mode='r') for task, path in paths.items()}
+
+def distillation_losses(outputs, targets, teacher_outputs, criteria, temperature, alpha):
+    # alpha * hard label loss + (1 - alpha) * T^2 * soft teacher loss, per task.
+    # Tasks without matching teacher logits fall back to the hard loss only.
+    losses = {}
+    for task in criteria.keys():
+        hard_loss = criteria[task](outputs[task], targets[task])
+
+        teacher = teacher_outputs.get(task)
+        if teacher is None:
+            losses[task] = hard_loss
+            continue
+
+        student = outputs[task] / temperature
+        teacher = teacher / temperature
+        if task == 'composition':
+            # Multi-label, so each element gets its own soft sigmoid target
+            soft_loss = F.binary_cross_entropy_with_logits(student, torch.sigmoid(teacher))
+        else:
+            soft_loss = F.kl_div(F.log_softmax(student, dim=1), F.log_softmax(teacher, dim=1), reduction='batchmean', log_target=True)
+
+        losses[task] = alpha * hard_loss + (1 - alpha) * (temperature ** 2) * soft_loss
+    return losses
+
+# train_loader must come from create_training_data_loaders(..., return_indices=True) so the cached teacher logits can be looked up.
+def train_distillation(student, teacher_logits, train_loader, val_loader, test_loader, criteria, optimizer, device, num_epochs, temperature=4.0, alpha=0.5):
+
+    # Heads that differ in size between teacher and student (e.g. smallFCN_MultiTask has 6 blt outputs) are trained on hard labels only
+    with torch.no_grad():
+        example_outputs = student.eval()(torch.zeros(2, 1, 3501, device=device))
+    distilled_tasks = [task for task in criteria.keys() if teacher_logits[task].shape[1] == example_outputs[task].shape[1]]
+    skipped_tasks = [task for task in criteria.keys() if task not in distilled_tasks]
+    if skipped_tasks:
+        print(f"Teacher and student heads differ in size for {skipped_tasks}. These are trained on hard labels only.")
+
+    for epoch in range(num_epochs):
+        student.train()
+        train_losses = {task: 0.0 for task in criteria.keys()}
+
+        for batch_idx, (indices, data, spg, crysystem, blt, composition) in enumerate(tqdm(train_loader, desc=f"Epoch {epoch+1} Distillation")):
+            data = data.unsqueeze(1).to(device)
+            targets = {
+                'spg': spg.to(device),
+                'crysystem': crysystem.to(device),
+                'blt': blt.to(device),
+                'composition': composition.to(device)
+            }
+            indices = indices.numpy()
+            teacher_outputs = {
+                task: torch.from_numpy(np.asarray(teacher_logits[task][indices], dtype=np.float32)).to(device)
+                for task in distilled_tasks
+            }
+
+            optimizer.zero_grad()
+            outputs = student(data)
+
+            losses = distillation_losses(outputs, targets, teacher_outputs, criteria, temperature, alpha)
+            total_loss = sum(losses.values())
+
+            total_loss.backward()
+            optimizer.step()
+
+            for task, loss in losses.items():
+                train_losses[task] += loss.item()
+
+        for task in train_losses:
+            train_losses[task] /= len(train_loader)
+
+        # Evaluate on Val
+        val_metrics = evaluate_multi_task(student, val_loader, criteria, device)
+
+        # Log metrics every epoch
+        epoch_log = {f"train_distill_{task}_loss": loss for task, loss in train_losses.items()}
+        epoch_log.update({f"val_{k}": v for k, v in val_metrics.items()})
+        experiment_logger.log(epoch_log)
+
+        print(f'Epoch {epoch+1}:')
+        for task, loss in train_losses.items():
+            print(f'Train distillation {task} loss: {loss:.4f}')
+        for k, v in val_metrics.items():
+            print(f'Val {k}: {v:.4f}')
+
+    # Finish with an evaluate on the test set
+    test_metrics = evaluate_multi_task(student, test_loader, criteria, device)
+
+    print('Test Results:')
+    for k, v in test_metrics.items():
+        print(f'Test {k}: {v:.4f}')
+
+    experiment_logger.log({f"test_{k}": v for k, v in test_metrics.items()})
+
+    return student, test_metrics
@@ -1,3 +1,6 @@
+import os
+import time
+import datetime
 import torch
 import wandb
 from tqdm import tqdm
@@ -6,23 +9,56 @@ from sklearn.metrics import f1_score
 # Config
 import scripts.training.config_training as config_training
 
-# TODO: Adaptive learning rates
+# Functions
+from src.training.large_batch import accumulation_group_size
+from src.training.hard_example_sampler import per_sample_loss
+from src.training.callbacks import run_train_end
+from src.training.validation import ValidationScheduler, report_validation
+from src.inference.consistent_decoding import consistent_decode, inconsistent_predictions
+from src.training.metrics import MultiTaskMetrics
+import src.utils.experiment_logger as experiment_logger
+
 # TODO: Is normalised loss the best method here?
 # TODO: Document momentum and add it as an input + figure out if running losses is the right call
 # TODO: Draw this function out to make sure it makes sense for our task
-# TODO: Save best model.
 
-def train_multitask(model, train_loader, val_loader, test_loader, criteria, optimizer, device, num_epochs):
+# accumulation_steps: Number of micro-batches to accumulate gradients over before each optimiser step.
+# scheduler: Optional per-optimiser-step LR scheduler (e.g. warmup).
+# loss_history_sampler: Optional LossHistorySampler of train_loader (hard example mining). train_loader must then return indices.
+# callbacks: Optional list of epoch-end callbacks (early stopping, best model tracking, plateau LR). See callbacks.py.
+# validation: Optional ValidationScheduler of val_loader (validation cadence, fast subset, async). Default: full val set every epoch.
+# resolution_schedule: Optional ResolutionSchedule of train_loader (coarse-to-fine training, see pattern_pyramid.py).
+def train_multitask(model, train_loader, val_loader, test_loader, criteria, optimizer, device, num_epochs, accumulation_steps=1, scheduler=None, loss_history_sampler=None, callbacks=None, validation=None, resolution_schedule=None):
+    callbacks = callbacks or []
+    validation = validation or ValidationScheduler(val_loader)
+    evaluate_fn = lambda model, loader, device: evaluate_multi_task(model, loader, criteria, device)
     
     # Initialize running averages for loss normalization
     running_avg_losses = {task: 1.0 for task in criteria.keys()}
     momentum = 0.9  # Momentum for updating running averages
+    samples_seen = 0
+    optimizer_steps = 0
     
+    stopped = False
     for epoch in range(num_epochs):
+        if resolution_schedule is not None:
+            resolution_schedule.set_epoch(epoch)
+        if hasattr(train_loader.dataset, 'set_epoch'):
+            train_loader.dataset.set_epoch(epoch)   # e.g. ShardedXRDDataset picking up new shards
         model.train()
         train_losses = {task: 0.0 for task in criteria.keys()}
+        epoch_samples = 0
+        epoch_start = time.perf_counter()
+        optimizer.zero_grad()
+
+        # Per epoch, as a hard example sampler draws fewer samples once mining starts
+        num_batches = len(train_loader)
         
-        for batch_idx, (data, spg, crysystem, blt, composition) in enumerate(tqdm(train_loader, desc=f"Epoch {epoch+1} Training")):
+        for batch_idx, batch in enumerate(tqdm(train_loader, desc=f"Epoch {epoch+1} Training")):
+            if loss_history_sampler is not None:
+                indices, batch = batch[0], batch[1:]
+            data, spg, crysystem, blt, composition = batch
+
             data = data.unsqueeze(1).to(device)
             targets = {
                 'spg': spg.to(device),
@@ -31,56 +67,96 @@ def train_multitask(model, train_loader, val_loader, test_loader, criteria, opti
                 'composition': composition.to(device)
             }
             
-            optimizer.zero_grad()
             outputs = model(data)
 
+            if loss_history_sampler is not None:
+                loss_history_sampler.update(indices, per_sample_loss(outputs['spg'], targets['spg']))
+
             # Normalize losses
             losses = {task: criteria[task](outputs[task], targets[task]) for task in criteria.keys()}
             normalized_losses = {task: loss / running_avg_losses[task] for task, loss in losses.items()}
             total_loss = sum(normalized_losses.values())
             
-            total_loss.backward()
-            optimizer.step()
+            # Scale so the accumulated gradient is the mean over the whole accumulation group
+            group_size = accumulation_group_size(batch_idx, num_batches, accumulation_steps)
+            (total_loss / group_size).backward()
+
+            if (batch_idx + 1) % accumulation_steps == 0 or (batch_idx + 1) == num_batches:
+                optimizer.step()
+                optimizer.zero_grad()
+                if scheduler is not None:
+                    scheduler.step()
+                optimizer_steps += 1
+                validation.on_step(optimizer_steps, epoch, model, evaluate_fn, device)
+
+                # Per-step losses are handed to the logger as (detached) tensors, converted in its background thread
+                if config_training.STEP_LOG_INTERVAL and optimizer_steps % config_training.STEP_LOG_INTERVAL == 0:
+                    step_log = {f"step_train_{task}_loss": loss.detach() for task, loss in losses.items()}
+                    step_log["learning_rate"] = optimizer.param_groups[0]['lr']
+                    experiment_logger.log(step_log, step=optimizer_steps)
             
             # Update running averages
             for task, loss in losses.items():
                 running_avg_losses[task] = momentum * running_avg_losses[task] + (1 - momentum) * loss.item()
                 train_losses[task] += loss.item()
+
+            samples_seen += data.size(0)
+            epoch_samples += data.size(0)
         
         for task in train_losses:
-            train_losses[task] /= len(train_loader)
+            train_losses[task] /= num_batches
         
-        # Evaluate on Val
-        val_metrics = evaluate_multi_task(model, val_loader, criteria, device)
+        # Log metrics every epoch
+        epoch_log = {f"train_{task}_loss": loss for task, loss in train_losses.items()}
+        epoch_log["samples_seen"] = samples_seen
+        epoch_log["train_samples_per_second"] = epoch_samples / (time.perf_counter() - epoch_start)
+        epoch_log["learning_rate"] = optimizer.param_groups[0]['lr']
+        epoch_log["epoch"] = epoch + 1
+        experiment_logger.log(epoch_log)
         
-        # Log metrics to wandb every epoch
-        if config_training.USE_WANDB:
-            wandb_log = {f"train_{task}_loss": loss for task, loss in train_losses.items()}
-            wandb_log.update({f"val_{k}": v for k, v in val_metrics.items()})
-            wandb.log(wandb_log)
-        
-        print(f'Epoch {epoch+1}:')
+        print(f'Epoch {epoch+1} ({samples_seen} samples seen):')
         for task, loss in train_losses.items():
             print(f'Train {task} loss: {loss:.4f}')
-        for k, v in val_metrics.items():
-            print(f'Val {k}: {v:.4f}')
 
-    # Finish with an evaluate on the test set
-    test_metrics = evaluate_multi_task(model, test_loader, criteria, device)
+        # Evaluate on Val (or the fast val subset), then report whatever validations have finished
+        validation.on_epoch_end(epoch, num_epochs, optimizer_steps, model, evaluate_fn, device)
+        stopped = report_validation(validation.collect(), callbacks)
+        if stopped:
+            break
+
+    # Wait for any validations still running in the background (logged only, if training was stopped early)
+    report_validation(validation.close(), callbacks, run_callbacks=not stopped)
+    run_train_end(callbacks, model)
+
+    # Finish with an evaluate on the test set, keeping the per-class details
+    test_details = MultiTaskMetrics(device)
+    test_metrics = evaluate_multi_task(model, test_loader, criteria, device, test_details)
+
+    details_path = os.path.join(
+        config_training.DETAILED_METRICS_DIR, f"{config_training.MODEL_TYPE}_test_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.npz"
+    )
+    test_details.save(details_path)
+    print(f"Saved per-class test metrics to '{details_path}'")
     
     print('Test Results:')
     for k, v in test_metrics.items():
         print(f'Test {k}: {v:.4f}')
 
+    experiment_logger.log({f"test_{k}": v for k, v in test_metrics.items()})
+    test_details.log_tables("test")
     if config_training.USE_WANDB:
-        wandb.log({f"test_{k}": v for k, v in test_metrics.items()})
+        wandb.save(details_path)
 
     return model, test_metrics
 
-def evaluate_multi_task(model, data_loader, criteria, device):
+# details: Optional MultiTaskMetrics, to get the full per-class arrays (confusion matrices etc.) back. Its scalars are added to the metrics either way.
+def evaluate_multi_task(model, data_loader, criteria, device, details=None):
+    details = details or MultiTaskMetrics(device)
     model.eval()
     total_losses = {task: 0.0 for task in criteria.keys()}
     correct = {task: 0 for task in ['spg', 'crysystem', 'blt']}
+    consistent_correct = {task: 0 for task in ['spg', 'crysystem', 'blt']}
+    inconsistent = 0
     total = 0
 
     all_composition_preds = []
@@ -107,8 +183,18 @@ def evaluate_multi_task(model, data_loader, criteria, device):
                 pred = outputs[task].argmax(dim=1, keepdim=True)
                 correct[task] += pred.eq(targets[task].view_as(pred)).sum().item()
 
-            # Threshold for composition BCE
-            composition_pred = (outputs['composition'] > 0.5).float()
+            details.update(outputs, targets)
+
+            # Jointly consistent spg / crysystem / blt predictions (see consistent_decoding.py)
+            decoded = consistent_decode(outputs['spg'], outputs['crysystem'], outputs['blt'])
+            for task in ['spg', 'crysystem', 'blt']:
+                consistent_correct[task] += decoded[task][:, 0].eq(targets[task]).sum().item()
+            # Like consistent_decode, only a 7-way blt head is checked (smallFCN_MultiTask has a 6-way one)
+            blt_pred = outputs['blt'].argmax(dim=1) if outputs['blt'].shape[1] == 7 else None
+            inconsistent += inconsistent_predictions(outputs['spg'].argmax(dim=1), outputs['crysystem'].argmax(dim=1), blt_pred).sum().item()
+
+            # Threshold for composition BCE (the heads output logits, see BCEWithLogitsLoss)
+            composition_pred = (torch.sigmoid(outputs['composition']) > 0.5).float()
             all_composition_preds.append(composition_pred.cpu())
             all_composition_targets.append(targets['composition'].cpu())
             
@@ -124,6 +210,9 @@ def evaluate_multi_task(model, data_loader, criteria, device):
     
     metrics = {f"{task}_loss": loss for task, loss in avg_losses.items()}
     metrics.update({f"{task}_accuracy": acc for task, acc in accuracies.items()})
+    metrics.update({f"{task}_consistent_accuracy": 100. * consistent_correct[task] / total for task in consistent_correct})
+    metrics['inconsistent_percent'] = 100. * inconsistent / total
+    metrics.update(details.summary())
     metrics['composition_f1'] = composition_f1 * 100
     
     return metrics
\ No newline at end of file
@@ -1,59 +1,117 @@
+import time
 import torch
-import wandb
 from tqdm import tqdm
 
 # Config
 import scripts.training.config_training as config_training
 
+# Functions
+from src.training.large_batch import accumulation_group_size
+from src.training.hard_example_sampler import per_sample_loss
+from src.training.callbacks import run_train_end
+from src.training.validation import ValidationScheduler, report_validation
+import src.utils.experiment_logger as experiment_logger
+
 # TODO: Maybe add in function hyper param tuning?
-# TODO: Save best model.
 # TODO: Residual XRD analysis
 
-def train_spg(model, train_loader, val_loader, test_loader, criterion, optimizer, device, num_epochs):
+# accumulation_steps: Number of micro-batches to accumulate gradients over before each optimiser step.
+# scheduler: Optional per-optimiser-step LR scheduler (e.g. warmup).
+# loss_history_sampler: Optional LossHistorySampler of train_loader (hard example mining). train_loader must then return indices.
+# callbacks: Optional list of epoch-end callbacks (early stopping, best model tracking, plateau LR). See callbacks.py.
+# validation: Optional ValidationScheduler of val_loader (validation cadence, fast subset, async). Default: full val set every epoch.
+# resolution_schedule: Optional ResolutionSchedule of train_loader (coarse-to-fine training, see pattern_pyramid.py).
+def train_spg(model, train_loader, val_loader, test_loader, criterion, optimizer, device, num_epochs, accumulation_steps=1, scheduler=None, loss_history_sampler=None, callbacks=None, validation=None, resolution_schedule=None):
+    callbacks = callbacks or []
+    validation = validation or ValidationScheduler(val_loader)
+    evaluate_fn = lambda model, loader, device: dict(zip(["spg_loss", "spg_accuracy"], evaluate(model, loader, criterion, device)))
+    samples_seen = 0
+    optimizer_steps = 0
+
+    stopped = False
     for epoch in range(num_epochs):
+        if resolution_schedule is not None:
+            resolution_schedule.set_epoch(epoch)
+        if hasattr(train_loader.dataset, 'set_epoch'):
+            train_loader.dataset.set_epoch(epoch)   # e.g. ShardedXRDDataset picking up new shards
         model.train()
         train_loss = 0.0
+        epoch_samples = 0
+        epoch_start = time.perf_counter()
+        optimizer.zero_grad()
+
+        # Per epoch, as a hard example sampler draws fewer samples once mining starts
+        num_batches = len(train_loader)
+
         for batch_idx, batch in enumerate(tqdm(train_loader, desc=f"Epoch {epoch+1} Training")):
             
             # Unpack
+            if loss_history_sampler is not None:
+                indices, batch = batch[0], batch[1:]
             data, space_group = batch[0], batch[1]
             
             # Reshape data: [batch_size, 3501] -> [batch_size, 1, 3501]
             data = data.unsqueeze(1).to(device)
             target = space_group.to(device)
             
-            optimizer.zero_grad()
             output = model(data)
             loss = criterion(output, target)
-            loss.backward()
-            optimizer.step()
+
+            if loss_history_sampler is not None:
+                loss_history_sampler.update(indices, per_sample_loss(output, target))
+
+            # Scale so the accumulated gradient is the mean over the whole accumulation group
+            group_size = accumulation_group_size(batch_idx, num_batches, accumulation_steps)
+            (loss / group_size).backward()
+
+            if (batch_idx + 1) % accumulation_steps == 0 or (batch_idx + 1) == num_batches:
+                optimizer.step()
+                optimizer.zero_grad()
+                if scheduler is not None:
+                    scheduler.step()
+                optimizer_steps += 1
+                validation.on_step(optimizer_steps, epoch, model, evaluate_fn, device)
+
+                # The loss is handed to the logger as a (detached) tensor, converted in its background thread
+                if config_training.STEP_LOG_INTERVAL and optimizer_steps % config_training.STEP_LOG_INTERVAL == 0:
+                    experiment_logger.log({"step_train_spg_loss": loss.detach(), "learning_rate": optimizer.param_groups[0]['lr']}, step=optimizer_steps)
+
             train_loss += loss.item()
+            samples_seen += data.size(0)
+            epoch_samples += data.size(0)
         
-        train_loss /= len(train_loader)
+        train_loss /= num_batches
         
-        # Evaluate on Val
-        val_loss, val_accuracy = evaluate(model, val_loader, criterion, device)
-        
-        # Log metrics to wandb every epoch
-        if config_training.USE_WANDB:
-            wandb.log({
-                "train_spg_loss": train_loss,
-                "val_spg_loss": val_loss,
-                "val_spg_accuracy": val_accuracy
-            })
+        # Log metrics every epoch
+        experiment_logger.log({
+            "train_spg_loss": train_loss,
+            "samples_seen": samples_seen,
+            "train_samples_per_second": epoch_samples / (time.perf_counter() - epoch_start),
+            "learning_rate": optimizer.param_groups[0]['lr'],
+            "epoch": epoch + 1
+        })
         
-        print(f'Epoch {epoch+1}: Train loss: {train_loss:.4f}, Val loss: {val_loss:.4f}, Val Accuracy: {val_accuracy:.2f}%')
+        print(f'Epoch {epoch+1} ({samples_seen} samples seen): Train loss: {train_loss:.4f}')
+
+        # Evaluate on Val (or the fast val subset), then report whatever validations have finished
+        validation.on_epoch_end(epoch, num_epochs, optimizer_steps, model, evaluate_fn, device)
+        stopped = report_validation(validation.collect(), callbacks)
+        if stopped:
+            break
+
+    # Wait for any validations still running in the background (logged only, if training was stopped early)
+    report_validation(validation.close(), callbacks, run_callbacks=not stopped)
+    run_train_end(callbacks, model)
 
     # Finish with an evaluate on the test set
     test_loss, test_accuracy = evaluate(model, test_loader, criterion, device)
     
     print(f'Test loss: {test_loss:.4f}, Test Accuracy: {test_accuracy:.2f}%')
 
-    if config_training.USE_WANDB:
-        wandb.log({
-            "test_spg_loss": test_loss,
-            "test_spg_accuracy": test_accuracy
-        })
+    experiment_logger.log({
+        "test_spg_loss": test_loss,
+        "test_spg_accuracy": test_accuracy
+    })
 
     return model, test_loss, test_accuracy
 
@@ -0,0 +1,107 @@
+import copy
+import torch
+from concurrent.futures import ThreadPoolExecutor
+from torch.utils.data import DataLoader, Subset
+
+# Functions
+from src.training.callbacks import run_epoch_end
+import src.utils.experiment_logger as experiment_logger
+
+# Decides when the trainers validate, and on what:
+# - Full val set every full_every_epochs epochs, and always after the last epoch.
+# - A fixed random subset of the val set ("fast" validation) at the end of the other epochs, and optionally every fast_every_steps optimiser steps.
+# - Optionally asynchronous: a snapshot of the weights is evaluated in a background thread (on validation_device, if given),
+#   so training carries on. Torch releases the GIL inside its kernels, so on a separate GPU the two genuinely overlap.
+
+# evaluate_fn(model, loader, device) -> {metric: value}, without the "val_" prefix (e.g. {"spg_loss": ..., "spg_accuracy": ...})
+
+MAX_PENDING_SNAPSHOTS = 2   # Training waits for the oldest async validation if more weight snapshots than this are queued
+
+class ValidationScheduler:
+    def __init__(self, val_loader, full_every_epochs=1, fast_subset_size=None, fast_every_steps=None, async_validation=False, validation_device=None, seed=0):
+        self.val_loader = val_loader
+        self.full_every_epochs = full_every_epochs
+        self.fast_every_steps = fast_every_steps
+
+        # The subset is drawn once, so fast validation scores are comparable across the run
+        self.fast_loader = None
+        if fast_subset_size is not None and fast_subset_size < len(val_loader.dataset):
+            generator = torch.Generator().manual_seed(seed)
+            indices = torch.randperm(len(val_loader.dataset), generator=generator)[:fast_subset_size].sort().values.tolist()
+            self.fast_loader = DataLoader(
+                Subset(val_loader.dataset, indices), batch_size=val_loader.batch_size, shuffle=False, num_workers=val_loader.num_workers
+            )
+
+        self.executor = ThreadPoolExecutor(max_workers=1) if async_validation else None
+        self.validation_device = torch.device(validation_device) if validation_device is not None else None
+        self.pending = []
+        self.results = []
+
+    def _validate(self, kind, loader, epoch, step, model, evaluate_fn, device):
+        result = {'kind': kind, 'epoch': epoch, 'step': step}
+
+        if self.executor is None:
+            was_training = model.training
+            result['metrics'] = evaluate_fn(model, loader, device)
+            result['model'] = model
+            model.train(was_training)
+            self.results.append(result)
+            return
+
+        device = self.validation_device or device
+        snapshot = copy.deepcopy(getattr(model, 'module', model)).to(device)
+        result['model'] = snapshot
+        self.pending.append((result, self.executor.submit(evaluate_fn, snapshot, loader, device)))
+
+        while len(self.pending) > MAX_PENDING_SNAPSHOTS:
+            self._finish_oldest()
+
+    def _finish_oldest(self):
+        result, future = self.pending.pop(0)
+        result['metrics'] = future.result()
+        self.results.append(result)
+
+    def on_step(self, step, epoch, model, evaluate_fn, device):
+        # Call after every optimiser step
+        if self.fast_every_steps and self.fast_loader is not None and step % self.fast_every_steps == 0:
+            self._validate('step', self.fast_loader, epoch, step, model, evaluate_fn, device)
+
+    def on_epoch_end(self, epoch, num_epochs, step, model, evaluate_fn, device):
+        if (epoch + 1) % self.full_every_epochs == 0 or epoch + 1 == num_epochs:
+            self._validate('full', self.val_loader, epoch, step, model, evaluate_fn, device)
+        elif self.fast_loader is not None:
+            self._validate('fast', self.fast_loader, epoch, step, model, evaluate_fn, device)
+
+    def collect(self, wait=False):
+        # Finished validations, in the order they were started. wait=True blocks until all are finished.
+        while self.pending and (wait or self.pending[0][1].done()):
+            self._finish_oldest()
+        results, self.results = self.results, []
+        return results
+
+    def close(self):
+        results = self.collect(wait=True)
+        if self.executor is not None:
+            self.executor.shutdown()
+        return results
+
+def report_validation(results, callbacks, run_callbacks=True):
+    # Logs finished validations and runs the epoch-end callbacks on the full validations.
+    # Fast subset scores aren't comparable with full val scores, so they never reach early stopping, best model tracking or the LR plateau.
+    # Callbacks get the evaluated weights (a snapshot for async validation). Returns True if a callback wants training to stop,
+    # after which no more callbacks run (run_callbacks=False does the same for validations reported after training stopped).
+    stop_training = False
+    for result in results:
+        prefix = "val" if result['kind'] == 'full' else "fast_val"
+
+        val_log = {f"{prefix}_{k}": v for k, v in result['metrics'].items()}
+        val_log["epoch"] = result['epoch'] + 1
+        experiment_logger.log(val_log, step=result['step'])
+
+        print(f"{'Val' if prefix == 'val' else 'Fast val'} (epoch {result['epoch']+1}, step {result['step']}): "
+              + ", ".join(f"{k}: {v:.4f}" for k, v in result['metrics'].items()))
+
+        if result['kind'] == 'full' and run_callbacks and not stop_training:
+            val_metrics = {f"val_{k}": v for k, v in result['metrics'].items()}
+            stop_training = run_epoch_end(callbacks, result['epoch'], val_metrics, result['model']) or stop_training
+    return stop_training
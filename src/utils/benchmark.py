@@ -0,0 +1,40 @@
+import time
+import numpy as np
+import torch
+
+# Measures inference throughput (samples/s) of a model on random XRD-shaped inputs.
+def measure_throughput(model, device, batch_size=256, input_length=3501, num_iters=20, num_warmup=3):
+    model.eval()
+    data = torch.rand(batch_size, 1, input_length, device=device) * 100
+
+    with torch.no_grad():
+        for _ in range(num_warmup):
+            model(data)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+
+        start_time = time.perf_counter()
+        for _ in range(num_iters):
+            model(data)
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        elapsed = time.perf_counter() - start_time
+
+    return batch_size * num_iters / elapsed
+
+def count_parameters(model):
+    return sum(p.numel() for p in model.parameters())
+
+# Same as measure_throughput, but for anything with a predict(intensities) method (e.g. TorchPredictor / OnnxPredictor)
+def measure_predictor_throughput(predictor, batch_size=256, input_length=3501, num_iters=20, num_warmup=3):
+    intensities = np.random.default_rng(0).random((batch_size, input_length), dtype=np.float32) * 100
+
+    for _ in range(num_warmup):
+        predictor.predict(intensities)
+
+    start_time = time.perf_counter()
+    for _ in range(num_iters):
+        predictor.predict(intensities)
+    elapsed = time.perf_counter() - start_time
+
+    return batch_size * num_iters / elapsed
@@ -0,0 +1,71 @@
+import torch
+
+from src.models.CNN11 import CNN11_MultiTask
+from src.models.ViT_1Ds import ViT1D_MultiTask
+
+# Reports the memory cost of one training step (forward + backward) with and without memory_efficient mode.
+# - Saved activations: bytes of tensors autograd keeps for the backward pass (works on CPU and GPU).
+# - Peak allocated: torch.cuda.max_memory_allocated over the step (GPU only). Includes weights, grads and activations.
+
+def _saved_activation_bytes(model, data):
+    saved_bytes = 0
+
+    # Weights are also saved for the backward pass, but they are not activations. Views of the same storage are only counted once.
+    seen = {p.untyped_storage().data_ptr() for p in model.parameters()}
+
+    def pack(tensor):
+        nonlocal saved_bytes
+        key = tensor.untyped_storage().data_ptr()
+        if key not in seen:
+            seen.add(key)
+            saved_bytes += tensor.untyped_storage().nbytes()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        outputs = model(data)
+    return outputs, saved_bytes
+
+def measure_training_step(model, batch_size, device, input_length=3501):
+    model = model.to(device).train()
+    data = torch.rand(batch_size, 1, input_length, device=device)
+
+    if device.type == "cuda":
+        torch.cuda.empty_cache()
+        torch.cuda.reset_peak_memory_stats(device)
+
+    outputs, saved_bytes = _saved_activation_bytes(model, data)
+    if isinstance(outputs, dict):
+        loss = sum(output.mean() for output in outputs.values())
+    else:
+        loss = outputs.mean()
+    loss.backward()
+
+    peak_bytes = torch.cuda.max_memory_allocated(device) if device.type == "cuda" else None
+    model.zero_grad(set_to_none=True)
+    return saved_bytes, peak_bytes
+
+def compare_memory_efficient(model_class, batch_size, device, **model_kwargs):
+    print(f"\n=== {model_class.__name__} (batch size {batch_size}) ===")
+    results = {}
+    for memory_efficient in [False, True]:
+        model = model_class(memory_efficient=memory_efficient, **model_kwargs)
+        results[memory_efficient] = measure_training_step(model, batch_size, device)
+        del model
+
+    for memory_efficient, (saved_bytes, peak_bytes) in results.items():
+        line = f"memory_efficient={memory_efficient}: saved activations {saved_bytes / 1024**2:.1f} MB"
+        if peak_bytes is not None:
+            line += f", peak allocated {peak_bytes / 1024**2:.1f} MB"
+        print(line)
+
+    (base_saved, base_peak), (lean_saved, lean_peak) = results[False], results[True]
+    print(f"Saved activation reduction: {100 * (1 - lean_saved / base_saved):.1f}%")
+    if base_peak is not None:
+        print(f"Peak memory reduction: {100 * (1 - lean_peak / base_peak):.1f}%")
+    return results
+
+if __name__ == "__main__":
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    compare_memory_efficient(CNN11_MultiTask, 32, device)
+    compare_memory_efficient(ViT1D_MultiTask, 32, device)
+    compare_memory_efficient(ViT1D_MultiTask, 32, device, dim=1024, heads=8, mlp_dim=2048, dim_head=64)  # ViT1D default size
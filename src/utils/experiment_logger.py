@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import queue
+import threading
+import torch
+import wandb
+
+# Asynchronous, batched experiment logging.
+# log() only puts the metrics on a queue (tensors are kept as they are, so no .item() GPU sync on the training thread) and returns.
+# A background thread converts them to floats, appends them to <run_dir>/metrics.jsonl and forwards them to W&B.
+# The local file is the complete record. If a W&B upload fails, forwarding stops and the run can be synced later
+# (scripts/training/sync_logs.py), so an offline compute node logs at full speed and syncs from a login node afterwards.
+
+# Module-level, like wandb itself: start() once per run (main_training.py etc.), log() from anywhere, finish() at the end.
+# Without start(), log() does nothing.
+# Tables (e.g. per-class metrics) are logged as table(columns, data): plain JSON in the file, a wandb.Table in W&B.
+
+class ExperimentLogger:
+    # run_dir: Directory of metrics.jsonl and config.json (the run config, for syncing later)
+    # use_wandb: Forward to the active W&B run. False = local file only (offline mode)
+    # flush_interval: Seconds between writes. Records logged in between are written (and forwarded) as one batch.
+    def __init__(self, run_dir, config=None, use_wandb=True, flush_interval=1.0):
+        self.run_dir = run_dir
+        self.use_wandb = use_wandb
+        self.flush_interval = flush_interval
+        self.num_records = 0
+
+        os.makedirs(run_dir, exist_ok=True)
+        with open(os.path.join(run_dir, 'config.json'), 'w') as f:
+            json.dump(config or {}, f, indent=2, default=str)
+        self.file = open(os.path.join(run_dir, 'metrics.jsonl'), 'a')
+
+        self.queue = queue.SimpleQueue()
+        self.flushed = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="ExperimentLogger", daemon=True)
+        self.thread.start()
+
+    def log(self, metrics, step=None):
+        # step: Optional optimiser step of per-step metrics, logged as "optimizer_step" (as validation does)
+        metrics = {key: value.detach() if isinstance(value, torch.Tensor) else value for key, value in metrics.items()}
+        if step is not None:
+            metrics['optimizer_step'] = step
+        self.queue.put((time.time(), metrics))
+
+    def flush(self):
+        # Blocks until everything logged so far is written
+        self.flushed.clear()
+        self.queue.put(None)
+        self.flushed.wait()
+
+    def close(self):
+        self.queue.put(StopIteration)
+        self.thread.join()
+        self.file.close()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is StopIteration:
+                    stop = True
+                    break
+                if item is None:
+                    self._write(batch)
+                    batch = []
+                    self.flushed.set()
+                    continue
+                batch.append(item)
+            self._write(batch)
+
+    def _write(self, batch):
+        if not batch:
+            return
+        records = []
+        for timestamp, metrics in batch:
+            records.append({key: value.item() if isinstance(value, torch.Tensor) else value for key, value in metrics.items()})
+            self.file.write(json.dumps({'_timestamp': timestamp, '_index': self.num_records, **records[-1]}, default=str) + '\n')
+            self.num_records += 1
+        self.file.flush()
+
+        if self.use_wandb:
+            try:
+                for record in records:
+                    wandb.log(_to_wandb(record))
+            except Exception as error:
+                self.use_wandb = False
+                print(f"W&B logging failed ({error}). Logging locally only. Sync later with: python -m scripts.training.sync_logs {self.run_dir}")
+
+def table(columns, data):
+    return {'_type': 'table', 'columns': list(columns), 'data': data}
+
+def _to_wandb(record):
+    return {
+        key: wandb.Table(columns=value['columns'], data=value['data']) if isinstance(value, dict) and value.get('_type') == 'table' else value
+        for key, value in record.items()
+    }
+
+_logger = None
+
+def start(run_dir, config=None, use_wandb=True, flush_interval=1.0):
+    global _logger
+    finish()
+    _logger = ExperimentLogger(run_dir, config, use_wandb, flush_interval)
+    return _logger
+
+def log(metrics, step=None):
+    if _logger is not None:
+        _logger.log(metrics, step)
+
+def flush():
+    if _logger is not None:
+        _logger.flush()
+
+def finish():
+    global _logger
+    if _logger is not None:
+        _logger.close()
+        _logger = None
+
+def read_records(run_dir):
+    with open(os.path.join(run_dir, 'metrics.jsonl')) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def sync_to_wandb(run_dir, project, name=None):
+    # Replays a logged run into a new W&B run, in the original order. Marks the run as synced so it isn't uploaded twice.
+    synced_marker = os.path.join(run_dir, '.synced')
+    if os.path.exists(synced_marker):
+        print(f"{run_dir} is already synced")
+        return
+
+    with open(os.path.join(run_dir, 'config.json')) as f:
+        config = json.load(f)
+    run = wandb.init(project=project, name=name or os.path.basename(os.path.normpath(run_dir)), config=config)
+    records = read_records(run_dir)
+    for record in records:
+        wandb.log(_to_wandb({key: value for key, value in record.items() if not key.startswith('_')}))
+    run.finish()
+
+    with open(synced_marker, 'w') as f:
+        f.write(run.id)
+    print(f"Synced {len(records)} records of {run_dir} to W&B run {run.id}")
@@ -0,0 +1,76 @@
+import torch
+
+# Probes the largest (micro) batch size that fits in GPU memory for a given model.
+# It runs a full forward + backward pass on random inputs, doubling the batch size until it runs out of memory,
+# and then binary searches between the last size that fit and the first that didn't.
+# If even the start size doesn't fit, it halves down to the first size that does (raising only if batch size 1 doesn't).
+
+# Note: The result is an upper bound. The real training step also holds optimiser state and data loader
+#       prefetches, so a safety margin is taken off the final answer.
+
+def _fits_in_memory(model, batch_size, device, input_length):
+    try:
+        data = torch.rand(batch_size, 1, input_length, device=device)
+        outputs = model(data)
+
+        if isinstance(outputs, dict):
+            loss = sum(output.float().mean() for output in outputs.values())
+        else:
+            loss = outputs.float().mean()
+        loss.backward()
+        return True
+    except RuntimeError as e:  # torch.cuda.OutOfMemoryError is a subclass of RuntimeError
+        if "out of memory" not in str(e):
+            raise
+        return False
+    finally:
+        model.zero_grad(set_to_none=True)
+        if device.type == "cuda":
+            torch.cuda.empty_cache()
+
+def find_max_batch_size(model, device, input_length=3501, start_batch_size=32, max_batch_size=16384, safety_margin=0.9):
+    # There is no memory ceiling to probe on a CPU, so just use the start size.
+    if device.type != "cuda":
+        print(f"Batch size finder: no GPU found, using batch size {start_batch_size}")
+        return start_batch_size
+
+    was_training = model.training
+    model.train()
+
+    # Double until we run out of memory
+    low, high = 0, None
+    batch_size = start_batch_size
+    while batch_size <= max_batch_size:
+        if _fits_in_memory(model, batch_size, device, input_length):
+            low = batch_size
+            batch_size *= 2
+        else:
+            high = batch_size
+            break
+
+    # Start size too big: halve until something fits
+    while low == 0 and batch_size > 1:
+        batch_size //= 2
+        if _fits_in_memory(model, batch_size, device, input_length):
+            low = batch_size
+        else:
+            high = batch_size
+
+    if low == 0:
+        model.train(was_training)
+        raise RuntimeError("Batch size finder: even a batch size of 1 does not fit in memory")
+
+    # Binary search between the last fit and the first failure
+    if high is not None:
+        while high - low > max(1, low // 16):
+            mid = (low + high) // 2
+            if _fits_in_memory(model, mid, device, input_length):
+                low = mid
+            else:
+                high = mid
+
+    model.train(was_training)
+
+    batch_size = max(1, int(low * safety_margin))
+    print(f"Batch size finder: largest batch that fits is {low}, using {batch_size}")
+    return batch_size
@@ -0,0 +1,100 @@
+import os
+import copy
+import time
+import random
+import numpy as np
+import torch
+
+# Reproducible training runs, so that e.g. profiling comparisons between commits aren't swamped by run-to-run noise.
+# - seed_everything(): Python, NumPy and torch (CPU + CUDA) RNGs, before the model is built (weight init, dropout)
+# - a torch.Generator for the train DataLoader and its samplers: shuffling / sampling order, and the base seed of the workers
+# - seed_worker(): DataLoader worker_init_fn giving each worker's NumPy and Python RNGs its own seed (by default forked workers
+#   inherit identical NumPy state), derived from the generator, so it is reproducible too
+# - set_deterministic(): deterministic cuDNN / cuBLAS and torch.use_deterministic_algorithms. Slower, see measure_determinism_cost().
+
+def seed_everything(seed):
+    # Returns a generator for the DataLoader / samplers, seeded separately from the global RNG
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)   # Also seeds every CUDA device
+    return torch.Generator().manual_seed(seed)
+
+def seed_worker(worker_id):
+    # torch already seeds each worker with base_seed + worker_id (base_seed drawn from the DataLoader's generator)
+    worker_seed = torch.initial_seed() % 2**32
+    np.random.seed(worker_seed)
+    random.seed(worker_seed)
+
+def set_deterministic(enabled=True):
+    # cuBLAS needs a fixed workspace for deterministic results. It is read when CUDA initialises, so call this before any CUDA work.
+    if enabled:
+        os.environ.setdefault("CUBLAS_WORKSPACE_CONFIG", ":4096:8")
+    torch.backends.cudnn.deterministic = enabled
+    torch.backends.cudnn.benchmark = not enabled
+    # warn_only: ops without a deterministic implementation warn instead of stopping the run
+    torch.use_deterministic_algorithms(enabled, warn_only=True)
+
+def _rng_state():
+    return random.getstate(), np.random.get_state(), torch.get_rng_state(), torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None
+
+def _set_rng_state(state):
+    python_state, numpy_state, torch_state, cuda_state = state
+    random.setstate(python_state)
+    np.random.set_state(numpy_state)
+    torch.set_rng_state(torch_state)
+    if cuda_state is not None:
+        torch.cuda.set_rng_state_all(cuda_state)
+
+def _train_steps_per_second(model, criterion, batches, device):
+    # Forward + backward of every batch (no optimiser step), after one warm-up batch
+    def step(batch):
+        data, spg, crysystem, blt, composition = (tensor.to(device) for tensor in batch)
+        outputs = model(data.unsqueeze(1))
+        if isinstance(criterion, dict):
+            targets = {'spg': spg, 'crysystem': crysystem, 'blt': blt, 'composition': composition}
+            loss = sum(criterion[task](outputs[task], targets[task]) for task in criterion)
+        else:
+            loss = criterion(outputs, spg)
+        loss.backward()
+        model.zero_grad(set_to_none=True)
+
+    step(batches[0])
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    for batch in batches:
+        step(batch)
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    return sum(len(batch[0]) for batch in batches) / (time.perf_counter() - start)
+
+def measure_determinism_cost(model, criterion, loader, device, num_steps=20):
+    # Train step throughput (samples/s) of a copy of the model with and without deterministic algorithms, on num_steps batches
+    # of loader (held in memory, so loading isn't timed). RNG states are restored afterwards (the global ones and the loader's
+    # generator, which shuffling and the worker seeds draw from), so the run itself is unaffected.
+    # Returns {"nondeterministic_samples_per_second", "deterministic_samples_per_second", "deterministic_slowdown"}.
+    state = _rng_state()
+    generator = getattr(loader, 'generator', None)
+    generator_state = generator.get_state() if generator is not None else None
+    deterministic = torch.are_deterministic_algorithms_enabled()
+    batches = []
+    for batch in loader:
+        batches.append(batch)
+        if len(batches) == num_steps:
+            break
+
+    model_copy = copy.deepcopy(model).train()
+    results = {}
+    for enabled in (False, True):
+        set_deterministic(enabled)
+        results[enabled] = _train_steps_per_second(model_copy, criterion, batches, device)
+
+    set_deterministic(deterministic)
+    _set_rng_state(state)
+    if generator is not None:
+        generator.set_state(generator_state)
+    return {
+        "nondeterministic_samples_per_second": results[False],
+        "deterministic_samples_per_second": results[True],
+        "deterministic_slowdown": results[False] / results[True],
+    }
@@ -0,0 +1,139 @@
+import os
+import csv
+import json
+import time
+import fcntl
+import glob
+import shutil
+import hashlib
+import itertools
+import subprocess
+
+# SLURM job-array sweeps: every entry of a sweep is a dict of config_training overrides, run as one task of ONE array job.
+# - submit_sweep():   writes <sweep_dir>/sweep.json and job.sh, and submits job.sh with sbatch --array
+# - stage_dataset():  copies the databases and their preprocessed stores (<db>.labels.npz, <db>.intensity.npy, ...) to node-local
+#                     scratch ONCE per node. Tasks on the same node share the copy, co-ordinated with a lock file.
+# - cpu_allocation(): DataLoader workers and torch threads from --cpus-per-task
+# - gather_results(): collects the <sweep_dir>/results/task_<i>.json written by every task into results.csv
+
+def expand_grid(grid):
+    # {"LEARNING_RATE": [1e-3, 1e-4], "BATCH_SIZE": [32, 64]} -> the 4 override dicts of the product
+    keys = list(grid.keys())
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+def job_script(sweep_dir, num_tasks, slurm_options, setup_commands, repo_dir, max_concurrent=None):
+    array = f"0-{num_tasks - 1}" + (f"%{max_concurrent}" if max_concurrent else "")
+    lines = ["#!/bin/bash", f"#SBATCH --job-name=sweep_{os.path.basename(os.path.normpath(sweep_dir))}", f"#SBATCH --array={array}"]
+    lines += [f"#SBATCH --{key}={value}" for key, value in slurm_options.items()]
+    lines += [f"#SBATCH --output={os.path.join(os.path.abspath(sweep_dir), 'logs', 'task_%a.out')}", ""]
+    lines += list(setup_commands) + ["", f"cd {os.path.abspath(repo_dir)}", f"python -m scripts.training.run_sweep_task {os.path.abspath(sweep_dir)}", ""]
+    return "\n".join(lines)
+
+def submit_sweep(sweep, sweep_dir, slurm_options, setup_commands=(), repo_dir='.', max_concurrent=None, sbatch_command="sbatch"):
+    # Returns the array job id
+    os.makedirs(os.path.join(sweep_dir, 'logs'), exist_ok=True)
+    os.makedirs(os.path.join(sweep_dir, 'results'), exist_ok=True)
+    with open(os.path.join(sweep_dir, 'sweep.json'), 'w') as f:
+        json.dump({'tasks': sweep}, f, indent=2)
+
+    script_path = os.path.join(sweep_dir, 'job.sh')
+    with open(script_path, 'w') as f:
+        f.write(job_script(sweep_dir, len(sweep), slurm_options, setup_commands, repo_dir, max_concurrent))
+
+    output = subprocess.run(sbatch_command.split() + ["--parsable", script_path], check=True, capture_output=True, text=True).stdout
+    job_id = output.strip().split(';')[0]
+    with open(os.path.join(sweep_dir, 'job_id'), 'w') as f:
+        f.write(job_id)
+    return job_id
+
+def load_task(sweep_dir, task_id):
+    with open(os.path.join(sweep_dir, 'sweep.json')) as f:
+        return json.load(f)['tasks'][task_id]
+
+def cpu_allocation(num_cpus, cuda):
+    # -> (DataLoader workers, torch threads of the main process)
+    # With a GPU the main process mostly launches kernels, so all but one CPU load data.
+    # On CPU the main process does the compute, so it keeps most of the CPUs.
+    if cuda:
+        return max(num_cpus - 1, 0), 1
+    num_workers = max(num_cpus // 4, 1) if num_cpus > 1 else 0
+    return num_workers, max(num_cpus - num_workers, 1)
+
+def slurm_cpus(default=None):
+    return int(os.environ.get('SLURM_CPUS_PER_TASK', default or os.cpu_count() or 1))
+
+def _dataset_files(db_paths):
+    # Every database plus its preprocessed companions, which share its path as a prefix
+    return sorted(set(path for db_path in db_paths for path in glob.glob(glob.escape(db_path) + '*') if not path.endswith('.tmp') and os.path.isfile(path)))
+
+def _signature(files):
+    digest = hashlib.sha1()
+    for path in files:
+        stat = os.stat(path)
+        digest.update(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:16]
+
+def stage_dataset(db_paths, staging_root=None):
+    # Copies db_paths (and companions) to <staging_root>/xrd_data_<signature>/<i>/, one subdirectory per database (so e.g.
+    # train/data.db and val/data.db can't overwrite each other), and returns {db_path: staged path}.
+    # staging_root defaults to $TMPDIR (node-local scratch on most clusters). The first task on a node copies while
+    # holding the lock, the others wait for it and reuse the copy. A changed source file changes the signature, so stale copies are never used.
+    # copy2 keeps modification times, so the stores are still seen as up to date with their databases.
+    staging_root = staging_root or os.environ.get('TMPDIR', '/tmp')
+    sources = list(dict.fromkeys(db_paths))   # The same database may be given twice (e.g. VAL_DATA = TEST_DATA)
+    files = _dataset_files(sources)
+    stage_dir = os.path.join(staging_root, f"xrd_data_{_signature(files)}")
+    subdirs = {db_path: str(i) for i, db_path in enumerate(sources)}
+    staged = {db_path: os.path.join(stage_dir, subdirs[db_path], os.path.basename(db_path)) for db_path in sources}
+
+    os.makedirs(staging_root, exist_ok=True)
+    with open(stage_dir + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if os.path.exists(os.path.join(stage_dir, '.complete')):
+                print(f"Using dataset already staged in {stage_dir}")
+                return staged
+
+            start = time.perf_counter()
+            tmp_dir = stage_dir + '.tmp'
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+            for db_path in sources:
+                os.makedirs(os.path.join(tmp_dir, subdirs[db_path]))
+                for path in _dataset_files([db_path]):
+                    shutil.copy2(path, os.path.join(tmp_dir, subdirs[db_path], os.path.basename(path)))
+            open(os.path.join(tmp_dir, '.complete'), 'w').close()
+            os.replace(tmp_dir, stage_dir)
+            size = sum(os.path.getsize(path) for path in files)
+            print(f"Staged {len(files)} files ({size / 1e9:.2f} GB) to {stage_dir} in {time.perf_counter() - start:.1f} s")
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return staged
+
+def save_task_result(sweep_dir, task_id, result):
+    path = os.path.join(sweep_dir, 'results', f"task_{task_id}.json")
+    with open(path + '.tmp', 'w') as f:
+        json.dump(result, f, indent=2, default=float)
+    os.replace(path + '.tmp', path)
+
+def gather_results(sweep_dir):
+    # One row per task (overrides + final metrics), written to <sweep_dir>/results.csv. Missing tasks are listed as such.
+    with open(os.path.join(sweep_dir, 'sweep.json')) as f:
+        tasks = json.load(f)['tasks']
+
+    rows = []
+    for task_id, overrides in enumerate(tasks):
+        path = os.path.join(sweep_dir, 'results', f"task_{task_id}.json")
+        if not os.path.exists(path):
+            rows.append({'task': task_id, 'status': 'missing', **overrides})
+            continue
+        with open(path) as f:
+            result = json.load(f)
+        rows.append({'task': task_id, 'status': 'done', **overrides, **result.get('metrics', {}), 'model_path': result.get('model_path')})
+
+    columns = list(dict.fromkeys(key for row in rows for key in row))
+    with open(os.path.join(sweep_dir, 'results.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+import torch
+
+from src.data_loading.dedup import peak_bins, minhash_signatures, cluster_signatures, assign_splits, representatives
+
+# Synthetic near-duplicates: every base pattern (15 Gaussian peaks) has copies with each peak shifted independently by up to
+# 3 points, heights scaled by 0.7 - 1.3 and some noise. The default sketch / LSH settings must find the copies and keep
+# distinct patterns apart, and whole clusters must land in one split.
+
+def synthetic_patterns(num_bases=500, copies=4, max_shift=3, seed=0):
+    rng = np.random.default_rng(seed)
+    x = np.arange(3501)
+    patterns, base = [], []
+    for b in range(num_bases):
+        positions, heights = rng.uniform(50, 3450, 15), rng.uniform(5, 100, 15)
+        for copy in range(copies):
+            shifted = positions + (rng.integers(-max_shift, max_shift + 1, 15) if copy else 0)
+            scaled = heights * (rng.uniform(0.7, 1.3, 15) if copy else 1)
+            pattern = (scaled[:, None] * np.exp(-0.5 * ((x[None] - shifted[:, None]) / 2.0) ** 2)).sum(axis=0) + rng.uniform(0, 0.5, len(x))
+            patterns.append(100 * pattern / pattern.max())
+            base.append(b)
+    return torch.tensor(np.array(patterns), dtype=torch.float32), np.array(base)
+
+@pytest.fixture(scope="module")
+def clustered():
+    intensities, base = synthetic_patterns()
+    rows, bins = peak_bins(intensities)
+    return base, cluster_signatures(minhash_signatures(rows, bins, len(intensities)))
+
+def test_finds_near_duplicates(clustered):
+    base, cluster = clustered
+    same_base = base[:, None] == base[None, :]
+    same_cluster = cluster[:, None] == cluster[None, :]
+    pairs = same_base & ~np.eye(len(base), dtype=bool)
+    recall = (same_cluster & pairs).sum() / pairs.sum()
+    assert recall >= 0.99
+
+def test_merges_no_distinct_patterns(clustered):
+    base, cluster = clustered
+    assert not (cluster[:, None] == cluster[None, :])[base[:, None] != base[None, :]].any()
+
+def test_clusters_do_not_straddle_splits(clustered):
+    _, cluster = clustered
+    split = assign_splits(cluster)
+    for cluster_id in np.unique(cluster):
+        assert len(np.unique(split[cluster == cluster_id])) == 1
+    assert set(np.unique(split)) == {0, 1, 2}
+
+def test_representatives_keep_one_row_per_cluster(clustered):
+    _, cluster = clustered
+    train = np.flatnonzero(assign_splits(cluster) == 0)
+    kept = representatives(cluster, train)
+    assert len(kept) == len(np.unique(cluster[train]))
+    assert len(np.unique(cluster[kept])) == len(kept)
+
+def test_minhash_signatures():
+    # Rows 0 and 2 have the same set of bins (in another order), row 1 has no peaks
+    rows = np.array([0, 0, 0, 2, 2, 2])
+    bins = np.array([3, 7, 11, 11, 3, 7])
+    signatures = minhash_signatures(rows, bins, 3)
+    assert signatures.shape == (3, 64)
+    assert (signatures[0] == signatures[2]).all()
+    assert (signatures[1] == -1).all()
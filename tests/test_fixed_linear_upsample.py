@@ -0,0 +1,18 @@
+import torch
+import torch.nn.functional as F
+
+from src.models.CNN11 import FixedLinearUpsample
+
+# FixedLinearUpsample precomputes PyTorch's linear interpolation, so it must agree with F.interpolate up to float32 rounding.
+
+def test_matches_interpolate():
+    torch.manual_seed(0)
+    upsample = FixedLinearUpsample(3501, 8500)
+    x = torch.rand(64, 1, 3501)
+    expected = F.interpolate(x, size=8500, mode='linear', align_corners=False)
+    torch.testing.assert_close(upsample(x), expected, atol=1e-4, rtol=0)
+
+def test_other_input_lengths_fall_back_to_interpolate():
+    upsample = FixedLinearUpsample(3501, 8500)
+    x = torch.rand(2, 1, 1750)
+    torch.testing.assert_close(upsample(x), F.interpolate(x, size=8500, mode='linear', align_corners=False))
@@ -0,0 +1,28 @@
+import pytest
+import torch
+
+from src.training.callbacks import build_lr_scheduler, STEP_COUNT_FREE_SCHEDULERS
+
+# A TRAIN_STORE grows during training, so the run takes more optimiser steps than the schedule was sized for.
+# The schedulers allowed with it must keep training (LR > 0) on the extra steps.
+
+NUM_EPOCHS, STEPS_PER_EPOCH, WARMUP_STEPS = 4, 10, 5
+
+def lr_after_steps(scheduler_type, num_steps):
+    optimizer = torch.optim.SGD([torch.nn.Parameter(torch.zeros(1))], lr=0.1)
+    scheduler, _ = build_lr_scheduler(optimizer, scheduler_type, NUM_EPOCHS, STEPS_PER_EPOCH, WARMUP_STEPS)
+    for _ in range(num_steps):
+        optimizer.step()
+        scheduler.step()
+    return optimizer.param_groups[0]['lr']
+
+@pytest.mark.parametrize("scheduler_type", STEP_COUNT_FREE_SCHEDULERS)
+def test_lr_stays_positive_after_store_grows(scheduler_type):
+    # The store doubled after the first epoch
+    num_steps = STEPS_PER_EPOCH + (NUM_EPOCHS - 1) * 2 * STEPS_PER_EPOCH
+    assert lr_after_steps(scheduler_type, num_steps) > 0
+
+def test_cosine_is_not_allowed_with_a_growing_store():
+    # Sized from the starting length, cosine is at LR 0 well before the grown run ends
+    assert "cosine" not in STEP_COUNT_FREE_SCHEDULERS
+    assert lr_after_steps("cosine", NUM_EPOCHS * STEPS_PER_EPOCH) == pytest.approx(0)
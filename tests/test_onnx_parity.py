@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+import torch
+
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+from src.inference.onnx_export import export_to_onnx
+from src.inference.onnx_predictor import OnnxPredictor
+from src.inference.predictor import TorchPredictor
+from src.models.CNN10 import smallCNN10_MultiTask
+
+# ONNX Runtime must give the same logits as eager PyTorch for every multi-task head,
+# also for batch sizes other than the export batch (2), i.e. the batch axis really is dynamic.
+# Run from the repository root: python -m pytest tests
+
+@pytest.fixture(scope="module")
+def exported_model(tmp_path_factory):
+    torch.manual_seed(0)
+    model = smallCNN10_MultiTask().eval()
+    onnx_path = str(tmp_path_factory.mktemp("onnx") / "smallCNN10_MultiTask.onnx")
+    output_names = export_to_onnx(model, onnx_path)
+    return model, onnx_path, output_names
+
+def test_output_names(exported_model):
+    _, _, output_names = exported_model
+    assert output_names == ['spg', 'crysystem', 'blt', 'composition']
+
+@pytest.mark.parametrize("num_patterns, batch_size", [(2, 256), (1, 256), (7, 256), (13, 5)])
+def test_logits_match_pytorch(exported_model, num_patterns, batch_size):
+    model, onnx_path, output_names = exported_model
+    intensities = np.random.default_rng(num_patterns).random((num_patterns, 3501), dtype=np.float32) * 100
+
+    torch_outputs = TorchPredictor(model, torch.device("cpu"), batch_size=batch_size).predict(intensities)
+    onnx_outputs = OnnxPredictor(onnx_path, batch_size=batch_size).predict(intensities)
+
+    assert set(onnx_outputs) == set(output_names) == set(torch_outputs)
+    for task in output_names:
+        assert onnx_outputs[task].shape == torch_outputs[task].shape
+        np.testing.assert_allclose(onnx_outputs[task], torch_outputs[task], atol=1e-4, rtol=1e-3, err_msg=task)